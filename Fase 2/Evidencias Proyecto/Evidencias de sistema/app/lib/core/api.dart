@@ -3,6 +3,7 @@ import 'dart:convert';
 import 'package:http/http.dart' as http;
 import 'package:shared_preferences/shared_preferences.dart';
 import 'auth_state.dart';
+import 'paging.dart';
 
 class Api {
   // Usa SIEMPRE el mismo host que valida los JWT (backend Flask)
@@ -65,6 +66,7 @@ class Api {
   static Future<void> logout() async {
     await _prefs?.clear();
     authState.clear();
+    _etagCache.clear();
   }
 
   static Future<void> registerPushToken(String token, {String platform = 'android'}) async {
@@ -142,13 +144,13 @@ class Api {
   }
 
   // -------------------- Requests con retry 401 --------------------
-  static Future<http.Response> authedGet(Uri uri) async {
+  static Future<http.Response> authedGet(Uri uri, {Map<String, String>? headers}) async {
     await ensureValidToken();
-    var resp = await http.get(uri, headers: _headers());
+    var resp = await http.get(uri, headers: {..._headers(), ...?headers});
     if (resp.statusCode == 401) {
       final newTok = await _refreshAccessToken();
       if (newTok != null) {
-        resp = await http.get(uri, headers: _headers());
+        resp = await http.get(uri, headers: {..._headers(), ...?headers});
       }
     }
     return resp;
@@ -190,6 +192,53 @@ class Api {
     return resp;
   }
 
+  /// GET de UNA página por cursor: el siguiente cursor viene en el header
+  /// X-Next-Cursor (null en la última). Las pantallas piden la próxima al hacer scroll.
+  ///
+  /// Si el servidor manda ETag se guarda (ETag, cuerpo, cursor) por URL+usuario y en la
+  /// siguiente petición se revalida con If-None-Match: un 304 reutiliza lo guardado.
+  static const int pageSize = 30;
+  static const int _etagCacheMax = 64;
+  static final Map<String, _CachedPage> _etagCache = {}; // orden de inserción = LRU
+
+  static Future<ApiPage> _getPage(
+    Uri uri,
+    Future<http.Response> Function(Uri, Map<String, String>) get, {
+    String? cursor,
+    required String error,
+  }) async {
+    final params = {
+      ...uri.queryParameters,
+      'limit': '$pageSize',
+      if (cursor != null) 'cursor': cursor,
+    };
+    final u = uri.replace(queryParameters: params);
+    // el ETag del catálogo depende del usuario (is_favorited), así que la clave también
+    final key = '${authState.userId ?? 0} $u';
+    final cached = _etagCache.remove(key);
+
+    final r = await get(u, {if (cached != null) 'If-None-Match': cached.etag});
+    if (r.statusCode == 304 && cached != null) {
+      _etagCache[key] = cached;
+      return ApiPage(_decodeList(cached.body), cached.nextCursor);
+    }
+    if (r.statusCode != 200) throw Exception(error);
+
+    final next = r.headers['x-next-cursor'];
+    final etag = r.headers['etag'];
+    if (etag != null && etag.isNotEmpty) {
+      _etagCache[key] = _CachedPage(etag, r.body, next);
+      if (_etagCache.length > _etagCacheMax) {
+        _etagCache.remove(_etagCache.keys.first);
+      }
+    }
+    return ApiPage(_decodeList(r.body), next);
+  }
+
+  // copia nueva en cada llamada: las pantallas mutan los mapas (likes, is_favorited)
+  static List<Map<String, dynamic>> _decodeList(String body) =>
+      List<Map<String, dynamic>>.from(jsonDecode(body));
+
   // -------------------- Auth --------------------
   static Future<String?> login(String email, String pass) async {
     final r = await http.post(
@@ -236,22 +285,24 @@ class Api {
   /// - q.startsWith('@') => por nombre/email de artista
   /// - q normal          => por título/descr
   /// Si hay token, usa GET autenticado para obtener `is_favorited`.
-  static Future<List<Map<String, dynamic>>> getDesigns({int? artistId, String? q, bool bustCache = false}) async {
+  /// Revalida con ETag (ver _getPage): no hace falta romper caché con parámetros extra.
+  static Future<ApiPage> getDesigns({int? artistId, String? q, String? cursor}) async {
     final params = <String, String>{};
     if (artistId != null) params['artist_id'] = '$artistId';
     if (q != null && q.trim().isNotEmpty) params['q'] = q.trim();
-    if (bustCache) params['_ts'] = DateTime.now().microsecondsSinceEpoch.toString();
 
     final uri = Uri.parse('$base/designs')
         .replace(queryParameters: params.isEmpty ? null : params);
 
     final t = authState.token;
-    final r = (t == null || t.isEmpty)
-        ? await http.get(uri, headers: {'Cache-Control': 'no-cache'})
-        : await authedGet(uri);
-
-    if (r.statusCode != 200) throw Exception('No se pudo cargar el catálogo');
-    return List<Map<String, dynamic>>.from(jsonDecode(r.body));
+    return _getPage(
+      uri,
+      (u, h) => (t == null || t.isEmpty)
+          ? http.get(u, headers: {'Cache-Control': 'no-cache', ...h})
+          : authedGet(u, headers: h),
+      cursor: cursor,
+      error: 'No se pudo cargar el catálogo',
+    );
   }
 
   static Future<Map?> createDesign({
@@ -319,10 +370,9 @@ class Api {
     }
   }
 
-  static Future<List<Map<String,dynamic>>> myFavorites() async {
-    final r = await authedGet(Uri.parse('$base/favorites/me'));
-    if (r.statusCode != 200) throw Exception('Error al cargar favoritos');
-    return List<Map<String,dynamic>>.from(jsonDecode(r.body));
+  static Future<ApiPage> myFavorites({String? cursor}) async {
+    return _getPage(Uri.parse('$base/favorites/me'), (u, h) => authedGet(u, headers: h), cursor: cursor,
+        error: 'Error al cargar favoritos');
   }
 
   // -------------------- Artista --------------------
@@ -416,10 +466,10 @@ class Api {
     }
   }
 
-  static Future<List<Map<String, dynamic>>> myAppointments() async {
-    final r = await authedGet(Uri.parse('$base/appointments/me'));
-    if (r.statusCode != 200) throw Exception('Error al cargar reservas');
-    return List<Map<String, dynamic>>.from(jsonDecode(r.body));
+  static Future<ApiPage> myAppointments({String? cursor}) async {
+    return _getPage(Uri.parse('$base/appointments/me?expand=design,artist'),
+        (u, h) => authedGet(u, headers: h),
+        cursor: cursor, error: 'Error al cargar reservas');
   }
 
   static Future<void> markPaid(int id) async {
@@ -544,6 +594,29 @@ class Api {
   }
 
   // -------------------- Upload (imágenes para chat) --------------------
+  /// Sube los bytes tal cual (sin base64): el backend los escribe a disco por bloques.
+  static Future<String> uploadImageBytes(List<int> bytes) async {
+    await ensureValidToken();
+    final uri = Uri.parse('$base/upload/image');
+    Map<String, String> headers() =>
+        {..._headers(), 'Content-Type': 'application/octet-stream'};
+    var r = await http.post(uri, headers: headers(), body: bytes);
+    if (r.statusCode == 401) {
+      final newTok = await _refreshAccessToken();
+      if (newTok != null) {
+        r = await http.post(uri, headers: headers(), body: bytes);
+      }
+    }
+    if (r.statusCode != 200) {
+      throw Exception(_safeMsg(r.body) ?? 'Error subiendo imagen');
+    }
+    final m = jsonDecode(r.body) as Map<String, dynamic>;
+    final url = m['url'] as String?;
+    if (url == null || url.isEmpty) throw Exception('Respuesta inválida al subir imagen');
+    return url;
+  }
+
+  /// Compatibilidad: base64 dentro de JSON (más pesado; preferir uploadImageBytes).
   static Future<String> uploadImageBase64(String b64) async {
     final r = await authedPost(
       Uri.parse('$base/upload/image'),
@@ -559,6 +632,17 @@ class Api {
   }
 
   // -------------------- Utils --------------------
+  /// Variante liviana de la imagen (thumb | medium) si el backend la entrega;
+  /// si no, la image_url original.
+  static String? imageVariant(Map d, String variant) {
+    final v = d['image_variants'];
+    if (v is Map && v[variant] is String && (v[variant] as String).isNotEmpty) {
+      return v[variant] as String;
+    }
+    final u = d['image_url'];
+    return (u is String && u.isNotEmpty) ? u : null;
+  }
+
   static String? _safeMsg(String body) {
     try {
       final m = jsonDecode(body);
@@ -567,3 +651,11 @@ class Api {
     return null;
   }
 }
+
+/// Respuesta guardada para revalidar con If-None-Match.
+class _CachedPage {
+  final String etag;
+  final String body;
+  final String? nextCursor;
+  const _CachedPage(this.etag, this.body, this.nextCursor);
+}
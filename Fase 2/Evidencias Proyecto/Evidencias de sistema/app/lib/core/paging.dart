@@ -0,0 +1,80 @@
+// lib/core/paging.dart
+import 'package:flutter/widgets.dart';
+
+/// Una página de un listado por cursor (el backend manda el siguiente en X-Next-Cursor).
+class ApiPage {
+  final List<Map<String, dynamic>> items;
+  final String? nextCursor;
+  const ApiPage(this.items, this.nextCursor);
+}
+
+typedef PageFetcher = Future<ApiPage> Function(String? cursor);
+
+/// Lista paginada que pide la página siguiente recién cuando el usuario se acerca al final.
+/// Uso: ListenableBuilder(listenable: pages, ...) + NotificationListener(onNotification: pages.onScroll).
+class PagedList extends ChangeNotifier {
+  PagedList(this._fetch);
+
+  PageFetcher _fetch;
+  final List<Map<String, dynamic>> items = [];
+  Object? error;
+
+  String? _cursor;
+  bool _hasMore = true;
+  bool _loading = false;
+  int _generation = 0; // descarta respuestas que llegan después de un refresh (o del dispose)
+
+  bool get hasMore => _hasMore;
+  bool get loading => _loading;
+
+  /// Todavía no hay nada que mostrar (primera página en camino).
+  bool get firstLoad => items.isEmpty && error == null && _hasMore;
+
+  /// Vacía la lista y pide la primera página (opcionalmente con otro fetcher, p.ej. otra búsqueda).
+  Future<void> refresh([PageFetcher? fetch]) {
+    if (fetch != null) _fetch = fetch;
+    _generation++;
+    items.clear();
+    _cursor = null;
+    _hasMore = true;
+    _loading = false;
+    error = null;
+    notifyListeners();
+    return loadMore();
+  }
+
+  Future<void> loadMore() async {
+    if (_loading || !_hasMore) return;
+    final gen = _generation;
+    _loading = true;
+    notifyListeners();
+    try {
+      final page = await _fetch(_cursor);
+      if (gen != _generation) return;
+      items.addAll(page.items);
+      _cursor = page.nextCursor;
+      _hasMore = _cursor != null && _cursor!.isNotEmpty;
+      error = null;
+    } catch (e) {
+      if (gen != _generation) return;
+      error = e;
+    } finally {
+      if (gen == _generation) {
+        _loading = false;
+        notifyListeners();
+      }
+    }
+  }
+
+  @override
+  void dispose() {
+    _generation++;
+    super.dispose();
+  }
+
+  /// Para NotificationListener<ScrollNotification>: carga más cerca del final del scroll.
+  bool onScroll(ScrollNotification n) {
+    if (n.metrics.extentAfter < 800) loadMore();
+    return false;
+  }
+}
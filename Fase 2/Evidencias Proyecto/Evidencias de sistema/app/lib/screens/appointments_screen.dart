@@ -1,6 +1,7 @@
 import 'package:flutter/material.dart';
 import 'package:url_launcher/url_launcher.dart';
 import '../core/api.dart';
+import '../core/paging.dart';
 import '../core/auth_state.dart';
 import '../widgets/common.dart';
 import 'design_detail_screen.dart';
@@ -15,7 +16,7 @@ class AppointmentsScreen extends StatefulWidget {
 
 class _AppointmentsScreenState extends State<AppointmentsScreen>
     with WidgetsBindingObserver {
-  late Future<List<Map<String, dynamic>>> _future;
+  final _pages = PagedList((c) => Api.myAppointments(cursor: c));
 
   // --------- Estado para generar schedule (solo artista) ---------
   DateTime _schedFrom = DateTime.now().add(const Duration(days: 1));
@@ -38,7 +39,7 @@ class _AppointmentsScreenState extends State<AppointmentsScreen>
   void initState() {
     super.initState();
     WidgetsBinding.instance.addObserver(this);
-    _future = Api.myAppointments();
+    _pages.loadMore();
 
     if (authState.role == 'artist') {
       _slotsDay = DateTime.now();
@@ -49,6 +50,7 @@ class _AppointmentsScreenState extends State<AppointmentsScreen>
   @override
   void dispose() {
     WidgetsBinding.instance.removeObserver(this);
+    _pages.dispose();
     super.dispose();
   }
 
@@ -60,10 +62,7 @@ class _AppointmentsScreenState extends State<AppointmentsScreen>
   }
 
   Future<void> _refresh() async {
-    setState(() {
-      _future = Api.myAppointments();
-    });
-    await _future;
+    await _pages.refresh();
     if (authState.role == 'artist') {
       await _loadSlotsForDay();
     }
@@ -812,6 +811,21 @@ class _AppointmentsScreenState extends State<AppointmentsScreen>
 
   // ================== BUILD ==================
 
+  /// Última fila de la lista: spinner mientras llega la página siguiente, o reintento si falló.
+  Widget _buildMoreTile() {
+    return Padding(
+      padding: const EdgeInsets.all(16),
+      child: Center(
+        child: _pages.error != null
+            ? TextButton(
+                onPressed: _pages.loadMore,
+                child: const Text('Reintentar'),
+              )
+            : const CircularProgressIndicator(),
+      ),
+    );
+  }
+
   @override
   Widget build(BuildContext context) {
     final isArtist = authState.role == 'artist';
@@ -836,17 +850,18 @@ class _AppointmentsScreenState extends State<AppointmentsScreen>
             ),
         ],
       ),
-      body: FutureBuilder<List<Map<String, dynamic>>>(
-        future: _future,
-        builder: (context, snap) {
-          if (snap.connectionState != ConnectionState.done) {
+      body: ListenableBuilder(
+        listenable: _pages,
+        builder: (context, _) {
+          if (_pages.firstLoad) {
             return const Busy();
           }
-          if (snap.hasError) {
-            return Center(child: Text('Error: ${snap.error}'));
+          if (_pages.error != null && _pages.items.isEmpty) {
+            return Center(child: Text('Error: ${_pages.error}'));
           }
 
-          final items = snap.data ?? const <Map<String, dynamic>>[];
+          final items = _pages.items;
+          final extra = _pages.hasMore ? 1 : 0;
 
           if (!isArtist) {
             // --------- Vista cliente (simplificada) ---------
@@ -855,11 +870,15 @@ class _AppointmentsScreenState extends State<AppointmentsScreen>
             }
             return RefreshIndicator(
               onRefresh: _refresh,
-              child: ListView.separated(
-                itemCount: items.length,
-                separatorBuilder: (_, __) => const Divider(height: 1),
-                itemBuilder: (context, i) =>
-                    _buildItem(context, items[i], isArtist: false),
+              child: NotificationListener<ScrollNotification>(
+                onNotification: _pages.onScroll,
+                child: ListView.separated(
+                  itemCount: items.length + extra,
+                  separatorBuilder: (_, __) => const Divider(height: 1),
+                  itemBuilder: (context, i) => i < items.length
+                      ? _buildItem(context, items[i], isArtist: false)
+                      : _buildMoreTile(),
+                ),
               ),
             );
           }
@@ -887,12 +906,16 @@ class _AppointmentsScreenState extends State<AppointmentsScreen>
                             SizedBox(height: 16),
                           ],
                         )
-                      : ListView.separated(
-                          itemCount: items.length,
-                          separatorBuilder: (_, __) =>
-                              const Divider(height: 1),
-                          itemBuilder: (context, i) =>
-                              _buildItem(context, items[i], isArtist: true),
+                      : NotificationListener<ScrollNotification>(
+                          onNotification: _pages.onScroll,
+                          child: ListView.separated(
+                            itemCount: items.length + extra,
+                            separatorBuilder: (_, __) =>
+                                const Divider(height: 1),
+                            itemBuilder: (context, i) => i < items.length
+                                ? _buildItem(context, items[i], isArtist: true)
+                                : _buildMoreTile(),
+                          ),
                         ),
                 ),
               ),
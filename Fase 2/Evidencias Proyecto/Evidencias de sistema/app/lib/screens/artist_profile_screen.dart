@@ -1,5 +1,6 @@
 import 'package:flutter/material.dart';
 import '../core/api.dart';
+import '../core/paging.dart';
 import '../core/auth_state.dart';
 import '../widgets/common.dart';
 import 'design_detail_screen.dart';
@@ -24,21 +25,25 @@ class ArtistProfileScreen extends StatefulWidget {
 
 class _ArtistProfileScreenState extends State<ArtistProfileScreen> {
   late Future<Map<String, dynamic>> _fArtist;
-  late Future<List<Map<String, dynamic>>> _fDesigns;
+  late final PagedList _designs =
+      PagedList((c) => Api.getDesigns(artistId: widget.artistId, cursor: c));
 
   @override
   void initState() {
     super.initState();
-    _load();
+    _fArtist = Api.getArtist(widget.artistId);
+    _designs.loadMore();
   }
 
-  void _load() {
-    _fArtist = Api.getArtist(widget.artistId);
-    _fDesigns = Api.getDesigns(artistId: widget.artistId);
+  @override
+  void dispose() {
+    _designs.dispose();
+    super.dispose();
   }
 
   Future<void> _refresh() async {
-    setState(_load);
+    setState(() => _fArtist = Api.getArtist(widget.artistId));
+    await _designs.refresh();
   }
 
   Future<void> _toggleFav(Map<String, dynamic> d) async {
@@ -159,7 +164,10 @@ class _ArtistProfileScreenState extends State<ArtistProfileScreen> {
       ],
       child: RefreshIndicator(
         onRefresh: _refresh,
-        child: ListView(
+        // la grilla va dentro de este ListView: su scroll es el que pide la página siguiente
+        child: NotificationListener<ScrollNotification>(
+          onNotification: _designs.onScroll,
+          child: ListView(
           padding: const EdgeInsets.all(16),
           children: [
             // Encabezado artista
@@ -232,17 +240,16 @@ class _ArtistProfileScreenState extends State<ArtistProfileScreen> {
             const Gap(8),
 
             // Grilla de diseños del artista
-            FutureBuilder<List<Map<String, dynamic>>>(
-              future: _fDesigns,
-              builder: (_, snap) {
-                if (snap.connectionState != ConnectionState.done) {
+            ListenableBuilder(
+              listenable: _designs,
+              builder: (_, __) {
+                if (_designs.firstLoad) {
                   return const Busy();
                 }
-                if (snap.hasError) {
-                  return Text('Error: ${snap.error}');
+                if (_designs.error != null && _designs.items.isEmpty) {
+                  return Text('Error: ${_designs.error}');
                 }
-                final items =
-                    snap.data ?? const <Map<String, dynamic>>[];
+                final items = _designs.items;
                 if (items.isEmpty) {
                   return const Padding(
                     padding: EdgeInsets.symmetric(vertical: 32),
@@ -265,8 +272,18 @@ class _ArtistProfileScreenState extends State<ArtistProfileScreen> {
                     crossAxisSpacing: 12,
                     mainAxisSpacing: 12,
                   ),
-                  itemCount: items.length,
+                  itemCount: items.length + (_designs.hasMore ? 1 : 0),
                   itemBuilder: (_, i) {
+                    if (i >= items.length) {
+                      return Center(
+                        child: _designs.error != null
+                            ? TextButton(
+                                onPressed: _designs.loadMore,
+                                child: const Text('Reintentar'),
+                              )
+                            : const CircularProgressIndicator(),
+                      );
+                    }
                     final d = items[i];
                     return Card(
                       clipBehavior: Clip.antiAlias,
@@ -286,7 +303,7 @@ class _ArtistProfileScreenState extends State<ArtistProfileScreen> {
                               child: (d['image_url'] != null &&
                                       (d['image_url'] as String).isNotEmpty)
                                   ? Image.network(
-                                      d['image_url'],
+                                      Api.imageVariant(d, 'medium')!,
                                       fit: BoxFit.cover,
                                       errorBuilder: (_, __, ___) =>
                                           const ColoredBox(
@@ -399,6 +416,7 @@ class _ArtistProfileScreenState extends State<ArtistProfileScreen> {
               },
             ),
           ],
+          ),
         ),
       ),
     );
@@ -1,6 +1,7 @@
 import 'dart:async';
 import 'package:flutter/material.dart';
 import '../core/api.dart';
+import '../core/paging.dart';
 import '../core/auth_state.dart';
 import '../widgets/common.dart';
 import '../core/chat_api.dart';
@@ -19,7 +20,8 @@ class CatalogScreen extends StatefulWidget {
 }
 
 class _CatalogScreenState extends State<CatalogScreen> {
-  late Future<List<Map<String, dynamic>>> _future;
+  // catálogo paginado: la siguiente página se pide al acercarse al final del grid
+  final _pages = PagedList((c) => Api.getDesigns(cursor: c));
 
   // ---- Search ----
   final _qCtrl = TextEditingController();
@@ -33,7 +35,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
   @override
   void initState() {
     super.initState();
-    _future = Api.getDesigns();
+    _pages.loadMore();
     // Refresca UI del buscador mientras escribes (icono clear, etc.)
     _qCtrl.addListener(() {
       if (mounted) setState(() {});
@@ -46,6 +48,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
     _poll?.cancel();
     _debounce?.cancel();
     _qCtrl.dispose();
+    _pages.dispose();
     super.dispose();
   }
 
@@ -85,7 +88,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
     if (raw.isEmpty) {
       // mostrar TODO inmediatamente (sin esperar 250 ms)
       _currentQ = null;
-      setState(() => _future = Api.getDesigns());
+      _pages.refresh((c) => Api.getDesigns(cursor: c));
       return;
     }
   
@@ -111,18 +114,19 @@ class _CatalogScreenState extends State<CatalogScreen> {
       }
     }
     _currentQ = q;
-    setState(() => _future = Api.getDesigns(q: q));
+    _pages.refresh((c) => Api.getDesigns(q: q, cursor: c));
   }
 
   Future<void> _clearSearch() async {
     _qCtrl.clear();
     _currentQ = null;
-    setState(() => _future = Api.getDesigns());
+    _pages.refresh((c) => Api.getDesigns(cursor: c));
   }
 
   // ---- Acciones ----
-  Future<void> _refresh() async {
-    setState(() => _future = Api.getDesigns(q: _currentQ));
+  Future<void> _refresh() {
+    final q = _currentQ;
+    return _pages.refresh((c) => Api.getDesigns(q: q, cursor: c));
   }
 
   Future<void> _goCreateDesign() async {
@@ -242,16 +246,16 @@ class _CatalogScreenState extends State<CatalogScreen> {
 
           // ---- Lista / Grid ----
           Expanded(
-            child: FutureBuilder<List<Map<String, dynamic>>>(
-              future: _future,
-              builder: (_, snap) {
-                if (snap.connectionState != ConnectionState.done) return const Busy();
-                if (snap.hasError) {
-                  debugPrint('[Catalog] ERROR: ${snap.error}');
-                  return Center(child: Text('Error: ${snap.error}'));
+            child: ListenableBuilder(
+              listenable: _pages,
+              builder: (_, __) {
+                if (_pages.firstLoad) return const Busy();
+                if (_pages.error != null && _pages.items.isEmpty) {
+                  debugPrint('[Catalog] ERROR: ${_pages.error}');
+                  return Center(child: Text('Error: ${_pages.error}'));
                 }
 
-                final items = snap.data ?? const <Map<String, dynamic>>[];
+                final items = _pages.items;
 
                 if (items.isEmpty) {
                   return SafeArea(
@@ -277,7 +281,9 @@ class _CatalogScreenState extends State<CatalogScreen> {
                 return SafeArea(
                   child: RefreshIndicator(
                     onRefresh: _refresh,
-                    child: GridView.builder(
+                    child: NotificationListener<ScrollNotification>(
+                      onNotification: _pages.onScroll,
+                      child: GridView.builder(
                       physics: const AlwaysScrollableScrollPhysics(),
                       padding: const EdgeInsets.all(12),
                       gridDelegate: const SliverGridDelegateWithFixedCrossAxisCount(
@@ -286,8 +292,16 @@ class _CatalogScreenState extends State<CatalogScreen> {
                         crossAxisSpacing: 12,
                         mainAxisSpacing: 12,
                       ),
-                      itemCount: items.length,
+                      itemCount: items.length + (_pages.hasMore ? 1 : 0),
                       itemBuilder: (_, i) {
+                        // celda final: spinner mientras llega la página siguiente (o reintento)
+                        if (i >= items.length) {
+                          return Center(
+                            child: _pages.error != null
+                                ? TextButton(onPressed: _pages.loadMore, child: const Text('Reintentar'))
+                                : const CircularProgressIndicator(),
+                          );
+                        }
                         final d = items[i];
 
                         int likes = 0;
@@ -314,7 +328,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
                                   child: (d['image_url'] != null &&
                                           (d['image_url'] as String).isNotEmpty)
                                       ? Image.network(
-                                          d['image_url'],
+                                          Api.imageVariant(d, 'medium')!,
                                           fit: BoxFit.cover,
                                           errorBuilder: (_, __, ___) =>
                                               const ColoredBox(color: Color(0x11000000)),
@@ -478,6 +492,7 @@ class _CatalogScreenState extends State<CatalogScreen> {
                         );
                       },
                     ),
+                    ),
                   ),
                 );
               },
@@ -1,6 +1,5 @@
 // lib/screens/chat_screen.dart
 import 'dart:async';
-import 'dart:convert';
 import 'package:flutter/material.dart';
 import 'package:image_picker/image_picker.dart';
 
@@ -185,8 +184,7 @@ class _ChatScreenState extends State<ChatScreen> {
       if (x == null) return;
 
       final bytes = await x.readAsBytes();
-      final b64 = base64Encode(bytes);
-      final url = await Api.uploadImageBase64(b64);
+      final url = await Api.uploadImageBytes(bytes);
 
       _pendingImageUrl = url; // para aprender mi id tras el delta
 
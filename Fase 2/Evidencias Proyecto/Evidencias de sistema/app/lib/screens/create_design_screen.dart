@@ -1,5 +1,4 @@
 // lib/screens/create_design_screen.dart
-import 'dart:convert';
 
 import 'package:flutter/material.dart';
 import 'package:image_picker/image_picker.dart';
@@ -68,10 +67,9 @@ class _CreateDesignScreenState extends State<CreateDesignScreen> {
       });
 
       final bytes = await picked.readAsBytes();
-      final b64 = base64Encode(bytes);
 
-      // Usa el endpoint existente /upload/image
-      final url = await Api.uploadImageBase64(b64);
+      // Usa el endpoint existente /upload/image (bytes crudos, sin base64)
+      final url = await Api.uploadImageBytes(bytes);
 
       if (!mounted) return;
       setState(() {
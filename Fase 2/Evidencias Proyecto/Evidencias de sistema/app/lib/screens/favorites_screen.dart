@@ -1,5 +1,6 @@
 import 'package:flutter/material.dart';
 import '../core/api.dart';
+import '../core/paging.dart';
 import '../widgets/common.dart';
 import 'design_detail_screen.dart';
 
@@ -10,9 +11,10 @@ class FavoritesScreen extends StatefulWidget {
 }
 
 class _FavoritesScreenState extends State<FavoritesScreen> {
-  late Future<List<Map<String,dynamic>>> _f;
-  @override void initState(){ super.initState(); _f = Api.myFavorites(); }
-  Future<void> _refresh() async { setState(()=> _f = Api.myFavorites()); }
+  final _pages = PagedList((c)=> Api.myFavorites(cursor: c));
+  @override void initState(){ super.initState(); _pages.loadMore(); }
+  @override void dispose(){ _pages.dispose(); super.dispose(); }
+  Future<void> _refresh() => _pages.refresh();
 
   @override
   Widget build(BuildContext context){
@@ -20,20 +22,32 @@ class _FavoritesScreenState extends State<FavoritesScreen> {
       appBar: AppBar(title: const Text('Mis favoritos')),
       body: RefreshIndicator(
         onRefresh: _refresh,
-        child: FutureBuilder(
-          future: _f,
-          builder: (_, snap){
-            if (snap.connectionState != ConnectionState.done) return const Busy();
-            final items = (snap.data as List<Map<String,dynamic>>?) ?? [];
-            if (items.isEmpty) return const Center(child: Text('Sin favoritos aún'));
-            return ListView.separated(
-              itemCount: items.length,
+        child: ListenableBuilder(
+          listenable: _pages,
+          builder: (_, __){
+            if (_pages.firstLoad) return const Busy();
+            final items = _pages.items;
+            if (items.isEmpty) {
+              return Center(child: Text(_pages.error != null ? 'Error: ${_pages.error}' : 'Sin favoritos aún'));
+            }
+            return NotificationListener<ScrollNotification>(
+             onNotification: _pages.onScroll,
+             child: ListView.separated(
+              itemCount: items.length + (_pages.hasMore ? 1 : 0),
               separatorBuilder: (_, __)=> const Divider(height: 1),
               itemBuilder: (_, i){
+                if (i >= items.length) {
+                  return Padding(
+                    padding: const EdgeInsets.all(16),
+                    child: Center(child: _pages.error != null
+                      ? TextButton(onPressed: _pages.loadMore, child: const Text('Reintentar'))
+                      : const CircularProgressIndicator()),
+                  );
+                }
                 final d = items[i];
                 return ListTile(
                   leading: (d['image_url']!=null && (d['image_url'] as String).isNotEmpty)
-                    ? Image.network(d['image_url'], width: 56, height: 56, fit: BoxFit.cover)
+                    ? Image.network(Api.imageVariant(d, 'thumb')!, width: 56, height: 56, fit: BoxFit.cover)
                     : const SizedBox(width:56,height:56),
                   title: Text(d['title'] ?? '—'),
                   subtitle: Text('${d['artist_name'] ?? '—'} • ❤ ${d['likes_count'] ?? 0}'),
@@ -51,6 +65,7 @@ class _FavoritesScreenState extends State<FavoritesScreen> {
                     )),
                 );
               },
+             ),
             );
           },
         ),
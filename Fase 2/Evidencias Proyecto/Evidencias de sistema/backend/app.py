@@ -1,38 +1,125 @@
 import os, requests, mimetypes
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 from flask_cors import CORS
 import json
-from flask import Flask, jsonify, request, abort, Response, stream_with_context, redirect
+from flask import (
+    Flask, jsonify, request, abort, Response, stream_with_context, redirect, g, send_file, has_request_context
+)
+import click
 from flask_jwt_extended import (
-    JWTManager, create_access_token, create_refresh_token, get_jwt_identity, jwt_required
+    JWTManager, create_access_token, create_refresh_token, get_jwt, get_jwt_identity, jwt_required
 )
 from sqlalchemy import (
-    create_engine, and_, func, or_,  Column, Integer, String, DateTime, Boolean, ForeignKey, Text, UniqueConstraint
+    create_engine, and_, func, or_,  Column, Integer, String, DateTime, Boolean, ForeignKey, Text, UniqueConstraint,
+    Index, event, update, inspect, select, text as sql_text
 )
-from sqlalchemy.orm import joinedload, sessionmaker, declarative_base, relationship, scoped_session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.orm import joinedload, load_only, sessionmaker, declarative_base, relationship, scoped_session
 from dotenv import load_dotenv
 from time import sleep
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 # === NUEVO ===
 import base64
+import bisect
+import hashlib
+import io
 import pathlib
+import sqlite3
+import unicodedata
+import warnings
 # =============
+try:  # opcional: sin Pillow no se generan miniaturas (image_variants = None)
+    from PIL import Image, ImageOps, features as pil_features
+except ImportError:
+    Image = None
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "static/uploads")
 pathlib.Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(UPLOAD_DIR, "blobs"))  # archivos por SHA-256
 # =========================
 # Config & DB
 # =========================
 load_dotenv(".env", override=True)
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", "artattoo-5ba9b")
 SCOPES = ["https://www.googleapis.com/auth/firebase.messaging"]
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///tattoo.db")
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
-    echo=False,
-)
+
+# =========================
+# Motor de base de datos
+# =========================
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))      # seg. esperando conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))      # seg. (evita conexiones muertas en PG)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def normalize_db_url(url: str) -> str:
+    """Heroku/Render entregan postgres://, que SQLAlchemy 2 ya no acepta."""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+class TimedQueuePool(QueuePool):
+    """QueuePool que mide cuánto se espera por una conexión (ver /metrics: db_pool_wait_ms)."""
+    def _do_get(self):
+        t0 = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe("db_pool_wait_ms", (time.monotonic() - t0) * 1000)
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL: lectores no bloquean al escritor; busy_timeout: espera en vez de "database is locked"
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.close()
+
+def make_engine(url: str):
+    url = normalize_db_url(url)
+    if url.startswith("sqlite"):
+        if ":memory:" in url or url in ("sqlite://", "sqlite:///"):
+            # en memoria: cada conexión es una base distinta, así que todos los hilos
+            # comparten UNA sola conexión (StaticPool); el pool por defecto daría una por hilo
+            return create_engine(url, connect_args={"check_same_thread": False},
+                                 poolclass=StaticPool, echo=False)
+        eng = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+            poolclass=TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            echo=False,
+        )
+        event.listen(eng, "connect", _sqlite_pragmas)
+        return eng
+    return create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        echo=False,
+    )
+
+DATABASE_URL = normalize_db_url(os.getenv("DATABASE_URL", "sqlite:///tattoo.db"))
+engine = make_engine(DATABASE_URL)
 SessionLocal = scoped_session(sessionmaker(bind=engine))
 Base = declarative_base()
 
@@ -70,6 +157,58 @@ class DeviceToken(Base):
     platform = Column(String(20), nullable=True)  # 'android'|'ios'|'web'
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
+class PushOutbox(Base):
+    """Cola durable de pushes FCM pendientes (la drena PushDispatcher)."""
+    __tablename__ = "push_outbox"
+    id = Column(Integer, primary_key=True)
+    notification_id = Column(Integer, ForeignKey("notifications.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    title = Column(String(120), nullable=False)
+    body = Column(Text, nullable=False)
+    data_json = Column(Text, nullable=True)
+    tokens_json = Column(Text, nullable=True)  # None = todos los tokens del usuario; si no, solo los que fallaron
+    status = Column(String(20), default="pending", nullable=False)  # pending|sent|skipped|failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # también sirve de lease al reclamar
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_push_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+class AppCounter(Base):
+    """Contadores/versiones globales compartidos entre procesos (ej: versión del catálogo)."""
+    __tablename__ = "app_counters"
+    name = Column(String(60), primary_key=True)
+    value = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class Blob(Base):
+    """
+    Archivo subido/generado, guardado una sola vez por contenido (SHA-256) en BLOB_DIR.
+    refcount = filas que lo referencian (designs.image_url, chat_messages.image_url).
+    """
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True)
+    ext = Column(String(10), nullable=False)
+    mime = Column(String(60), nullable=False)
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, default=0, server_default="0", nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class BlobUpload(Base):
+    """
+    Quién subió cada blob (el mismo contenido puede venir de varios usuarios).
+    Sólo esos usuarios pueden referenciarlo desde un diseño o mensaje nuevo.
+    """
+    __tablename__ = "blob_uploads"
+    sha256 = Column(String(64), ForeignKey("blobs.sha256", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
@@ -87,6 +226,10 @@ class User(Base):
     mp_scope         = Column(String, nullable=True)
     mp_token_expires_at = Column(DateTime, nullable=True)
 
+    # Perfil de artista materializado (se mantiene al escribir diseños/favoritos)
+    designs_count = Column(Integer, default=0, server_default="0", nullable=False)
+    likes_total = Column(Integer, default=0, server_default="0", nullable=False)
+
 class Design(Base):
     __tablename__ = "designs"
     id = Column(Integer, primary_key=True)
@@ -96,9 +239,16 @@ class Design(Base):
     price = Column(Integer, nullable=True)   # en la moneda que definas (ej: CLP)
     artist_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    likes_count = Column(Integer, default=0, server_default="0", nullable=False)  # materializado
 
     artist = relationship("User", back_populates="designs")
 
+    __table_args__ = (
+        # paginación keyset del catálogo: ORDER BY created_at DESC, id DESC
+        Index("ix_designs_created_at_id", "created_at", "id"),
+        Index("ix_designs_artist_created_at_id", "artist_id", "created_at", "id"),
+    )
+
 
 class Appointment(Base):
     __tablename__ = "appointments"
@@ -122,6 +272,10 @@ class Appointment(Base):
     __table_args__ = (
         # Evita doble booking exacto mismo tramo (no perfecto, pero ayuda)
         UniqueConstraint('artist_id', 'start_time', name='uq_artist_slot'),
+        # choques de horario: artist_id = ? AND start_time < ? AND end_time > ?
+        Index("ix_appointments_artist_start_end", "artist_id", "start_time", "end_time"),
+        # agenda del cliente: client_id = ? ORDER BY start_time DESC, id DESC
+        Index("ix_appointments_client_start_id", "client_id", "start_time", "id"),
     )
 class Payment(Base):
     __tablename__ = "payments"
@@ -142,6 +296,10 @@ class ChatThread(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, index=True)
 
+    # No leídos por lado (desnormalizado; se mantiene al escribir, ver bump_unread)
+    artist_unread = Column(Integer, default=0, server_default="0", nullable=False)
+    client_unread = Column(Integer, default=0, server_default="0", nullable=False)
+
     __table_args__ = (
         UniqueConstraint('artist_id', 'client_id', name='uq_chat_pair'),
     )
@@ -163,6 +321,11 @@ class ChatMessage(Base):
     seen_by_client = Column(Boolean, default=False, index=True)
 
     thread = relationship("ChatThread")
+
+    __table_args__ = (
+        # cada página de historial = un range scan sobre (thread_id, id)
+        Index("ix_chat_messages_thread_id_id", "thread_id", "id"),
+    )
     sender = relationship("User")
 
 class Favorite(Base):
@@ -172,7 +335,11 @@ class Favorite(Base):
     design_id = Column(Integer, ForeignKey("designs.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    __table_args__ = (UniqueConstraint('user_id','design_id', name='uq_fav'),)
+    __table_args__ = (
+        UniqueConstraint('user_id','design_id', name='uq_fav'),
+        # /favorites/me pagina por (created_at, id) dentro del usuario
+        Index("ix_favorites_user_created_at_id", "user_id", "created_at", "id"),
+    )
 
 class TimeSlot(Base):
     __tablename__ = "time_slots"
@@ -193,32 +360,95 @@ class TimeSlot(Base):
     )
 
 
+def _add_missing_columns() -> set[tuple[str, str]]:
+    """
+    Migración mínima: create_all no altera tablas existentes, así que las
+    columnas nuevas de los modelos se agregan con ALTER TABLE (usando su
+    server_default). Devuelve las (tabla, columna) agregadas.
+    """
+    insp = inspect(engine)
+    added = set()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}"
+                if col.server_default is not None:
+                    ddl += f" DEFAULT {col.server_default.arg}"
+                    if not col.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(sql_text(ddl))
+                added.add((table.name, col.name))
+    return added
+
+def _add_missing_indexes():
+    """create_all tampoco crea índices nuevos en tablas que ya existían."""
+    for table in Base.metadata.sorted_tables:
+        for idx in table.indexes:
+            idx.create(bind=engine, checkfirst=True)
+
 def init_db():
+    added = _add_missing_columns()
     Base.metadata.create_all(bind=engine)
+    _add_missing_indexes()
+    search_index.setup()
+    if ("chat_threads", "artist_unread") in added:
+        db = SessionLocal()
+        try:
+            rebuild_chat_unread_counters(db)
+        finally:
+            db.close()
+    if ("designs", "likes_count") in added or ("users", "likes_total") in added:
+        db = SessionLocal()
+        try:
+            rebuild_like_counters(db)
+        finally:
+            db.close()
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Crea tablas/columnas faltantes."""
+    init_db()
 
 # =========================
 # Helpers
 # =========================
 def get_db():
+    # scoped_session: dentro de un request siempre es la MISMA sesión (decorador + handler)
     return SessionLocal()
 
+def new_db():
+    """
+    Sesión propia, NO la del hilo. Para helpers que hacen commit/close y pueden correr
+    en medio de otra unidad de trabajo (p.ej. dentro de PushDispatcher._dispatch_one):
+    cerrar get_db() ahí desconectaría los objetos del que llama.
+    """
+    return SessionLocal.session_factory()
+
+@app.teardown_appcontext
+def remove_db_session(exc=None):
+    SessionLocal.remove()
+
 def role_required(required_role):
     """Decorator para exigir rol específico en endpoints protegidos."""
     def wrapper(fn):
         @wraps(fn)
         @jwt_required()
         def inner(*args, **kwargs):
-            db = get_db()
-            try:
-                uid = get_jwt_identity()
-                user = db.get(User, int(uid))
-                if not user or user.role != required_role:
-                    return jsonify({"msg": "No autorizado para este recurso"}), 403
-                # inyectamos user en request context de forma simple
-                request.current_user = user
-                return fn(*args, **kwargs)
-            finally:
-                db.close()
+            # el rol viaja en el JWT (claim "role" de /auth/login): se rechaza sin tocar la DB
+            claim_role = get_jwt().get("role")
+            if claim_role is not None and claim_role != required_role:
+                return jsonify({"msg": "No autorizado para este recurso"}), 403
+            user = current_user()
+            if not user or user.role != required_role:
+                return jsonify({"msg": "No autorizado para este recurso"}), 403
+            # inyectamos user en request context de forma simple
+            request.current_user = user
+            return fn(*args, **kwargs)
         return inner
     return wrapper
 
@@ -228,22 +458,286 @@ def hash_pw(raw: str) -> str:
     import hashlib
     return hashlib.sha256(raw.encode()).hexdigest()
 
-def check_overlap(db, artist_id: int, start_time: datetime, end_time: datetime) -> bool:
-    """True si hay choque de hora para el artista."""
-    q = (
-        db.query(Appointment)
-        .filter(
-            Appointment.artist_id == artist_id,
-            Appointment.status == "booked",
-            Appointment.start_time < end_time,
-            Appointment.end_time > start_time,
-        )
+# Una cita ocupa la agenda salvo que esté cancelada o rechazada
+FREE_APPT_STATUSES = ("canceled", "rejected")
+OVERLAP_MAX_BATCH = 500
+
+def _busy_appointments_query(db, artist_id: int, start_time: datetime, end_time: datetime):
+    return db.query(Appointment.id, Appointment.start_time, Appointment.end_time).filter(
+        Appointment.artist_id == artist_id,
+        Appointment.status.notin_(FREE_APPT_STATUSES),
+        Appointment.start_time < end_time,
+        Appointment.end_time > start_time,
     )
+
+def check_overlap(db, artist_id: int, start_time: datetime, end_time: datetime) -> bool:
+    """True si hay choque de hora para el artista (usa ix_appointments_artist_start_end)."""
+    q = _busy_appointments_query(db, artist_id, start_time, end_time)
     return db.query(q.exists()).scalar()
 
+def _overlapping(intervals, start: datetime, end: datetime, starts: list, max_len: timedelta) -> list:
+    """
+    Índices de `intervals` (ordenados por inicio; `starts` = sus inicios) que chocan con [start, end).
+    Todo intervalo que termine después de `start` empezó después de `start - max_len`,
+    así que basta revisar la ventana [start - max_len, end) con bisect.
+    """
+    lo = bisect.bisect_right(starts, start - max_len)
+    hi = bisect.bisect_left(starts, end)
+    return [i for i in range(lo, hi) if intervals[i][2] > start]
+
+def find_overlaps(db, artist_id: int, intervals: list[tuple[datetime, datetime]]) -> list[dict]:
+    """
+    Valida muchos intervalos candidatos de un artista con UNA consulta.
+    Devuelve, por candidato (mismo orden): {"ok", "conflicts": [{"start_time", "end_time"}...],
+    "batch_conflicts": [índices de otros candidatos que se pisan con este]}.
+    Los choques van sólo como rangos horarios: los ids de citas ajenas no se exponen.
+    """
+    if not intervals:
+        return []
+    busy = _busy_appointments_query(
+        db, artist_id, min(s for s, _ in intervals), max(e for _, e in intervals)
+    ).order_by(Appointment.start_time.asc()).all()
+    busy_starts = [b[1] for b in busy]
+    busy_max = max((b[2] - b[1] for b in busy), default=timedelta(0))
+
+    cands = sorted(((s, i, e) for i, (s, e) in enumerate(intervals)), key=lambda c: c[0])
+    cand_starts = [c[0] for c in cands]
+    cand_max = max(e - s for s, e in intervals)
+
+    out = []
+    for idx, (s, e) in enumerate(intervals):
+        conflicts = [
+            {"start_time": busy[i][1].isoformat(), "end_time": busy[i][2].isoformat()}
+            for i in _overlapping(busy, s, e, busy_starts, busy_max)
+        ]
+        batch = sorted(
+            cands[i][1] for i in _overlapping(cands, s, e, cand_starts, cand_max) if cands[i][1] != idx
+        )
+        out.append({"ok": not conflicts, "conflicts": conflicts, "batch_conflicts": batch})
+    return out
+
+# =========================
+# Reservas atómicas
+# =========================
+BOOKING_MAX_RETRIES = int(os.getenv("BOOKING_MAX_RETRIES", "4"))
+BOOKING_RETRY_BASE_SECONDS = 0.05
+
+class BookingConflict(Exception):
+    """El horario/slot ya fue tomado: se responde 409."""
+
+_artist_locks = defaultdict(threading.Lock)
+_artist_locks_guard = threading.Lock()
+
+@contextmanager
+def artist_booking_lock(db, artist_id: int):
+    """
+    Serializa las reservas de un mismo artista mientras dura la transacción.
+    Postgres: SELECT ... FOR UPDATE sobre la fila del artista (se libera en commit/rollback).
+    SQLite no tiene bloqueo por fila: lock por artista dentro del proceso (evita esperas
+    inútiles entre hilos) + una escritura vacía que abre la transacción y toma el lock
+    RESERVED de la base, como BEGIN IMMEDIATE. Así el chequeo de solapamiento y el insert
+    quedan serializados también entre procesos (workers de gunicorn).
+    """
+    if engine.dialect.name == "sqlite":
+        with _artist_locks_guard:
+            lock = _artist_locks[artist_id]
+        with lock:
+            db.execute(sql_text("UPDATE users SET id = id WHERE id = :id"), {"id": artist_id})
+            yield
+    else:
+        db.query(User.id).filter(User.id == artist_id).with_for_update().one_or_none()
+        yield
+
+def run_booking(db, fn):
+    """
+    Ejecuta fn() (que debe hacer commit) con reintentos acotados ante bloqueos/deadlocks.
+    IntegrityError (uq_artist_slot) => BookingConflict. Si se agotan los reintentos
+    se re-lanza el OperationalError.
+    """
+    for attempt in range(BOOKING_MAX_RETRIES):
+        try:
+            return fn()
+        except IntegrityError:
+            db.rollback()
+            metrics.inc("booking_conflicts")
+            raise BookingConflict("Horario no disponible")
+        except BookingConflict:
+            db.rollback()
+            metrics.inc("booking_conflicts")
+            raise
+        except OperationalError:
+            db.rollback()
+            if attempt == BOOKING_MAX_RETRIES - 1:
+                raise
+            metrics.inc("booking_retries")
+            time.sleep(BOOKING_RETRY_BASE_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+def insert_ignore_duplicates(table, index_elements: list[str]):
+    """INSERT ... ON CONFLICT (index_elements) DO NOTHING según el motor (SQLite/Postgres)."""
+    if engine.dialect.name == "postgresql":
+        return pg_insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if engine.dialect.name == "sqlite":
+        return sqlite_insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    raise RuntimeError(f"ON CONFLICT no soportado en {engine.dialect.name}")
+
 def parse_dt(s: str) -> datetime:
-    # Espera ISO 8601 (ej: "2025-09-12T15:00:00")
-    return datetime.fromisoformat(s)
+    # Espera ISO 8601 (ej: "2025-09-12T15:00:00"). Con zona ("Z", "-03:00") se pasa
+    # a UTC naive, igual que las columnas DateTime: mezclar aware/naive rompe las comparaciones.
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+# === Paginación por cursor (keyset) ===
+# El cursor es "<timestamp ISO>|<id>" del último elemento de la página; el
+# siguiente cursor viaja en el header X-Next-Cursor para no cambiar el body.
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    return f"{ts.isoformat()}|{row_id}"
+
+def decode_cursor(raw: str) -> tuple[datetime, int]:
+    """Lanza ValueError si el cursor no es válido."""
+    ts, sep, row_id = (raw or "").partition("|")
+    if not sep:
+        raise ValueError("cursor inválido")
+    return datetime.fromisoformat(ts), int(row_id)
+
+def page_limit(default: int | None, maximum: int) -> int | None:
+    """Lee ?limit= acotado a [1, maximum]; None = sin límite (solo si default es None)."""
+    limit = request.args.get("limit", type=int)
+    if limit is None:
+        return default
+    return max(1, min(limit, maximum))
+
+# === Contadores de versión (invalidación de cachés entre procesos) ===
+def bump_counter(db, name: str):
+    """+1 al contador dentro de la transacción en curso (lo crea si no existe)."""
+    now = datetime.utcnow()
+    # crear con ON CONFLICT DO NOTHING: dos primeros bumps concurrentes no chocan en la PK
+    db.execute(insert_ignore_duplicates(AppCounter.__table__, ["name"])
+               .values(name=name, value=0, updated_at=now))
+    db.execute(
+        update(AppCounter)
+        .where(AppCounter.name == name)
+        .values(value=AppCounter.value + 1, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+def read_counter(db, name: str) -> tuple[int, datetime | None]:
+    row = db.get(AppCounter, name, populate_existing=True)
+    return (row.value, row.updated_at) if row else (0, None)
+
+class LRUCache:
+    """LRU thread-safe con TTL opcional (segundos) por entrada."""
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at | None, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# =========================
+# Usuario autenticado (cache)
+# =========================
+# El cache es POR PROCESO: invalidate_user sólo limpia el worker que hizo el cambio;
+# en los demás la entrada vieja vive a lo más USER_CACHE_TTL_SECONDS. (El rol además
+# viaja en el JWT, que role_required revisa primero, hasta que el token expira.)
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+class UserSnapshot:
+    """Datos mínimos del usuario autenticado; no está ligado a ninguna sesión."""
+    __slots__ = ("id", "role", "name", "email")
+
+    def __init__(self, id: int, role: str, name: str, email: str):
+        self.id = id
+        self.role = role
+        self.name = name
+        self.email = email
+
+user_cache = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+def invalidate_user(user_id: int):
+    """Llamar al cambiar rol/nombre/email o borrar un usuario (ver _invalidate_changed_users)."""
+    user_cache.pop(int(user_id))
+
+_SNAPSHOT_FIELDS = set(UserSnapshot.__slots__) - {"id"}
+
+@event.listens_for(SessionLocal.session_factory, "after_flush")
+def _collect_changed_users(session, _flush_context):
+    # cualquier handler que edite rol/nombre/email vía ORM (o borre el usuario) queda cubierto
+    changed = session.info.setdefault("changed_users", set())
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User) and any(
+            inspect(obj).attrs[f].history.has_changes() for f in _SNAPSHOT_FIELDS
+        ):
+            changed.add(obj.id)
+
+@event.listens_for(SessionLocal.session_factory, "after_commit")
+def _invalidate_changed_users(session):
+    # recién después del commit: antes, otro request podría volver a cachear el valor viejo
+    for uid in session.info.pop("changed_users", ()):
+        invalidate_user(uid)
+
+@event.listens_for(SessionLocal.session_factory, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("changed_users", None)
+
+def current_user() -> UserSnapshot | None:
+    """
+    Usuario del JWT actual, resuelto a lo más una vez por request (flask.g)
+    y cacheado entre requests por USER_CACHE_TTL_SECONDS.
+    """
+    if "current_user" in g:
+        return g.current_user
+    uid = int(get_jwt_identity())
+    snap = user_cache.get(uid)
+    if snap is None:
+        metrics.inc("user_cache_misses")
+        row = (
+            get_db().query(User.id, User.role, User.name, User.email)
+            .filter(User.id == uid)
+            .first()
+        )
+        snap = UserSnapshot(*row) if row else None
+        if snap:
+            user_cache.set(uid, snap)
+    else:
+        metrics.inc("user_cache_hits")
+    g.current_user = snap
+    return snap
 
 # === NUEVO: helpers de cuota y guardado ===
 def today_range_utc():
@@ -295,18 +789,434 @@ def notifications_test():
     finally:
         db.close()
 
+# =========================
+# Almacén de archivos por contenido (SHA-256)
+# =========================
+MEDIA_URL_RE = re.compile(r"/media/([0-9a-f]{64})(\.[a-z0-9]{1,5})$")
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# únicas extensiones que se guardan y se sirven: nada de svg/html desde el origen de la API
+RASTER_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+def sniff_image_ext(raw: bytes) -> str | None:
+    """Extensión según los magic bytes (no confía en el nombre del archivo)."""
+    if raw.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if raw[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if raw[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if raw[:4] == b"RIFF" and raw[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+def blob_path(sha: str) -> pathlib.Path:
+    # 2 niveles de carpetas para no juntar miles de archivos en un directorio
+    return pathlib.Path(BLOB_DIR).absolute() / sha[:2] / sha[2:4] / sha
+
+def public_base_url() -> str:
+    return os.getenv("PUBLIC_BASE_URL") or (request.host_url.rstrip("/") if has_request_context() else "")
+
+def media_url(sha: str, ext: str) -> str:
+    """URL inmutable: el contenido de /media/<sha> nunca cambia."""
+    return f"{public_base_url()}/media/{sha}{ext}"
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+class UploadTooLarge(Exception):
+    """El archivo supera UPLOAD_MAX_BYTES: se responde 413."""
+
+_pil_warnings_lock = threading.Lock()
+
+def open_image_limited(path):
+    """
+    Image.open que trata una imagen de más de IMAGE_MAX_PIXELS como error (ValueError),
+    también en el rango en que Pillow sólo avisa con DecompressionBombWarning. Los filtros
+    de warnings son globales del proceso: se cambian sólo acá, con lock y mientras dura el
+    open (que lee la cabecera), para no afectar al resto de la app.
+    """
+    with _pil_warnings_lock, warnings.catch_warnings():
+        warnings.simplefilter("error", Image.DecompressionBombWarning)
+        try:
+            im = Image.open(path)
+        except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+            raise ValueError(f"máximo {IMAGE_MAX_PIXELS} píxeles") from None
+    if im.width * im.height > IMAGE_MAX_PIXELS:
+        im.close()
+        raise ValueError(f"máximo {IMAGE_MAX_PIXELS} píxeles")
+    return im
+
+def _check_decodable(path: pathlib.Path):
+    """
+    Con Pillow, además de los magic bytes exige que la cabecera se pueda leer y que la
+    imagen no pase de IMAGE_MAX_PIXELS (un PNG de pocos MB puede descomprimir a cientos).
+    """
+    if Image is None:
+        return
+    try:
+        with open_image_limited(path) as im:
+            im.verify()
+    except Exception as e:
+        raise ValueError(f"imagen inválida: {e}") from None
+
+def put_blob_stream(stream, max_bytes: int | None = None, uploader_id: int | None = None) -> tuple[str, str]:
+    """
+    Copia `stream` a disco por bloques calculando el SHA-256 al vuelo (memoria constante),
+    deduplica contra BLOB_DIR y registra la fila en blobs (y en blob_uploads si hay
+    `uploader_id`). Devuelve (sha256, ext). El registro va en una sesión propia con su
+    commit: la del que llama no se toca.
+    La extensión sale SOLO de los magic bytes (nunca del nombre ni del Content-Type).
+    Lanza UploadTooLarge si se pasa de `max_bytes` y ValueError si viene vacío o no es
+    una imagen png/jpg/gif/webp (en ambos casos no queda nada escrito).
+    """
+    if max_bytes is None:
+        max_bytes = UPLOAD_MAX_BYTES
+    incoming = pathlib.Path(BLOB_DIR).absolute() / "incoming"
+    incoming.mkdir(parents=True, exist_ok=True)
+    tmp = incoming / f"{os.getpid()}.{threading.get_ident()}.{time.monotonic_ns()}.tmp"
+    h = hashlib.sha256()
+    size = 0
+    head = b""
+    try:
+        with open(tmp, "wb") as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"máximo {max_bytes} bytes")
+                if len(head) < 16:
+                    head = (head + chunk)[:16]
+                h.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise ValueError("archivo vacío")
+        ext = sniff_image_ext(head)
+        if ext is None:
+            raise ValueError("no es una imagen png/jpg/gif/webp")
+        _check_decodable(tmp)
+        sha = h.hexdigest()
+        # primero la fila (last_used_at = ahora, con commit) y recién después el archivo:
+        # desde ese commit gc_blobs ya no puede borrar este sha, y si la fila venía de un
+        # GC en curso el INSERT espera a que termine, así que path.exists() es confiable
+        reg = new_db()
+        try:
+            sha, ext = _register_blob(reg, sha, ext, size, uploader_id)
+            reg.commit()
+        finally:
+            reg.close()
+        path = blob_path(sha)
+        if path.exists():
+            metrics.inc("blob_dedup_hits")
+        else:
+            # archivo nuevo, o fila que existía pero cuyo archivo se perdió: se (re)escribe
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, path)  # atómico: nunca se sirve un archivo a medio escribir
+            metrics.inc("blob_writes")
+    finally:
+        tmp.unlink(missing_ok=True)
+    if ext in RASTER_EXTS:
+        image_pipeline.submit(sha)  # miniaturas en segundo plano
+    return sha, ext
+
+def upload_too_large():
+    return jsonify({"msg": f"Imagen demasiado grande (máx {UPLOAD_MAX_BYTES // (1024 * 1024)} MB)"}), 413
+
+def put_blob(raw: bytes, uploader_id: int | None = None) -> tuple[str, str]:
+    """Igual que put_blob_stream, para bytes que ya están en memoria (sin tope)."""
+    return put_blob_stream(io.BytesIO(raw), max_bytes=len(raw), uploader_id=uploader_id)
+
+def _register_blob(db, sha: str, ext: str, size: int, uploader_id: int | None = None) -> tuple[str, str]:
+    """Crea/renueva la fila del blob (y anota quién lo subió). Sin commit."""
+    now = datetime.utcnow()
+    db.execute(insert_ignore_duplicates(Blob.__table__, ["sha256"]).values(
+        sha256=sha, ext=ext, mime=mimetypes.types_map.get(ext, "application/octet-stream"),
+        size=size, refcount=0, created_at=now, last_used_at=now,
+    ))
+    db.execute(update(Blob).where(Blob.sha256 == sha).values(last_used_at=now)
+               .execution_options(synchronize_session=False))
+    if uploader_id is not None:
+        db.execute(insert_ignore_duplicates(BlobUpload.__table__, ["sha256", "user_id"])
+                   .values(sha256=sha, user_id=uploader_id, created_at=now))
+    ext = db.query(Blob.ext).filter(Blob.sha256 == sha).scalar() or ext
+    return sha, ext
+
+def _blob_sha_from_url(url: str | None) -> str | None:
+    m = MEDIA_URL_RE.search(url or "")
+    return m.group(1) if m else None
+
+def can_reference_blob(db, url: str | None, user_id: int, current: str | None = None) -> bool:
+    """
+    ¿Puede `user_id` guardar `url` en un diseño/mensaje? Las URLs /media/... sólo si él
+    subió ese blob o si la entidad ya lo referenciaba (`current`); si no, cualquiera podría
+    fijar (refcount) blobs ajenos y el GC nunca los borraría. URLs externas: sí.
+    """
+    sha = _blob_sha_from_url(url)
+    if not sha or sha == _blob_sha_from_url(current):
+        return True
+    return db.query(BlobUpload.sha256).filter(
+        BlobUpload.sha256 == sha, BlobUpload.user_id == user_id).first() is not None
+
+def adjust_blob_refcount(db, url: str | None, delta: int):
+    """+1/-1 al blob de una URL /media/...; URLs externas o antiguas se ignoran. Sin commit."""
+    sha = _blob_sha_from_url(url)
+    if sha:
+        db.execute(update(Blob).where(Blob.sha256 == sha)
+                   .values(refcount=Blob.refcount + delta, last_used_at=datetime.utcnow())
+                   .execution_options(synchronize_session=False))
+
+def recount_blob_refs(db) -> int:
+    """Recalcula refcount desde las URLs guardadas en designs y chat_messages."""
+    counts = defaultdict(int)
+    for col in (Design.image_url, ChatMessage.image_url):
+        for (url,) in db.query(col).filter(col.like("%/media/%")).yield_per(1000):
+            sha = _blob_sha_from_url(url)
+            if sha:
+                counts[sha] += 1
+    db.execute(update(Blob).values(refcount=0).execution_options(synchronize_session=False))
+    for sha, n in counts.items():
+        db.execute(update(Blob).where(Blob.sha256 == sha).values(refcount=n)
+                   .execution_options(synchronize_session=False))
+    db.commit()
+    return len(counts)
+
+def gc_blobs(db, min_age: timedelta) -> tuple[int, int]:
+    """
+    Borra blobs sin referencias que no se usan hace más de `min_age` (el margen protege
+    subidas recientes que aún no se guardan en un diseño/mensaje). Devuelve (filas, bytes).
+    """
+    cutoff = datetime.utcnow() - min_age
+    candidates = db.query(Blob.sha256, Blob.size).filter(Blob.refcount <= 0, Blob.last_used_at < cutoff).all()
+    db.commit()
+    deleted = freed = 0
+    for sha, size in candidates:
+        # la condición se vuelve a evaluar en el DELETE: si un put_blob* o una referencia
+        # nueva tocó la fila desde la lectura, rowcount = 0 y el archivo no se toca
+        removed = db.query(Blob).filter(
+            Blob.sha256 == sha, Blob.refcount <= 0, Blob.last_used_at < cutoff
+        ).delete(synchronize_session=False)
+        if removed != 1:
+            db.rollback()
+            continue
+        db.query(BlobUpload).filter(BlobUpload.sha256 == sha).delete(synchronize_session=False)
+        # se borra el archivo ANTES del commit: la fila queda bloqueada y un put_blob*
+        # concurrente del mismo sha espera y luego reescribe el archivo
+        try:
+            blob_path(sha).unlink()
+            freed += size
+        except FileNotFoundError:
+            pass
+        for name in IMAGE_VARIANTS:
+            variant_path(sha, name).unlink(missing_ok=True)
+        db.commit()
+        deleted += 1
+    # restos de escrituras interrumpidas
+    for tmp in pathlib.Path(BLOB_DIR).glob("incoming/*.tmp"):
+        if datetime.utcfromtimestamp(tmp.stat().st_mtime) < cutoff:
+            tmp.unlink(missing_ok=True)
+    return deleted, freed
+
+@app.cli.command("gc-blobs")
+@click.option("--min-age-hours", default=24, show_default=True, help="Margen para subidas recientes.")
+@click.option("--recount/--no-recount", default=True, show_default=True,
+              help="Recalcular refcount desde designs/chat_messages antes de borrar.")
+def gc_blobs_command(min_age_hours, recount):
+    """Elimina archivos de /media que ya nadie referencia."""
+    db = get_db()
+    try:
+        if recount:
+            print(f"blobs referenciados: {recount_blob_refs(db)}")
+        n, freed = gc_blobs(db, timedelta(hours=min_age_hours))
+        print(f"blobs eliminados: {n} ({freed / 1024 / 1024:.1f} MB)")
+    finally:
+        db.close()
+
+@app.get("/media/<string:name>")
+def serve_media(name):
+    m = MEDIA_URL_RE.search("/media/" + name)
+    if not m or m.group(2) not in RASTER_EXTS:
+        abort(404)
+    sha, ext = m.groups()
+    etag = f'"{sha}"'
+    if request.headers.get("If-None-Match") == etag:
+        resp = Response(status=304)
+    else:
+        path = blob_path(sha)
+        if not path.exists():
+            abort(404)
+        resp = send_file(path, mimetype=mimetypes.types_map.get(ext, "application/octet-stream"),
+                         conditional=False, etag=False)
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = MEDIA_CACHE_CONTROL
+    resp.headers["X-Content-Type-Options"] = "nosniff"
+    return resp
+
+# =========================
+# Miniaturas / variantes responsivas
+# =========================
+IMAGE_VARIANTS = {"thumb": 256, "medium": 800}  # lado mayor en px
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_VARIANT_WAIT_SECONDS = 20
+# tope de píxeles al decodificar (40 MP ~ 160 MB en RGBA): open_image_limited lo trata
+# como error y las subidas más grandes se rechazan con 400 (_check_decodable)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+if Image is not None:
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+if Image is not None and pil_features.check("webp"):
+    VARIANT_FORMAT, VARIANT_EXT = "WEBP", "webp"
+else:
+    VARIANT_FORMAT, VARIANT_EXT = "JPEG", "jpg"
+VARIANT_NAME_RE = re.compile(r"^([0-9a-f]{64})\." + VARIANT_EXT + r"$")
+
+def variant_path(sha: str, variant: str) -> pathlib.Path:
+    return blob_path(sha).with_name(f"{sha}.{variant}.{VARIANT_EXT}")
+
+def image_variants(url: str | None) -> dict | None:
+    """URLs de thumb/medium para una imagen /media/...; None si no aplica (URL externa, sin Pillow)."""
+    if Image is None:
+        return None
+    m = MEDIA_URL_RE.search(url or "")
+    if not m or m.group(2) not in RASTER_EXTS:
+        return None
+    prefix, sha = url[:m.start()], m.group(1)
+    return {name: f"{prefix}/media/{name}/{sha}.{VARIANT_EXT}" for name in IMAGE_VARIANTS}
+
+class ImageVariantPipeline:
+    """Genera las variantes de un blob en un pool acotado; un solo trabajo en curso por sha."""
+    def __init__(self, workers: int):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="img")
+        self._lock = threading.Lock()
+        self._inflight = {}  # sha -> Future
+
+    def submit(self, sha: str):
+        if Image is None:
+            return None
+        with self._lock:
+            fut = self._inflight.get(sha)
+            created = fut is None
+            if created:
+                fut = self._inflight[sha] = self._pool.submit(self._build, sha)
+        if created:
+            fut.add_done_callback(lambda _f: self._forget(sha))
+        return fut
+
+    def pending(self, sha: str):
+        """Future del trabajo en curso para `sha` (o None); no encola nada."""
+        with self._lock:
+            return self._inflight.get(sha)
+
+    def _forget(self, sha: str):
+        with self._lock:
+            self._inflight.pop(sha, None)
+
+    def _build(self, sha: str):
+        todo = {name: side for name, side in IMAGE_VARIANTS.items() if not variant_path(sha, name).exists()}
+        if not todo:
+            return
+        t0 = time.monotonic()
+        with open_image_limited(blob_path(sha)) as im:
+            if im.format == "JPEG":
+                # el decoder JPEG escala en DCT: no se materializa la foto a tamaño completo
+                im.draft("RGB", (max(todo.values()),) * 2)
+            im = ImageOps.exif_transpose(im)
+            has_alpha = im.mode in ("RGBA", "LA", "P") and VARIANT_FORMAT == "WEBP"
+            im = im.convert("RGBA" if has_alpha else "RGB")
+            for name, side in todo.items():
+                v = im.copy()
+                v.thumbnail((side, side), Image.LANCZOS)  # nunca agranda
+                out = variant_path(sha, name)
+                tmp = out.with_name(f"{out.name}.{threading.get_ident()}.tmp")
+                if VARIANT_FORMAT == "WEBP":
+                    v.save(tmp, VARIANT_FORMAT, quality=80, method=4)
+                else:
+                    v.save(tmp, VARIANT_FORMAT, quality=82, optimize=True, progressive=True)
+                os.replace(tmp, out)
+        metrics.inc("image_variants_built")
+        metrics.observe("image_variant_ms", (time.monotonic() - t0) * 1000)
+
+image_pipeline = ImageVariantPipeline(IMAGE_WORKERS)
+
+@app.get("/media/<variant>/<string:name>")
+def serve_media_variant(variant, name):
+    m = VARIANT_NAME_RE.match(name)
+    if variant not in IMAGE_VARIANTS or not m or Image is None:
+        abort(404)
+    sha = m.group(1)
+    etag = f'"{sha}-{variant}"'
+    if request.headers.get("If-None-Match") == etag:
+        resp = Response(status=304)
+    else:
+        path = variant_path(sha, variant)
+        if not path.exists():
+            # las variantes se generan al subir (put_blob_stream) o con build-image-variants;
+            # un GET anónimo nunca dispara un decode, a lo más espera el trabajo ya encolado
+            fut = image_pipeline.pending(sha)
+            if fut is not None:
+                try:
+                    fut.result(timeout=IMAGE_VARIANT_WAIT_SECONDS)
+                except Exception as e:
+                    print("image variant error:", sha, repr(e))
+            if not path.exists():
+                db = get_db()
+                try:
+                    ext = db.query(Blob.ext).filter(Blob.sha256 == sha).scalar()
+                finally:
+                    db.close()
+                if ext not in RASTER_EXTS:
+                    abort(404)
+                metrics.inc("image_variant_fallbacks")
+                return redirect(media_url(sha, ext), code=307)  # el original mientras tanto
+        resp = send_file(path, mimetype=mimetypes.types_map[f".{VARIANT_EXT}"], conditional=False, etag=False)
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = MEDIA_CACHE_CONTROL
+    resp.headers["X-Content-Type-Options"] = "nosniff"
+    return resp
+
+@app.cli.command("build-image-variants")
+def build_image_variants_command():
+    """Genera miniaturas para los blobs de imagen que aún no las tienen."""
+    if Image is None:
+        print("Pillow no está instalado")
+        return
+    db = get_db()
+    try:
+        shas = [sha for sha, ext in db.query(Blob.sha256, Blob.ext) if ext in RASTER_EXTS]
+    finally:
+        db.close()
+    futures = [image_pipeline.submit(sha) for sha in shas]
+    failed = 0
+    for fut in futures:
+        try:
+            fut.result()
+        except Exception:
+            failed += 1
+    print(f"blobs procesados: {len(shas)} (fallidos: {failed})")
+
 def save_base64_png(b64_str: str, user_id: int) -> str:
     """
-    Guarda el base64 (PNG) en IMAGE_SAVE_DIR y devuelve URL pública.
+    Guarda el base64 (PNG) en el almacén de blobs y devuelve URL pública.
     """
     raw = base64.b64decode(b64_str)
-    ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
-    filename = f"user{user_id}_{ts}.png"
-    out_path = pathlib.Path(IMAGE_SAVE_DIR) / filename
-    out_path.write_bytes(raw)
-    # arma URL pública. Con Flask dev, /static se sirve por defecto.
-    rel = str(out_path).replace("\\", "/")
-    return f"{PUBLIC_BASE_URL}/{rel}"
+    sha, ext = put_blob(raw, uploader_id=user_id)
+    return media_url(sha, ext)
+def chat_message_payload(m: ChatMessage) -> dict:
+    return {
+        "id": m.id,
+        "sender_id": m.sender_id,
+        "text": m.text,
+        "image_url": m.image_url,
+        "image_variants": image_variants(m.image_url),
+        "created_at": m.created_at.isoformat()
+    }
+
+def publish_chat_message(m: ChatMessage):
+    """Emite el mensaje (ya commiteado) a los SSE abiertos del hilo."""
+    try:
+        broker.publish(chat_channel(m.thread_id), chat_message_payload(m))
+    except Exception as e:
+        print("broker publish error:", e)
+
 def ensure_pair_is_artist_client(db, uid_a: int, uid_b: int):
     """
     Devuelve (artist_id, client_id) si la pareja es válida, o (None, None) si no.
@@ -321,6 +1231,49 @@ def ensure_pair_is_artist_client(db, uid_a: int, uid_b: int):
         return (b.id, a.id)
     return (None, None)
 
+def bump_unread(th: ChatThread, sender_id: int):
+    """
+    Suma 1 al contador de no leídos del lado que NO envió (el bot no es
+    ninguno de los dos, así que suma a ambos). Se aplica como expresión SQL
+    (col = col + 1) en el UPDATE del commit, así dos envíos simultáneos no se pisan.
+    """
+    if sender_id != th.artist_id:
+        th.artist_unread = ChatThread.artist_unread + 1
+    if sender_id != th.client_id:
+        th.client_unread = ChatThread.client_unread + 1
+
+def rebuild_chat_unread_counters(db, thread_ids: list[int] | None = None) -> int:
+    """Recalcula artist_unread/client_unread desde chat_messages. Devuelve filas tocadas."""
+    def unread_for(side_id, seen_col):
+        return (
+            select(func.count(ChatMessage.id))
+            .where(
+                ChatMessage.thread_id == ChatThread.id,
+                ChatMessage.sender_id != side_id,
+                seen_col == False,
+            )
+            .scalar_subquery()
+        )
+    stmt = update(ChatThread).values(
+        artist_unread=unread_for(ChatThread.artist_id, ChatMessage.seen_by_artist),
+        client_unread=unread_for(ChatThread.client_id, ChatMessage.seen_by_client),
+    )
+    if thread_ids is not None:
+        stmt = stmt.where(ChatThread.id.in_(thread_ids))
+    res = db.execute(stmt.execution_options(synchronize_session=False))
+    db.commit()
+    return res.rowcount
+
+@app.cli.command("rebuild-chat-unread")
+def rebuild_chat_unread_command():
+    """Reconstruye los contadores de no leídos de todos los hilos."""
+    db = get_db()
+    try:
+        n = rebuild_chat_unread_counters(db)
+        print(f"hilos recalculados: {n}")
+    finally:
+        db.close()
+
 def thread_for_pair(db, artist_id: int, client_id: int) -> ChatThread | None:
     return (
         db.query(ChatThread)
@@ -328,60 +1281,305 @@ def thread_for_pair(db, artist_id: int, client_id: int) -> ChatThread | None:
         .one_or_none()
     )
 
+# =========================
+# Métricas (expuestas en /metrics)
+# =========================
+class Metrics:
+    """Contadores, observaciones (count/sum/max) y gauges calculados al leer."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._observations = {}
+        self._gauges = {}
+
+    def inc(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            o = self._observations.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            o["count"] += 1
+            o["sum"] += value
+            o["max"] = max(o["max"], value)
+
+    def gauge(self, name: str, fn):
+        self._gauges[name] = fn
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = dict(self._counters)
+            for name, o in self._observations.items():
+                out[name] = {**o, "avg": (o["sum"] / o["count"]) if o["count"] else 0.0}
+        for name, fn in self._gauges.items():
+            try:
+                out[name] = fn()
+            except Exception as e:
+                out[name] = None
+                print(f"metrics gauge {name} error:", e)
+        return out
+
+metrics = Metrics()
+
+# =========================
+# Pub/Sub (SSE)
+# =========================
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "2000"))  # por proceso
+
+class BrokerFull(Exception):
+    """Se alcanzó el máximo de suscriptores SSE del proceso."""
+
+class LocalBroker:
+    """
+    Broker pub/sub en memoria del proceso. Cada suscriptor recibe su propia
+    Queue; publish() hace fan-out a todas las colas del canal.
+    Sirve para un solo proceso (dev o gunicorn con 1 worker). Para varios
+    procesos registra otro backend en BROKER_BACKENDS con la misma interfaz
+    (subscribe / unsubscribe / publish).
+    """
+    def __init__(self, max_subscribers: int = SSE_MAX_SUBSCRIBERS):
+        self._lock = threading.Lock()
+        self._subs = defaultdict(set)  # canal -> {Queue}
+        self._count = 0
+        self.max_subscribers = max_subscribers
+
+    def subscribe(self, channel: str) -> queue.Queue:
+        q = queue.Queue()
+        with self._lock:
+            if self.max_subscribers and self._count >= self.max_subscribers:
+                raise BrokerFull()
+            self._subs[channel].add(q)
+            self._count += 1
+        return q
+
+    def unsubscribe(self, channel: str, q: queue.Queue):
+        with self._lock:
+            subs = self._subs.get(channel)
+            if subs is not None and q in subs:
+                subs.discard(q)
+                self._count -= 1
+                if not subs:
+                    del self._subs[channel]
+
+    def publish(self, channel: str, payload: dict):
+        with self._lock:
+            subs = list(self._subs.get(channel, ()))
+        for q in subs:
+            q.put(payload)
+
+
+BROKER_BACKENDS = {"local": LocalBroker}
+
+def make_broker():
+    name = (os.getenv("BROKER_BACKEND") or "local").lower()
+    cls = BROKER_BACKENDS.get(name)
+    if cls is None:
+        raise RuntimeError(f"BROKER_BACKEND desconocido: {name}")
+    return cls()
+
+broker = make_broker()
+
+def notif_channel(user_id: int) -> str:
+    return f"notif:{user_id}"
+
+def chat_channel(thread_id: int) -> str:
+    return f"chat:{thread_id}"
+
+def sse_events(q: queue.Queue):
+    """
+    Itera los payloads de una cola de suscripción. Si no llega nada en
+    SSE_HEARTBEAT_SECONDS entrega None para que el stream mande un keepalive.
+    """
+    while True:
+        try:
+            yield q.get(timeout=SSE_HEARTBEAT_SECONDS)
+        except queue.Empty:
+            yield None
+
+def notification_payload(n: Notification) -> dict:
+    return {
+        "id": n.id,
+        "type": n.type,
+        "title": n.title,
+        "body": n.body,
+        "data": json.loads(n.data_json) if n.data_json else {},
+        "created_at": n.created_at.isoformat()
+    }
+
 # =========================
 # Notificaciones
 # =========================
+FCM_TOKEN_REFRESH_MARGIN = timedelta(minutes=5)  # refresca un poco antes de que expire
+
+class FcmTokenCache:
+    """
+    Cache de proceso del access token OAuth2 para FCM HTTP v1. Las credenciales
+    se cargan una sola vez y el token se refresca (bajo lock) solo cuando está
+    por expirar, así una ráfaga de pushes no hace un round-trip OAuth por envío.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._creds = None
+        self._creds_path = None
+
+    def _needs_refresh(self) -> bool:
+        c = self._creds
+        if c is None or not c.token or c.expiry is None:
+            return True
+        # google-auth guarda expiry como datetime UTC naive
+        return c.expiry - datetime.utcnow() <= FCM_TOKEN_REFRESH_MARGIN
+
+    def get(self) -> str:
+        path = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
+        if self._creds_path == path and not self._needs_refresh():
+            return self._creds.token
+        with self._lock:
+            if self._creds is None or self._creds_path != path:
+                self._creds = service_account.Credentials.from_service_account_file(path, scopes=SCOPES)
+                self._creds_path = path
+            if self._needs_refresh():
+                t0 = time.monotonic()
+                try:
+                    self._creds.refresh(Request())
+                except Exception:
+                    metrics.inc("fcm_token_refresh_errors")
+                    raise
+                metrics.inc("fcm_token_refreshes")
+                metrics.observe("fcm_token_refresh_ms", (time.monotonic() - t0) * 1000)
+            return self._creds.token
+
+    def invalidate(self):
+        with self._lock:
+            if self._creds is not None:
+                self._creds.token = None
+
+fcm_token_cache = FcmTokenCache()
+
 def _get_access_token():
     """
     Obtiene un access token OAuth2 usando el Service Account para llamar FCM HTTP v1.
     Requiere GOOGLE_APPLICATION_CREDENTIALS apuntando al JSON del service account.
+    El token se reutiliza entre envíos (ver FcmTokenCache).
+    FCM_ACCESS_TOKEN fija un token estático (útil contra tools/fake_fcm.py).
     """
-    creds = service_account.Credentials.from_service_account_file(
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"],
-        scopes=SCOPES
-    )
-    creds.refresh(Request())
-    return creds.token
+    static = os.getenv("FCM_ACCESS_TOKEN")
+    if static:
+        return static
+    return fcm_token_cache.get()
+
+# Cliente HTTP compartido (keep-alive) y fan-out acotado para los envíos a FCM
+FCM_BASE_URL = os.getenv("FCM_BASE_URL", "https://fcm.googleapis.com").rstrip("/")
+FCM_FANOUT_CONCURRENCY = int(os.getenv("FCM_FANOUT_CONCURRENCY", "8"))
+
+fcm_http = requests.Session()
+fcm_http.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=FCM_FANOUT_CONCURRENCY))
+fcm_http.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=FCM_FANOUT_CONCURRENCY))
+_fcm_fanout = ThreadPoolExecutor(max_workers=FCM_FANOUT_CONCURRENCY, thread_name_prefix="fcm-fanout")
+
+def _prune_device_tokens(tokens: list[str]):
+    """Borra de DeviceToken los tokens que FCM reporta como no registrados/inválidos."""
+    if not tokens:
+        return
+    db = new_db()
+    try:
+        n = db.query(DeviceToken).filter(DeviceToken.token.in_(tokens)).delete(synchronize_session=False)
+        db.commit()
+        metrics.inc("fcm_tokens_pruned", n)
+    except Exception as e:
+        db.rollback()
+        print("FCM prune error:", e)
+    finally:
+        db.close()
 
-def _fcm_send(tokens: list[str], title: str, body: str, data: dict | None = None):
+def _fcm_v1_is_dead_token(r) -> bool:
+    try:
+        err = r.json().get("error") or {}
+    except Exception:
+        return False
+    codes = {d.get("errorCode") for d in (err.get("details") or []) if isinstance(d, dict)}
+    if "UNREGISTERED" in codes or err.get("status") == "NOT_FOUND":
+        return True
+    # INVALID_ARGUMENT también sale por payload inválido: solo si habla del token
+    return ("INVALID_ARGUMENT" in codes or err.get("status") == "INVALID_ARGUMENT") \
+        and "registration token" in (err.get("message") or "").lower()
+
+def _fcm_v1_send_one(url: str, headers: dict, token: str, title: str, body: str, data: dict) -> str:
+    """Devuelve 'ok' | 'dead' | 'retry'."""
+    payload = {
+        "message": {
+            "token": token,
+            "notification": {"title": title, "body": body},
+            "data": data
+        }
+    }
+    try:
+        r = fcm_http.post(url, headers=headers, json=payload, timeout=10)
+    except Exception as e:
+        print("FCM v1 error:", e)
+        return "retry"
+    if r.status_code == 200:
+        return "ok"
+    if r.status_code == 401:
+        # token revocado/expirado antes de tiempo: fuerza refresh en el reintento
+        fcm_token_cache.invalidate()
+        return "retry"
+    if r.status_code == 429 or r.status_code >= 500:
+        return "retry"
+    if _fcm_v1_is_dead_token(r):
+        return "dead"
+    print("FCM v1 rejected:", r.status_code, r.text[:300])
+    return "ok"  # error permanente del mensaje: reintentar no lo arregla
+
+class FcmError(Exception):
+    """Fallo transitorio de envío; failed_tokens son los que conviene reintentar."""
+    def __init__(self, msg: str, failed_tokens: list[str]):
+        super().__init__(msg)
+        self.failed_tokens = failed_tokens
+
+def _fcm_send(tokens: list[str], title: str, body: str, data: dict | None = None) -> bool:
     """
     Envía notificaciones con FCM. Intenta HTTP v1; si no hay credencial, usa Legacy Server Key.
+    Devuelve False si no había nada que enviar (sin tokens o sin credenciales) y
+    lanza FcmError si hubo fallos reintentables (red, 5xx, 429).
     """
     if not tokens:
-        return
+        return False
 
     # --- Preferir HTTP v1 si hay service account ---
-    if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+    if os.getenv("GOOGLE_APPLICATION_CREDENTIALS") or os.getenv("FCM_ACCESS_TOKEN"):
         try:
             access_token = _get_access_token()
-            url = f"https://fcm.googleapis.com/v1/projects/{FIREBASE_PROJECT_ID}/messages:send"
+        except Exception as e:
+            print("FCM v1 unavailable, falling back to Legacy:", e)
+        else:
+            url = f"{FCM_BASE_URL}/v1/projects/{FIREBASE_PROJECT_ID}/messages:send"
             headers = {
                 "Authorization": f"Bearer {access_token}",
                 "Content-Type": "application/json",
             }
-            # v1 -> 1 request por token (o usa topics en el futuro)
-            for t in tokens:
-                payload = {
-                    "message": {
-                        "token": t,
-                        "notification": {"title": title, "body": body},
-                        "data": (data or {})
-                    }
-                }
-                try:
-                    requests.post(url, headers=headers, json=payload, timeout=10)
-                except Exception as e:
-                    print("FCM v1 error:", e)
-            return
-        except Exception as e:
-            print("FCM v1 unavailable, falling back to Legacy:", e)
+            # v1 solo acepta valores string en "data"
+            v1_data = {k: v if isinstance(v, str) else json.dumps(v) for k, v in (data or {}).items()}
+            # v1 -> 1 request por token, en paralelo (acotado por FCM_FANOUT_CONCURRENCY)
+            if len(tokens) == 1:
+                results = [_fcm_v1_send_one(url, headers, tokens[0], title, body, v1_data)]
+            else:
+                results = list(_fcm_fanout.map(
+                    lambda t: _fcm_v1_send_one(url, headers, t, title, body, v1_data), tokens
+                ))
+            dead = [t for t, res in zip(tokens, results) if res == "dead"]
+            failed = [t for t, res in zip(tokens, results) if res == "retry"]
+            _prune_device_tokens(dead)
+            if failed:
+                raise FcmError(f"FCM v1: {len(failed)}/{len(tokens)} envíos fallidos", failed)
+            return True
 
     # --- Fallback Legacy (lo que ya usabas) ---
     key = os.getenv("FCM_SERVER_KEY")  # si mantienes soporte legacy
     if not key:
         # sin v1 y sin legacy -> no enviar
         print("FCM: faltan credenciales (ni GOOGLE_APPLICATION_CREDENTIALS ni FCM_SERVER_KEY)")
-        return
+        return False
 
     payload = {
         "registration_ids": tokens,
@@ -389,35 +1587,199 @@ def _fcm_send(tokens: list[str], title: str, body: str, data: dict | None = None
         "data": data or {}
     }
     try:
-        requests.post(
-            "https://fcm.googleapis.com/fcm/send",
+        r = fcm_http.post(
+            f"{FCM_BASE_URL}/fcm/send",
             headers={"Authorization": f"key {key}", "Content-Type": "application/json"},
             json=payload, timeout=10
         )
     except Exception as e:
         print("FCM legacy error:", e)
+        raise FcmError(f"FCM legacy: {e}", tokens)
+    if r.status_code == 429 or r.status_code >= 500:
+        raise FcmError(f"FCM legacy HTTP {r.status_code}", tokens)
+    try:
+        results = r.json().get("results") or []
+    except Exception:
+        results = []
+    _prune_device_tokens([
+        t for t, res in zip(tokens, results)
+        if isinstance(res, dict) and res.get("error") in ("NotRegistered", "InvalidRegistration")
+    ])
+    return True
+
+# =========================
+# Outbox de pushes (worker pool)
+# =========================
+PUSH_WORKERS = int(os.getenv("PUSH_WORKERS", "4"))
+PUSH_MAX_ATTEMPTS = int(os.getenv("PUSH_MAX_ATTEMPTS", "6"))
+PUSH_POLL_SECONDS = float(os.getenv("PUSH_POLL_SECONDS", "5"))
+PUSH_LEASE_SECONDS = 60      # si el worker muere a mitad, la fila vuelve a estar disponible tras esto
+PUSH_BACKOFF_MAX_SECONDS = 300
+
+class PushDispatcher:
+    """
+    Pool de hilos que drena push_outbox. Cada worker reclama una fila con un
+    UPDATE condicional (seguro con varios procesos sobre la misma DB), llama
+    a _fcm_send y la marca como enviada o la reprograma con backoff exponencial.
+    """
+    def __init__(self, workers: int = PUSH_WORKERS):
+        self.workers = workers
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None  # proceso dueño de los hilos: tras un fork hay que lanzarlos de nuevo
+
+    def start(self):
+        """Lanza los hilos una vez por proceso. Idempotente y barato (se llama en cada request)."""
+        if self._pid == os.getpid() or self.workers <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # los hilos heredados de un fork no existen en este proceso
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"push-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+
+    def notify(self):
+        """Despierta a los workers (hay una fila nueva en la outbox)."""
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                worked = self._dispatch_one()
+            except Exception as e:
+                print("push worker error:", e)
+                worked = False
+            finally:
+                SessionLocal.remove()
+            if not worked:
+                self._wake.wait(PUSH_POLL_SECONDS)
+                self._wake.clear()
+
+    def _claim(self, db) -> PushOutbox | None:
+        now = datetime.utcnow()
+        row_id = (
+            db.query(PushOutbox.id)
+            .filter(PushOutbox.status == "pending", PushOutbox.next_attempt_at <= now)
+            .order_by(PushOutbox.id.asc())
+            .limit(1)
+            .scalar()
+        )
+        if row_id is None:
+            return None
+        res = db.execute(
+            update(PushOutbox)
+            .where(
+                PushOutbox.id == row_id,
+                PushOutbox.status == "pending",
+                PushOutbox.next_attempt_at <= now,
+            )
+            .values(
+                attempts=PushOutbox.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=PUSH_LEASE_SECONDS),
+            )
+        )
+        db.commit()
+        if res.rowcount != 1:
+            return None  # otro worker la tomó primero
+        return db.get(PushOutbox, row_id)
+
+    def _dispatch_one(self) -> bool:
+        db = get_db()
+        try:
+            row = self._claim(db)
+            if row is None:
+                return False
+
+            if row.tokens_json:
+                tokens = json.loads(row.tokens_json)
+            else:
+                tokens = [t.token for t in db.query(DeviceToken).filter(DeviceToken.user_id == row.user_id).all()]
+            data = json.loads(row.data_json) if row.data_json else {}
+
+            try:
+                sent = _fcm_send(tokens, row.title, row.body, data)
+            except Exception as e:
+                failed = getattr(e, "failed_tokens", None)
+                row.last_error = str(e)[:1000]
+                if failed:
+                    row.tokens_json = json.dumps(failed)
+                if row.attempts >= PUSH_MAX_ATTEMPTS:
+                    row.status = "failed"
+                    metrics.inc("push_failed")
+                else:
+                    backoff = min(PUSH_BACKOFF_MAX_SECONDS, 2 ** row.attempts) * random.uniform(0.5, 1.0)
+                    row.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+                    metrics.inc("push_retries")
+                db.commit()
+                return True
+
+            row.status = "sent" if sent else "skipped"
+            row.sent_at = datetime.utcnow()
+            db.commit()
+            metrics.inc("push_sent" if sent else "push_skipped")
+            metrics.observe("push_dispatch_latency_ms", (row.sent_at - row.created_at).total_seconds() * 1000)
+            return True
+        finally:
+            db.close()
+
+push_dispatcher = PushDispatcher()
+
+@app.before_request
+def _start_push_dispatcher():
+    # no depende de cómo se sirva la app (gunicorn, flask run, otro WSGI): el primer
+    # request de cada proceso arranca la outbox, aunque nadie haya notificado todavía
+    push_dispatcher.start()
+
+def _push_queue_depth() -> int:
+    db = new_db()
+    try:
+        return db.query(func.count(PushOutbox.id)).filter(PushOutbox.status == "pending").scalar() or 0
+    finally:
+        db.close()
+
+metrics.gauge("push_queue_depth", _push_queue_depth)
+
+def _db_pool_status():
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return None
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "idle": pool.checkedin(),
+    }
+
+metrics.gauge("db_pool", _db_pool_status)
+
 def send_notification(db, user_id: int, ntype: str, title: str, body: str, *, data: dict | None = None):
     # 1) Guarda en DB
     n = Notification(
         user_id=user_id, type=ntype, title=title, body=body,
         data_json=json.dumps(data or {})
     )
-    db.add(n); db.commit()
+    db.add(n); db.flush()
 
-    # 2) Push FCM (si hay tokens)
-    tokens = [t.token for t in db.query(DeviceToken).filter(DeviceToken.user_id == user_id).all()]
-    try:
-        _fcm_send(tokens, title, body, {"type": ntype, **(data or {})})
-    except Exception:
-        pass
+    # 2) Push FCM: solo se encola en la outbox (misma transacción); lo envía PushDispatcher
+    db.add(PushOutbox(
+        notification_id=n.id, user_id=user_id, title=title, body=body,
+        data_json=json.dumps({"type": ntype, **(data or {})})
+    ))
+    db.commit()
+    push_dispatcher.notify()
 
     # 3) Empuja por SSE (canal de notificaciones)
     try:
-        # Para SSE “fire-and-forget”: no necesitamos nada si el cliente tira long-poll cada Xs,
-        # pero si implementas un pub/sub real, emite aquí.
-        pass
-    except:
-        pass
+        broker.publish(notif_channel(user_id), notification_payload(n))
+    except Exception as e:
+        print("broker publish error:", e)
     return n.id
 @app.post("/pns/register_token")
 @jwt_required()
@@ -515,51 +1877,52 @@ def notifications_sse():
 
     @stream_with_context
     def event_stream():
-        db = get_db()
+        from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
         try:
-            from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-            try:
-                verify_jwt_in_request()
-            except Exception:
-                yield "event: error\ndata: unauthorized\n\n"
-                return
+            verify_jwt_in_request()
+        except Exception:
+            yield "event: error\ndata: unauthorized\n\n"
+            return
 
-            uid = int(get_jwt_identity())
-            last_id = request.args.get("last_id", type=int) or 0
+        uid = int(get_jwt_identity())
+        last_id = request.args.get("last_id", type=int) or 0
 
-            while True:
+        # Suscribe ANTES de leer el histórico para no perder lo que llegue entremedio
+        channel = notif_channel(uid)
+        try:
+            q = broker.subscribe(channel)
+        except BrokerFull:
+            yield "event: error\ndata: busy\n\n"
+            return
+        try:
+            # Catch-up: una sola consulta al conectar; luego no se toca la DB
+            db = get_db()
+            try:
                 rows = (
                     db.query(Notification)
                     .filter(Notification.user_id == uid, Notification.id > last_id)
                     .order_by(Notification.id.asc())
                     .all()
                 )
-                for r in rows:
-                    payload = {
-                        "id": r.id,
-                        "type": r.type,
-                        "title": r.title,
-                        "body": r.body,
-                        "data": json.loads(r.data_json) if r.data_json else {},
-                        "created_at": r.created_at.isoformat()
-                    }
-                    yield f"event: notification\ndata: {json.dumps(payload)}\n\n"
-                    last_id = r.id
-                sleep(1.0)
+                backlog = [notification_payload(r) for r in rows]
+            finally:
+                db.close()
+
+            for payload in backlog:
+                yield f"event: notification\ndata: {json.dumps(payload)}\n\n"
+                last_id = payload["id"]
+
+            for payload in sse_events(q):
+                if payload is None:
+                    yield ": keepalive\n\n"
+                    continue
+                if payload["id"] <= last_id:
+                    continue
+                yield f"event: notification\ndata: {json.dumps(payload)}\n\n"
+                last_id = payload["id"]
         finally:
-            db.close()
+            broker.unsubscribe(channel, q)
     return Response(event_stream(), mimetype="text/event-stream")
-def check_overlap(db, artist_id: int, start_time: datetime, end_time: datetime) -> bool:
-    q = (
-        db.query(Appointment)
-        .filter(
-            Appointment.artist_id == artist_id,
-            Appointment.status.notin_(["canceled", "rejected"]),  # ← ocupado si no está cancelada/rechazada
-            Appointment.start_time < end_time,
-            Appointment.end_time > start_time,
-        )
-    )
-    return db.query(q.exists()).scalar()
 @app.post("/appointments/<int:appointment_id>/confirm")
 @role_required("artist")
 def confirm_appointment(appointment_id):
@@ -623,11 +1986,39 @@ def reject_appointment(appointment_id):
 # ========================
 # Módulos agendamiento
 # =======================
+SLOTS_MAX_PER_REQUEST = 5000
+
+def _parse_hhmm(v) -> timedelta:
+    """'10:30' o 10 -> offset desde medianoche."""
+    if isinstance(v, int):
+        return timedelta(hours=v)
+    h, _, m = str(v).partition(":")
+    return timedelta(hours=int(h), minutes=int(m or 0))
+
+def build_slot_candidates(d_from, d_to, windows_by_weekday: dict, slot_minutes: int) -> list[tuple[datetime, datetime]]:
+    """
+    Calcula en memoria los tramos (inicio, fin) a crear. windows_by_weekday:
+    {0..6: [(desde, hasta), ...]} con offsets desde medianoche; solo entran
+    tramos completos dentro de cada ventana.
+    """
+    step = timedelta(minutes=slot_minutes)
+    out = []
+    current = d_from
+    while current <= d_to:
+        midnight = datetime(current.year, current.month, current.day)
+        for w_start, w_end in windows_by_weekday.get(current.weekday(), ()):
+            start = midnight + w_start
+            while start + step <= midnight + w_end:
+                out.append((start, start + step))
+                start += step
+        current = current + timedelta(days=1)
+    return out
+
 @app.post("/artist/slots/generate")
 @role_required("artist")
 def generate_slots():
     """
-    Crea módulos de 1h para el tatuador autenticado.
+    Crea módulos para el tatuador autenticado (1h por defecto).
 
     body:
     {
@@ -635,8 +2026,17 @@ def generate_slots():
       "to_date":   "2025-11-25",      # opcional; por defecto = from_date
       "start_hour": 10,               # hora inicial (24h) inclusive
       "end_hour": 20,                 # hora final (24h) exclusiva (20 => último 19-20)
-      "days_of_week": [0,1,2,3,4]     # opcional; 0=lunes ... 6=domingo
+      "days_of_week": [0,1,2,3,4],    # opcional; 0=lunes ... 6=domingo
+      "slot_minutes": 60,             # opcional; duración de cada módulo (15..480)
+      "weekly_template": {            # opcional; reemplaza start/end_hour y days_of_week
+        "0": [["10:00","14:00"], ["15:00","19:00"]],
+        "5": [["11:00","15:00"]]
+      }
     }
+
+    Los tramos se calculan en memoria, se leen los existentes con una sola
+    consulta por rango y se insertan en bloque (ON CONFLICT DO NOTHING sobre
+    uq_timeslot_artist_start, por si otra petición generó los mismos).
     """
     data = request.get_json(force=True) or {}
     from_date_s = (data.get("from_date") or "").strip()
@@ -644,6 +2044,8 @@ def generate_slots():
     start_hour = int(data.get("start_hour") or 10)
     end_hour = int(data.get("end_hour") or 20)
     days_of_week = data.get("days_of_week")  # puede ser None o lista de ints
+    slot_minutes = int(data.get("slot_minutes") or 60)
+    template = data.get("weekly_template")
 
     if not from_date_s:
         return jsonify({"msg": "from_date requerido (YYYY-MM-DD)"}), 400
@@ -656,39 +2058,49 @@ def generate_slots():
 
     if d_to < d_from:
         return jsonify({"msg": "to_date debe ser >= from_date"}), 400
+    if not 15 <= slot_minutes <= 480:
+        return jsonify({"msg": "slot_minutes debe estar entre 15 y 480"}), 400
 
+    if template:
+        try:
+            windows = {
+                int(dow): [(_parse_hhmm(w[0]), _parse_hhmm(w[1])) for w in wins]
+                for dow, wins in template.items()
+            }
+        except Exception:
+            return jsonify({"msg": "weekly_template inválido"}), 400
+    else:
+        dows = range(7) if days_of_week is None else days_of_week
+        windows = {int(dow): [(timedelta(hours=start_hour), timedelta(hours=end_hour))] for dow in dows}
+
+    candidates = build_slot_candidates(d_from, d_to, windows, slot_minutes)
+    if len(candidates) > SLOTS_MAX_PER_REQUEST:
+        return jsonify({"msg": f"Demasiados módulos en una petición (máx {SLOTS_MAX_PER_REQUEST})"}), 400
+    if not candidates:
+        return jsonify({"msg": "slots_generados", "count": 0, "skipped": 0})
+
+    artist_id = request.current_user.id
     db = get_db()
     try:
-        current = d_from
+        # Evita duplicados: una sola consulta por rango
+        existing = {
+            st for (st,) in db.query(TimeSlot.start_time).filter(
+                TimeSlot.artist_id == artist_id,
+                TimeSlot.start_time >= candidates[0][0],
+                TimeSlot.start_time <= candidates[-1][0],
+            )
+        }
+        now = datetime.utcnow()
+        rows = [
+            {"artist_id": artist_id, "start_time": st, "end_time": et, "enabled": True, "created_at": now}
+            for st, et in candidates if st not in existing
+        ]
         created = 0
-        while current <= d_to:
-            if days_of_week is None or current.weekday() in days_of_week:
-                for h in range(start_hour, end_hour):
-                    start = datetime(current.year, current.month, current.day, h, 0)
-                    end = start + timedelta(hours=1)
-
-                    # Evita duplicados
-                    exists = (
-                        db.query(TimeSlot)
-                        .filter(
-                            TimeSlot.artist_id == request.current_user.id,
-                            TimeSlot.start_time == start,
-                        )
-                        .first()
-                    )
-                    if not exists:
-                        db.add(TimeSlot(
-                            artist_id=request.current_user.id,
-                            start_time=start,
-                            end_time=end,
-                            enabled=True,
-                        ))
-                        created += 1
-
-            current = current + timedelta(days=1)
-
+        if rows:
+            res = db.execute(insert_ignore_duplicates(TimeSlot.__table__, ["artist_id", "start_time"]), rows)
+            created = res.rowcount if res.rowcount is not None and res.rowcount >= 0 else len(rows)
         db.commit()
-        return jsonify({"msg": "slots_generados", "count": created})
+        return jsonify({"msg": "slots_generados", "count": created, "skipped": len(candidates) - created})
     finally:
         db.close()
 @app.get("/artists/<int:artist_id>/slots")
@@ -740,22 +2152,142 @@ def list_slots_for_artist(artist_id):
             .all()
         )
 
-        out = []
-        for s in slots:
-            appt = s.appointment
-            out.append({
-                "id": s.id,
-                "artist_id": s.artist_id,
-                "start_time": s.start_time.isoformat(),
-                "end_time": s.end_time.isoformat(),
-                "enabled": bool(s.enabled),
-                "has_appointment": bool(appt is not None),
-                "appointment_id": appt.id if appt else None,
-                "appointment_status": appt.status if appt else None,
-            })
-        return jsonify(out)
+        out = []
+        for s in slots:
+            appt = s.appointment
+            out.append({
+                "id": s.id,
+                "artist_id": s.artist_id,
+                "start_time": s.start_time.isoformat(),
+                "end_time": s.end_time.isoformat(),
+                "enabled": bool(s.enabled),
+                "has_appointment": bool(appt is not None),
+                "appointment_id": appt.id if appt else None,
+                "appointment_status": appt.status if appt else None,
+            })
+        return jsonify(out)
+    finally:
+        db.close()
+AVAILABILITY_MAX_DAYS = 93
+AVAILABILITY_MAX_ARTISTS = 50
+
+def _availability_rows(db, artist_ids: list[int] | None, start: datetime, end: datetime):
+    """Módulos libres (habilitados y sin cita) en [start, end), por artista y hora. Una sola consulta."""
+    q = (
+        db.query(TimeSlot.id, TimeSlot.artist_id, TimeSlot.start_time, TimeSlot.end_time)
+        .filter(
+            TimeSlot.start_time >= start,
+            TimeSlot.start_time < end,
+            TimeSlot.enabled == True,
+            TimeSlot.appointment_id.is_(None),
+        )
+    )
+    if artist_ids:
+        q = q.filter(TimeSlot.artist_id.in_(artist_ids))
+    # (artist_id, start_time) = uq_timeslot_artist_start -> range scan por artista
+    return q.order_by(TimeSlot.artist_id.asc(), TimeSlot.start_time.asc()).yield_per(1000)
+
+def _day_bitmap(slots, granularity: int) -> str:
+    """'0'/'1' por tramo de `granularity` minutos del día; 1 = cubierto por un módulo libre."""
+    bits = ["0"] * (24 * 60 // granularity)
+    for _, st, et in slots:
+        first = (st.hour * 60 + st.minute) // granularity
+        last = -(-((et - datetime(st.year, st.month, st.day)).total_seconds() // 60) // granularity)
+        for i in range(first, min(int(last), len(bits))):
+            bits[i] = "1"
+    return "".join(bits)
+
+def _group_by_artist_day(rows):
+    """Agrupa filas ordenadas en (artist_id, 'YYYY-MM-DD', [(id, start, end), ...])."""
+    key, bucket = None, []
+    for slot_id, artist_id, st, et in rows:
+        k = (artist_id, st.date().isoformat())
+        if k != key:
+            if bucket:
+                yield key[0], key[1], bucket
+            key, bucket = k, []
+        bucket.append((slot_id, st, et))
+    if bucket:
+        yield key[0], key[1], bucket
+
+@app.get("/availability")
+@jwt_required(optional=True)
+def availability_range():
+    """
+    Disponibilidad de varios días y/o varios artistas en una sola consulta.
+
+    GET /availability?from=2025-11-01&to=2025-11-30&artist_ids=2,5
+         &format=slots|bitmap&granularity=60&stream=1
+
+    - format=slots (defecto): por día, lista compacta [slot_id, "HH:MM", "HH:MM"]
+      de módulos libres (habilitados y sin reserva).
+    - format=bitmap: por día, string de '0'/'1' con un carácter por tramo de
+      `granularity` minutos (1 = libre).
+    - stream=1: NDJSON, una línea por artista/día, sin armar todo en memoria.
+    Sin artist_ids se consideran todos los artistas.
+    """
+    try:
+        d_from = datetime.fromisoformat((request.args.get("from") or "").strip()).date()
+        d_to = datetime.fromisoformat((request.args.get("to") or "").strip()).date()
+    except Exception:
+        return jsonify({"msg": "from y to requeridos (YYYY-MM-DD)"}), 400
+    if d_to < d_from:
+        return jsonify({"msg": "to debe ser >= from"}), 400
+    if (d_to - d_from).days + 1 > AVAILABILITY_MAX_DAYS:
+        return jsonify({"msg": f"Rango máximo {AVAILABILITY_MAX_DAYS} días"}), 400
+
+    artist_ids = None
+    raw_ids = (request.args.get("artist_ids") or "").strip()
+    if raw_ids:
+        try:
+            artist_ids = sorted({int(x) for x in raw_ids.split(",") if x.strip()})
+        except ValueError:
+            return jsonify({"msg": "artist_ids inválido (ej: 1,2,3)"}), 400
+        if len(artist_ids) > AVAILABILITY_MAX_ARTISTS:
+            return jsonify({"msg": f"Máximo {AVAILABILITY_MAX_ARTISTS} artistas"}), 400
+
+    fmt = (request.args.get("format") or "slots").lower()
+    if fmt not in ("slots", "bitmap"):
+        return jsonify({"msg": "format debe ser slots o bitmap"}), 400
+    granularity = request.args.get("granularity", default=60, type=int)
+    if granularity not in (15, 30, 60, 120):
+        return jsonify({"msg": "granularity debe ser 15, 30, 60 o 120"}), 400
+    stream = request.args.get("stream", default=0, type=int) == 1
+
+    start = datetime(d_from.year, d_from.month, d_from.day)
+    end = datetime(d_to.year, d_to.month, d_to.day) + timedelta(days=1)
+
+    def day_value(slots):
+        if fmt == "bitmap":
+            return _day_bitmap(slots, granularity)
+        return [[sid, st.strftime("%H:%M"), et.strftime("%H:%M")] for sid, st, et in slots]
+
+    if stream:
+        @stream_with_context
+        def generate():
+            db = get_db()
+            try:
+                for artist_id, day, slots in _group_by_artist_day(_availability_rows(db, artist_ids, start, end)):
+                    yield json.dumps({"artist_id": artist_id, "date": day, fmt: day_value(slots)}) + "\n"
+            finally:
+                db.close()
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    db = get_db()
+    try:
+        artists = {}
+        for artist_id, day, slots in _group_by_artist_day(_availability_rows(db, artist_ids, start, end)):
+            artists.setdefault(str(artist_id), {})[day] = day_value(slots)
+        return jsonify({
+            "from": d_from.isoformat(),
+            "to": d_to.isoformat(),
+            "format": fmt,
+            "granularity": granularity if fmt == "bitmap" else None,
+            "artists": artists,
+        })
     finally:
         db.close()
+
 @app.post("/artist/slots/<int:slot_id>/enable")
 @role_required("artist")
 def enable_slot(slot_id):
@@ -829,22 +2361,46 @@ def book_from_slot():
         if slot.start_time <= datetime.utcnow():
             return jsonify({"msg": "No se puede reservar en el pasado"}), 400
 
-        # Crea la cita de 1h ligada al slot
-        appt = Appointment(
-            design_id=design.id,
-            client_id=request.current_user.id,
-            artist_id=slot.artist_id,
-            start_time=slot.start_time,
-            end_time=slot.end_time,
-            status="booked",   # PENDIENTE de confirmación del tatuador
-            pay_now=pay_now,
-            paid=False,
-        )
-        db.add(appt)
-        db.flush()  # para obtener appt.id sin commit aún
+        def reserve():
+            with artist_booking_lock(db, slot.artist_id):
+                if check_overlap(db, slot.artist_id, slot.start_time, slot.end_time):
+                    raise BookingConflict("Slot ya reservado")
+                # Crea la cita de 1h ligada al slot
+                appt = Appointment(
+                    design_id=design.id,
+                    client_id=request.current_user.id,
+                    artist_id=slot.artist_id,
+                    start_time=slot.start_time,
+                    end_time=slot.end_time,
+                    status="booked",   # PENDIENTE de confirmación del tatuador
+                    pay_now=pay_now,
+                    paid=False,
+                )
+                db.add(appt)
+                db.flush()  # para obtener appt.id sin commit aún
+
+                # Toma el slot sólo si sigue libre: el UPDATE condicional es el árbitro
+                claimed = db.execute(
+                    update(TimeSlot)
+                    .where(
+                        TimeSlot.id == slot.id,
+                        TimeSlot.appointment_id.is_(None),
+                        TimeSlot.enabled == True,
+                    )
+                    .values(appointment_id=appt.id)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if not claimed:
+                    raise BookingConflict("Slot ya reservado")
+                db.commit()
+                return appt
 
-        slot.appointment_id = appt.id
-        db.commit()
+        try:
+            appt = run_booking(db, reserve)
+        except BookingConflict as e:
+            return jsonify({"msg": str(e)}), 409
+        except OperationalError:
+            return jsonify({"msg": "Agenda ocupada, intenta nuevamente"}), 503
 
         # Notificar al tatuador
         try:
@@ -879,7 +2435,7 @@ def chat_ensure_thread():
     """
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         if not me:
             return jsonify({"msg":"No autorizado"}), 401
 
@@ -901,96 +2457,117 @@ def chat_ensure_thread():
         db.close()
 
 
+CHAT_THREADS_MAX_PAGE = 200
+
 @app.get("/chat/threads")
 @jwt_required()
 def chat_list_threads():
     """
     Lista hilos del usuario autenticado con último mensaje, no leídos
     y datos básicos del "otro" usuario (id + nombre [+ email]).
+
+    Query opcional: ?limit=<int>&cursor=<X-Next-Cursor de la página anterior>
+    Se arma con una sola consulta (agregados por hilo), sin N+1.
     """
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         if not me:
             return jsonify({"msg": "No autorizado"}), 401
 
-        q = (
-            db.query(ChatThread)
-              .filter((ChatThread.artist_id == me.id) | (ChatThread.client_id == me.id))
-              .order_by(ChatThread.updated_at.desc())
-        )
+        limit = page_limit(None, CHAT_THREADS_MAX_PAGE)
+        cursor = request.args.get("cursor")
 
-        out = []
-        for th in q.all():
-            # último mensaje del hilo (si existe)
-            last = (
-                db.query(ChatMessage)
-                  .filter(ChatMessage.thread_id == th.id)
-                  .order_by(ChatMessage.id.desc())
-                  .first()
-            )
+        mine = (ChatThread.artist_id == me.id) | (ChatThread.client_id == me.id)
+        # "unread" sale del contador desnormalizado del lado del rol actual
+        if me.role == "artist":
+            other_col = ChatThread.client_id
+            unread_col = ChatThread.artist_unread
+        else:
+            other_col = ChatThread.artist_id
+            unread_col = ChatThread.client_unread
 
-            # calcula "unread" en función del rol actual (sin tocar tu lógica)
-            if me.role == "artist":
-                unread = (
-                    db.query(ChatMessage)
-                      .filter(
-                          ChatMessage.thread_id == th.id,
-                          ChatMessage.sender_id != me.id,
-                          ChatMessage.seen_by_artist == False,  # o .is_(False) si prefieres
-                      )
-                      .count()
-                )
-                other_id = th.client_id
-            else:
-                unread = (
-                    db.query(ChatMessage)
-                      .filter(
-                          ChatMessage.thread_id == th.id,
-                          ChatMessage.sender_id != me.id,
-                          ChatMessage.seen_by_client == False,  # o .is_(False)
-                      )
-                      .count()
-                )
-                other_id = th.artist_id
+        my_threads = db.query(ChatThread.id).filter(mine)
+
+        # último mensaje de todos mis hilos, agregado de una vez
+        last_sq = (
+            db.query(ChatMessage.thread_id.label("thread_id"), func.max(ChatMessage.id).label("last_id"))
+              .filter(ChatMessage.thread_id.in_(my_threads))
+              .group_by(ChatMessage.thread_id)
+              .subquery()
+        )
 
-            # NUEVO: datos del "otro" usuario
-            other = db.get(User, other_id)
-            other_name = other.name if other else None
-            other_email = other.email if other else None
+        q = (
+            db.query(ChatThread, ChatMessage, User, unread_col)
+              .outerjoin(last_sq, last_sq.c.thread_id == ChatThread.id)
+              .outerjoin(ChatMessage, ChatMessage.id == last_sq.c.last_id)
+              .outerjoin(User, User.id == other_col)
+              .filter(mine)
+        )
+        if cursor:
+            try:
+                c_ts, c_id = decode_cursor(cursor)
+            except ValueError:
+                return jsonify({"msg": "cursor inválido"}), 400
+            q = q.filter(or_(
+                ChatThread.updated_at < c_ts,
+                and_(ChatThread.updated_at == c_ts, ChatThread.id < c_id),
+            ))
+        q = q.order_by(ChatThread.updated_at.desc(), ChatThread.id.desc())
+        rows = q.limit(limit + 1).all() if limit else q.all()
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][0].updated_at, rows[-1][0].id)
 
+        out = []
+        for th, last, other, unread in rows:
             out.append({
                 "thread_id": th.id,
-                "other_user_id": other_id,
-                "other_user_name": other_name,        # <- añadido
-                "other_user_email": other_email,      # <- opcional
+                "other_user_id": th.client_id if me.role == "artist" else th.artist_id,
+                "other_user_name": other.name if other else None,        # <- añadido
+                "other_user_email": other.email if other else None,      # <- opcional
                 "last_message": ({
                     "id": last.id,
                     "text": last.text,
                     "image_url": last.image_url,
+                    "image_variants": image_variants(last.image_url),
                     "sender_id": last.sender_id,
                     "created_at": last.created_at.isoformat(),
                 } if last else None),
-                "unread": unread,
+                "unread": int(unread or 0),
                 "updated_at": th.updated_at.isoformat(),
             })
 
-        return jsonify(out)
+        resp = jsonify(out)
+        if next_cursor:
+            resp.headers["X-Next-Cursor"] = next_cursor
+        return resp
     finally:
         db.close()
 
 
 
+CHAT_MESSAGES_MAX_PAGE = 200
+
 @app.get("/chat/threads/<int:thread_id>/messages")
 @jwt_required()
 def chat_get_messages(thread_id):
     """
-    Query: ?after_id=<int>&limit=<int default=50>
-    Devuelve mensajes ASC (antiguo->nuevo).
+    Query (una de):
+      ?after_id=<int>   mensajes más nuevos que after_id
+      ?before_id=<int>  mensajes más antiguos que before_id (scrollback)
+      ?latest=1         los últimos `limit` mensajes
+      (sin nada)        desde el principio, como antes
+    &limit=<int default=50, máx CHAT_MESSAGES_MAX_PAGE>
+    Devuelve mensajes ASC (antiguo->nuevo). Cursores en headers:
+    X-Before-Id / X-After-Id (primer/último id de la página) y X-Has-More
+    (si quedan más en la dirección pedida).
     """
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         th = db.get(ChatThread, thread_id)
         if not me or not th:
             return jsonify({"msg":"No autorizado o hilo no existe"}), 404
@@ -998,22 +2575,31 @@ def chat_get_messages(thread_id):
             return jsonify({"msg":"No perteneces a este hilo"}), 403
 
         after_id = request.args.get("after_id", type=int)
-        limit = request.args.get("limit", default=50, type=int)
+        before_id = request.args.get("before_id", type=int)
+        latest = request.args.get("latest", default=0, type=int) == 1
+        limit = page_limit(50, CHAT_MESSAGES_MAX_PAGE)
 
         q = db.query(ChatMessage).filter(ChatMessage.thread_id == thread_id)
-        if after_id:
-            q = q.filter(ChatMessage.id > after_id)
-        msgs = q.order_by(ChatMessage.id.asc()).limit(limit).all()
-
-        return jsonify([
-            {
-                "id": m.id,
-                "sender_id": m.sender_id,
-                "text": m.text,
-                "image_url": m.image_url,
-                "created_at": m.created_at.isoformat()
-            } for m in msgs
-        ])
+        if before_id or (latest and not after_id):
+            # hacia atrás: DESC por índice y se invierte para devolver ASC
+            if before_id:
+                q = q.filter(ChatMessage.id < before_id)
+            msgs = q.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+            has_more = len(msgs) > limit
+            msgs = list(reversed(msgs[:limit]))
+        else:
+            if after_id:
+                q = q.filter(ChatMessage.id > after_id)
+            msgs = q.order_by(ChatMessage.id.asc()).limit(limit + 1).all()
+            has_more = len(msgs) > limit
+            msgs = msgs[:limit]
+
+        resp = jsonify([chat_message_payload(m) for m in msgs])
+        if msgs:
+            resp.headers["X-Before-Id"] = str(msgs[0].id)
+            resp.headers["X-After-Id"] = str(msgs[-1].id)
+        resp.headers["X-Has-More"] = "1" if has_more else "0"
+        return resp
     finally:
         db.close()
 
@@ -1023,7 +2609,7 @@ def chat_get_messages(thread_id):
 def chat_send_message(thread_id):
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         data = request.get_json(force=True) or {}
         text = (data.get("text") or "").strip()
         image_url = data.get("image_url")
@@ -1031,6 +2617,11 @@ def chat_send_message(thread_id):
         th = db.get(ChatThread, thread_id)
         if not th or (me.id not in (th.client_id, th.artist_id)):
             return jsonify({"msg": "No autorizado"}), 403
+        if not can_reference_blob(db, image_url, me.id):
+            return jsonify({"msg": "image_url debe ser una imagen subida por ti"}), 400
+        # "@tink" sin pregunta: todas esas variantes compartirían la misma clave de cache
+        if "@tink" in text.lower() and not normalize_prompt(text):
+            return jsonify({"msg": "Escribe tu pregunta después de @tink"}), 400
 
         # Guarda el mensaje del usuario
         msg = ChatMessage(
@@ -1042,7 +2633,10 @@ def chat_send_message(thread_id):
         )
         db.add(msg)
         th.updated_at = datetime.now(timezone.utc)
+        bump_unread(th, me.id)
+        adjust_blob_refcount(db, image_url, +1)
         db.commit()  # ← HOOK del bot parte después de guardar el mensaje del usuario
+        publish_chat_message(msg)
 
         # 🔔 Notificación a la contraparte (si el emisor NO es el bot)
         other_id = th.client_id if me.id == th.artist_id else th.artist_id
@@ -1061,93 +2655,27 @@ def chat_send_message(thread_id):
                 # Evita que un fallo de notificación afecte al flujo de chat
                 pass
 
-        # --- BOT @tink ---
+        # --- BOT @tink --- (la respuesta llega después por SSE; aquí sólo se encola)
         if text and "@tink" in text.lower():
             bot = ensure_bot_user(db)  # crea/obtiene al usuario 'tink'
             if me.id != bot.id:        # evita loops
-
-                def _looks_like_image_prompt(t: str) -> bool:
-                    t = (t or "").lower()
-                    triggers = ["img ", "/img", "imagen", "genera una imagen", "generar imagen", "hazme una imagen", "dibuja"]
-                    return any(k in t for k in triggers)
-
-                bot_text = None
-
-                if _looks_like_image_prompt(text):
-                    # === Generación de imagen vía Qwen, igualando a chatbot.py ===
-                    key = os.getenv("DASHSCOPE_API_KEY") or os.getenv("QWEN_API_KEY")
-                    if not key:
-                        bot_text = "(@tink) Falta DASHSCOPE_API_KEY en el .env para generar imágenes."
-                    else:
-                        region = (os.getenv("DASHSCOPE_REGION") or "intl").lower()
-                        gen_endpoint = (
-                            "https://dashscope-intl.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
-                            if region == "intl"
-                            else "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
-                        )
-                        try:
-                            resp = requests.post(
-                                gen_endpoint,
-                                headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
-                                json={
-                                    "model": "qwen-image-plus",
-                                    "input": {"messages": [{"role": "user", "content": [{"text": text}]}]},
-                                    "parameters": {
-                                        "size": "1328*1328",
-                                        "negative_prompt": "",
-                                        "watermark": False,
-                                        "prompt_extend": True
-                                    },
-                                },
-                                timeout=120
-                            )
-                            data = resp.json()
-                            resp.raise_for_status()
-
-                            # Extrae URLs (dos posibles formas de salida)
-                            urls = []
-                            out = (data or {}).get("output") or {}
-                            if "results" in out:
-                                for r in out.get("results", []):
-                                    u = r.get("url") or r.get("image")
-                                    if u:
-                                        urls.append(u)
-                            if "choices" in out:
-                                for ch in out.get("choices", []):
-                                    msgc = ch.get("message") or {}
-                                    for c in (msgc.get("content") or []):
-                                        if isinstance(c, dict) and c.get("image"):
-                                            urls.append(c["image"])
-
-                            if urls:
-                                bot_text = "(@tink) Imagen lista:\n" + "\n".join(urls)
-                            else:
-                                bot_text = "(@tink) No recibí URL de imagen en la respuesta."
-                        except Exception as e:
-                            bot_text = f"(@tink) Falló la generación de imagen: {e}"
-                else:
-                    # Respuesta de texto con Qwen (usa tu qwen_reply existente, idealmente adaptado a DASHSCOPE_*)
-                    try:
-                        bot_text = qwen_reply(text)
-                    except Exception:
-                        bot_text = "(@tink) Problemas con el asistente ahora mismo."
-
-                # Inserta el mensaje del bot
-                bot_msg = ChatMessage(
-                    thread_id=th.id,
-                    sender_id=bot.id,
-                    text=bot_text,
-                    created_at=datetime.now(timezone.utc)
+                thread_id_, bot_id = th.id, bot.id  # ids, no objetos ORM: el job corre en otro hilo
+                queued = tink_jobs.submit(
+                    thread_id_, me.id, lambda: _tink_reply_job(thread_id_, bot_id, text)
                 )
-                db.add(bot_msg)
-                th.updated_at = datetime.now(timezone.utc)
-                db.commit()
+                if not queued:
+                    metrics.inc("tink_jobs_rejected")
+                    post_bot_message(
+                        db, thread_id_, bot_id,
+                        "(@tink) Tengo varias respuestas tuyas en camino, dame un momento 🙏"
+                    )
 
         # Respuesta del endpoint: el mensaje del usuario
         return jsonify({
             "id": msg.id,
             "text": msg.text,
             "image_url": msg.image_url,
+            "image_variants": image_variants(msg.image_url),
             "sender_id": msg.sender_id,
             "created_at": msg.created_at.isoformat()
         }), 201
@@ -1165,7 +2693,7 @@ def chat_mark_read(thread_id):
     """
     db = get_db()
     try:
-        me = db.get(User, int(get_jwt_identity()))
+        me = current_user()
         th = db.get(ChatThread, thread_id)
         if not me or not th:
             return jsonify({"msg":"No autorizado o hilo no existe"}), 404
@@ -1178,17 +2706,27 @@ def chat_mark_read(thread_id):
             return jsonify({"msg":"last_id requerido"}), 400
 
         if me.id == th.artist_id:
-            db.query(ChatMessage).filter(
-                ChatMessage.thread_id == th.id,
-                ChatMessage.id <= last_id,
-                ChatMessage.sender_id != me.id
-            ).update({ChatMessage.seen_by_artist: True}, synchronize_session=False)
+            seen_col, unread_attr = ChatMessage.seen_by_artist, "artist_unread"
         else:
-            db.query(ChatMessage).filter(
+            seen_col, unread_attr = ChatMessage.seen_by_client, "client_unread"
+        db.query(ChatMessage).filter(
+            ChatMessage.thread_id == th.id,
+            ChatMessage.id <= last_id,
+            ChatMessage.sender_id != me.id
+        ).update({seen_col: True}, synchronize_session=False)
+
+        # Lo que queda sin leer solo puede ser posterior a last_id (rango corto por índice)
+        remaining = (
+            select(func.count(ChatMessage.id))
+            .where(
                 ChatMessage.thread_id == th.id,
-                ChatMessage.id <= last_id,
-                ChatMessage.sender_id != me.id
-            ).update({ChatMessage.seen_by_client: True}, synchronize_session=False)
+                ChatMessage.id > last_id,
+                ChatMessage.sender_id != me.id,
+                seen_col == False,
+            )
+            .scalar_subquery()
+        )
+        setattr(th, unread_attr, remaining)
         db.commit()
         return jsonify({"msg":"ok"})
     finally:
@@ -1211,76 +2749,112 @@ def chat_sse(thread_id):
     # Valida JWT dentro del generador:
     @stream_with_context
     def event_stream():
-        db = get_db()
+        from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
         try:
-            # valida usuario y pertenencia al hilo
-            from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-            try:
-                verify_jwt_in_request()
-            except Exception:
-                yield "event: error\ndata: unauthorized\n\n"
-                return
-
-            me = db.get(User, int(get_jwt_identity()))
-            th = db.get(ChatThread, thread_id)
-            if not me or not th or me.id not in (th.artist_id, th.client_id):
-                yield "event: error\ndata: forbidden\n\n"
-                return
+            verify_jwt_in_request()
+        except Exception:
+            yield "event: error\ndata: unauthorized\n\n"
+            return
 
-            last_id = request.args.get("last_id", type=int)
-            if not last_id:
-                # arranca en el último para no reemitir histórico
-                last = (
-                    db.query(ChatMessage)
-                    .filter(ChatMessage.thread_id == th.id)
-                    .order_by(ChatMessage.id.desc())
-                    .first()
-                )
-                last_id = last.id if last else 0
+        # Suscribe ANTES de resolver last_id para no perder mensajes entremedio
+        channel = chat_channel(thread_id)
+        try:
+            q = broker.subscribe(channel)
+        except BrokerFull:
+            yield "event: error\ndata: busy\n\n"
+            return
+        try:
+            # La DB solo se usa al conectar (permiso + catch-up); luego se libera
+            db = get_db()
+            try:
+                me = current_user()
+                th = db.get(ChatThread, thread_id)
+                if not me or not th or me.id not in (th.artist_id, th.client_id):
+                    yield "event: error\ndata: forbidden\n\n"
+                    return
+
+                last_id = request.args.get("last_id", type=int)
+                backlog = []
+                if last_id:
+                    msgs = (
+                        db.query(ChatMessage)
+                        .filter(ChatMessage.thread_id == th.id, ChatMessage.id > last_id)
+                        .order_by(ChatMessage.id.asc())
+                        .all()
+                    )
+                    backlog = [chat_message_payload(m) for m in msgs]
+                else:
+                    # arranca en el último para no reemitir histórico
+                    last_id = (
+                        db.query(func.max(ChatMessage.id))
+                        .filter(ChatMessage.thread_id == th.id)
+                        .scalar()
+                    ) or 0
+            finally:
+                db.close()
 
-            # bucle simple (dev). En prod, pasarse a Redis pub/sub o Socket.IO
-            while True:
-                msgs = (
-                    db.query(ChatMessage)
-                    .filter(ChatMessage.thread_id == th.id, ChatMessage.id > last_id)
-                    .order_by(ChatMessage.id.asc())
-                    .all()
-                )
-                for m in msgs:
-                    payload = {
-                        "id": m.id,
-                        "sender_id": m.sender_id,
-                        "text": m.text,
-                        "image_url": m.image_url,
-                        "created_at": m.created_at.isoformat()
-                    }
-                    yield f"event: message\ndata: {jsonify(payload).get_data(as_text=True)}\n\n"
-                    last_id = m.id
-                sleep(1.0)
+            for payload in backlog:
+                yield f"event: message\ndata: {jsonify(payload).get_data(as_text=True)}\n\n"
+                last_id = payload["id"]
+
+            for payload in sse_events(q):
+                if payload is None:
+                    yield ": keepalive\n\n"
+                    continue
+                if payload["id"] <= last_id:
+                    continue
+                yield f"event: message\ndata: {jsonify(payload).get_data(as_text=True)}\n\n"
+                last_id = payload["id"]
         finally:
-            db.close()
+            broker.unsubscribe(channel, q)
 
     return Response(event_stream(), mimetype="text/event-stream")
 @app.post("/upload/image")
 @jwt_required()
 def upload_image():
     """
-    body: { "base64": "data:image/png;base64,AAAA..." }  o  { "b64": "AAAA..." }
+    Sube una imagen y devuelve su URL /media/... (deduplicada por contenido).
+    - multipart/form-data con el archivo en "file" (o "image")
+    - cuerpo crudo con Content-Type image/* o application/octet-stream
+    - compat: JSON { "base64": "data:image/png;base64,AAAA..." }  o  { "b64": "AAAA..." }
+    Los dos primeros se escriben a disco por bloques. Máximo UPLOAD_MAX_BYTES (413).
     """
-    data = request.get_json(force=True) or {}
-    b64 = data.get("base64") or data.get("b64")
-    if not b64:
-        return jsonify({"msg":"base64 requerido"}), 400
-    # strip header
-    if "," in b64:
-        b64 = b64.split(",",1)[1]
-    raw = base64.b64decode(b64)
-    ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
-    fname = f"chat_{ts}.png"
-    (pathlib.Path(UPLOAD_DIR)/fname).write_bytes(raw)
-    base = os.getenv("PUBLIC_BASE_URL", request.host_url.rstrip("/"))
-    url = f"{base}/{UPLOAD_DIR}/{fname}".replace("//", "/").replace(":/", "://")
-    return jsonify({"url": url})
+    ctype = request.mimetype or ""
+    is_json = not (ctype == "multipart/form-data" or ctype.startswith("image/")
+                   or ctype == "application/octet-stream")
+    # base64 ocupa 4/3; el margen cubre los headers del multipart
+    body_cap = (UPLOAD_MAX_BYTES * 4 // 3 if is_json else UPLOAD_MAX_BYTES) + UPLOAD_CHUNK_BYTES
+    if request.content_length and request.content_length > body_cap:
+        return upload_too_large()
+
+    uid = int(get_jwt_identity())
+    try:
+        if ctype == "multipart/form-data":
+            f = request.files.get("file") or request.files.get("image")
+            if not f:
+                return jsonify({"msg": "file requerido (multipart)"}), 400
+            sha, ext = put_blob_stream(f.stream, uploader_id=uid)
+        elif not is_json:
+            sha, ext = put_blob_stream(request.stream, uploader_id=uid)
+        else:
+            # compat: base64 dentro de JSON (~2.3x el tamaño en memoria; preferir multipart/crudo)
+            metrics.inc("upload_base64_legacy")
+            data = request.get_json(force=True) or {}
+            b64 = data.get("base64") or data.get("b64")
+            if not b64:
+                return jsonify({"msg":"base64 requerido"}), 400
+            # strip header
+            if "," in b64:
+                b64 = b64.split(",",1)[1]
+            raw = base64.b64decode(b64)
+            if len(raw) > UPLOAD_MAX_BYTES:
+                return upload_too_large()
+            sha, ext = put_blob(raw, uploader_id=uid)
+    except UploadTooLarge:
+        return upload_too_large()
+    except ValueError:  # vacío, base64 inválido o no es png/jpg/gif/webp
+        return jsonify({"msg": "Imagen vacía o inválida (png, jpg, gif o webp)"}), 400
+    return jsonify({"url": media_url(sha, ext)})
 def ensure_bot_user(db) -> User:
     bot = db.query(User).filter_by(email="tink@bot").first()
     if not bot:
@@ -1288,11 +2862,12 @@ def ensure_bot_user(db) -> User:
         db.add(bot); db.commit()
     return bot
 REGION = (os.getenv("DASHSCOPE_REGION") or "intl").lower()
-GEN_ENDPOINT = (
-    "https://dashscope-intl.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
-    if REGION == "intl"
-    else "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
-)
+# DASHSCOPE_BASE_URL apunta a otro host (p.ej. tools/fake_dashscope.py) sin tocar la región
+DASHSCOPE_BASE_URL = (os.getenv("DASHSCOPE_BASE_URL") or (
+    "https://dashscope-intl.aliyuncs.com" if REGION == "intl" else "https://dashscope.aliyuncs.com"
+)).rstrip("/")
+GEN_ENDPOINT = f"{DASHSCOPE_BASE_URL}/api/v1/services/aigc/multimodal-generation/generation"
+TEXT_ENDPOINT = f"{DASHSCOPE_BASE_URL}/api/v1/services/aigc/text-generation/generation"
 
 def _headers():
     key = os.getenv("DASHSCOPE_API_KEY") or os.getenv("QWEN_API_KEY")
@@ -1338,75 +2913,296 @@ def looks_like_image_prompt(text: str) -> bool:
     triggers = ["img ", "/img", "imagen", "genera una imagen", "generar imagen", "hazme una imagen", "dibuja"]
     return any(k in t for k in triggers)
 
+# =========================
+# Cache de respuestas de qwen_reply
+# =========================
+QWEN_CACHE_TTL_SECONDS = float(os.getenv("QWEN_CACHE_TTL_SECONDS", str(24 * 3600)))
+QWEN_CACHE_SIZE = int(os.getenv("QWEN_CACHE_SIZE", "2000"))
+QWEN_CACHE_DB = os.getenv("QWEN_CACHE_DB")  # p.ej. qwen_cache.sqlite3 para sobrevivir reinicios
+
+def normalize_prompt(prompt: str) -> str:
+    """Clave de cache: sin @tink, sin tildes/puntuación, espacios colapsados."""
+    words = re.findall(r"\w+", fold_text(prompt))
+    return " ".join(w for w in words if w != "tink")
+
+class PromptCache:
+    """LRU en memoria con TTL y, si se configura `path`, copia persistente en SQLite."""
+    def __init__(self, maxsize: int, ttl: float, path: str | None = None):
+        self.ttl = ttl
+        self._mem = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._path = path
+        self._disk = None
+        self._disk_pid = None
+        self._disk_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Conexión SQLite del proceso actual, abierta en el primer uso (con _disk_lock tomado).
+        Nunca se abre al importar: gunicorn importa app en el master y una conexión
+        heredada por fork no es segura en SQLite.
+        """
+        if self._disk_pid != os.getpid():
+            self._disk = sqlite3.connect(self._path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS qwen_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._disk.commit()
+            self._disk_pid = os.getpid()
+        return self._disk
+
+    def get(self, key: str) -> str | None:
+        value = self._mem.get(key)
+        if value is not None or not self._path:
+            return value
+        with self._disk_lock:
+            row = self._conn().execute(
+                "SELECT value FROM qwen_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        if row:
+            self._mem.set(key, row[0])
+            return row[0]
+        return None
+
+    def set(self, key: str, value: str):
+        self._mem.set(key, value)
+        if self._path:
+            with self._disk_lock:
+                disk = self._conn()
+                disk.execute(
+                    "INSERT OR REPLACE INTO qwen_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, time.time() + self.ttl),
+                )
+                disk.execute("DELETE FROM qwen_cache WHERE expires_at <= ?", (time.time(),))
+                disk.commit()
+
+class SingleFlight:
+    """Llamadas concurrentes con la misma clave comparten una sola ejecución de fn()."""
+    class _Call:
+        __slots__ = ("done", "value", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+        if not leader:
+            metrics.inc("qwen_coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = fn()
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+qwen_cache = PromptCache(QWEN_CACHE_SIZE, QWEN_CACHE_TTL_SECONDS, QWEN_CACHE_DB)
+qwen_flight = SingleFlight()
+
+def _qwen_text_call(prompt: str, key: str) -> str:
+    """Una llamada a qwen-plus. Lanza excepción ante error HTTP o formato inesperado."""
+    t0 = time.monotonic()
+    resp = requests.post(
+        TEXT_ENDPOINT,
+        headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
+        json={
+            "model": "qwen-plus",
+            "input": {"messages": [{"role": "user", "content": prompt}]}
+        },
+        timeout=60
+    )
+    metrics.observe("qwen_upstream_ms", (time.monotonic() - t0) * 1000)
+    try:
+        resp.raise_for_status()
+    except Exception:
+        print("qwen_reply error:", resp.status_code, resp.text)
+        raise
+    j = resp.json()
+    out = j.get("output") or {}
+
+    # 1) output.text directo
+    txt = out.get("text")
+
+    # 2) output.choices[0].message.content (puede ser str o lista de bloques)
+    if not txt and "choices" in out:
+        choices = out.get("choices") or []
+        if choices:
+            msg = choices[0].get("message") or {}
+            content = msg.get("content")
+            if isinstance(content, str):
+                txt = content
+            elif isinstance(content, list):
+                parts = []
+                for c in content:
+                    if isinstance(c, dict) and "text" in c:
+                        parts.append(c["text"])
+                txt = "\n".join([p for p in parts if p])
+
+    if not txt:
+        raise ValueError("formato inesperado")
+    return txt
+
 def qwen_reply(prompt: str) -> str:
     key = os.getenv("QWEN_API_KEY") or os.getenv("DASHSCOPE_API_KEY")
     if not key:
         return "(@tink) Aquí. Deja más contexto y te ayudo 😉"
 
-    region = (os.getenv("DASHSCOPE_REGION") or "intl").lower()
-    endpoint = (
-        "https://dashscope-intl.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
-        if region == "intl"
-        else "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
-    )
+    cache_key = normalize_prompt(prompt)
+    if not cache_key:  # vacío o sólo puntuación: ni cache ni llamada
+        return "(@tink) Aquí. Deja más contexto y te ayudo 😉"
+    cached = qwen_cache.get(cache_key)
+    if cached is not None:
+        metrics.inc("qwen_cache_hits")
+        return cached
+    metrics.inc("qwen_cache_misses")
+
+    def fetch():
+        # otro líder pudo haberla guardado mientras esperábamos el turno
+        hit = qwen_cache.get(cache_key)
+        if hit is not None:
+            return hit
+        txt = _qwen_text_call(prompt, key)
+        qwen_cache.set(cache_key, txt)  # sólo respuestas buenas; los errores no se cachean
+        return txt
 
     try:
-        resp = requests.post(
-            endpoint,
-            headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
-            json={
-                "model": "qwen-plus",
-                "input": {"messages": [{"role": "user", "content": prompt}]}
-            },
-            timeout=60
-        )
-        resp.raise_for_status()
-        j = resp.json()
-        out = j.get("output") or {}
-
-        # 1) output.text directo
-        txt = out.get("text")
-
-        # 2) output.choices[0].message.content (puede ser str o lista de bloques)
-        if not txt and "choices" in out:
-            choices = out.get("choices") or []
-            if choices:
-                msg = choices[0].get("message") or {}
-                content = msg.get("content")
-                if isinstance(content, str):
-                    txt = content
-                elif isinstance(content, list):
-                    parts = []
-                    for c in content:
-                        if isinstance(c, dict) and "text" in c:
-                            parts.append(c["text"])
-                    txt = "\n".join([p for p in parts if p])
-
-        return txt or "(tink) sin respuesta (formato inesperado)"
+        return qwen_flight.do(cache_key, fetch)
+    except ValueError:
+        return "(@tink) Sin respuesta (formato inesperado)."
     except Exception as e:
+        print("qwen_reply error:", repr(e))
+        return "(@tink) Problemas con el asistente ahora mismo."
+
+# =========================
+# Bot @tink en segundo plano
+# =========================
+TINK_WORKERS = int(os.getenv("TINK_WORKERS", "4"))
+TINK_MAX_PENDING_PER_USER = int(os.getenv("TINK_MAX_PENDING_PER_USER", "3"))
+
+class KeyedSerialQueue:
+    """
+    Pool acotado donde los trabajos con la misma `key` (hilo de chat) corren en orden,
+    uno tras otro, y claves distintas en paralelo. Limita pendientes por usuario.
+    """
+    def __init__(self, workers: int, per_user_max: int, name: str = "jobs"):
+        self.per_user_max = per_user_max
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queues = {}                 # key -> deque[(user_id, fn)]; existe mientras hay un drain activo
+        self._per_user = defaultdict(int)
+
+    def submit(self, key, user_id: int, fn) -> bool:
+        """False si el usuario ya tiene per_user_max trabajos pendientes."""
+        with self._lock:
+            if self._per_user[user_id] >= self.per_user_max:
+                return False
+            self._per_user[user_id] += 1
+            q = self._queues.get(key)
+            start = q is None
+            if start:
+                q = self._queues[key] = deque()
+            q.append((user_id, fn))
+        if start:
+            self._pool.submit(self._drain, key)
+        return True
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                q = self._queues[key]
+                if not q:
+                    del self._queues[key]
+                    return
+                user_id, fn = q.popleft()
+            try:
+                fn()
+            except Exception as e:
+                print("job error:", repr(e))
+            finally:
+                with self._lock:
+                    self._per_user[user_id] -= 1
+                    if self._per_user[user_id] <= 0:
+                        del self._per_user[user_id]
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(self._per_user.values())
+
+tink_jobs = KeyedSerialQueue(TINK_WORKERS, TINK_MAX_PENDING_PER_USER, name="tink")
+metrics.gauge("tink_jobs_pending", tink_jobs.pending)
+
+def tink_answer(text: str) -> str:
+    """Texto de respuesta del bot (imagen vía Qwen o texto con qwen_reply). Puede tardar."""
+    if looks_like_image_prompt(text):
         try:
-            detail = resp.text  # puede no existir si falló antes
-        except:
-            detail = ""
-        print("qwen_reply error:", repr(e), detail)
+            urls = generate_image_via_qwen(text)
+        except RuntimeError:
+            return "(@tink) Falta DASHSCOPE_API_KEY en el .env para generar imágenes."
+        except Exception as e:
+            return f"(@tink) Falló la generación de imagen: {e}"
+        if urls:
+            return "(@tink) Imagen lista:\n" + "\n".join(urls)
+        return "(@tink) No recibí URL de imagen en la respuesta."
+    try:
+        return qwen_reply(text)
+    except Exception:
         return "(@tink) Problemas con el asistente ahora mismo."
+
+def post_bot_message(db, thread_id: int, bot_id: int, text: str):
+    """Inserta un mensaje del bot en el hilo, actualiza no leídos y lo publica por SSE."""
+    th = db.get(ChatThread, thread_id)
+    if not th:
+        return None
+    bot_msg = ChatMessage(
+        thread_id=th.id,
+        sender_id=bot_id,
+        text=text,
+        created_at=datetime.now(timezone.utc)
+    )
+    db.add(bot_msg)
+    th.updated_at = datetime.now(timezone.utc)
+    bump_unread(th, bot_id)
+    db.commit()
+    publish_chat_message(bot_msg)
+    return bot_msg
+
+def _tink_reply_job(thread_id: int, bot_id: int, text: str):
+    t0 = time.monotonic()
+    bot_text = tink_answer(text)  # llamada lenta SIN conexión de DB tomada
+    db = SessionLocal()
+    try:
+        post_bot_message(db, thread_id, bot_id, bot_text)
+    finally:
+        db.close()
+        SessionLocal.remove()
+    metrics.observe("tink_job_ms", (time.monotonic() - t0) * 1000)
 # === Helpers (guardar archivos y/o convertir a base64) ===
 def _save_upload(fieldname):
     f = request.files[fieldname]
-    ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
-    ext = (pathlib.Path(f.filename).suffix or ".png").lower()
-    safe = f"{fieldname}_{ts}{ext}"
-    out = pathlib.Path(UPLOAD_DIR) / safe
-    pathlib.Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
-    f.save(out)
-    base = os.getenv("PUBLIC_BASE_URL", request.host_url.rstrip("/"))
-    url = f"{base}/{UPLOAD_DIR}/{safe}".replace("//", "/").replace(":/", "://")
-    return out, url
+    sha, ext = put_blob_stream(f.stream)
+    return blob_path(sha), media_url(sha, ext)
 
 def _b64_image(path):
-    mt, _ = mimetypes.guess_type(str(path))
-    mt = mt or "image/png"
-    data = base64.b64encode(open(path, "rb").read()).decode("utf-8")
+    raw = open(path, "rb").read()
+    mt = mimetypes.types_map.get(sniff_image_ext(raw) or "", "image/png")
+    data = base64.b64encode(raw).decode("utf-8")
     return f"data:{mt};base64,{data}"
 
 # === Endpoint: fusión brazo + tatuaje con Qwen-Image-Edit ===
@@ -1416,8 +3212,13 @@ def qwen_tattoo_preview():
     if "arm" not in request.files or "tattoo" not in request.files:
         return jsonify({"error": "Sube 'arm' y 'tattoo' como archivos"}), 400
 
-    arm_path, arm_url = _save_upload("arm")
-    tat_path, tat_url = _save_upload("tattoo")
+    try:
+        arm_path, arm_url = _save_upload("arm")
+        tat_path, tat_url = _save_upload("tattoo")
+    except UploadTooLarge:
+        return jsonify({"error": f"Imagen demasiado grande (máx {UPLOAD_MAX_BYTES // (1024 * 1024)} MB)"}), 413
+    except ValueError:
+        return jsonify({"error": "'arm' y 'tattoo' deben ser imágenes png, jpg, gif o webp"}), 400
 
     # 2) Parámetros opcionales
     use_base64 = (request.form.get("use_base64", "false").lower() == "true")
@@ -1497,16 +3298,11 @@ def qwen_tattoo_preview():
 
     # 6) Descargar y persistir local (porque los links del proveedor expiran)
     local_urls = []
-    pathlib.Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
-    base = os.getenv("PUBLIC_BASE_URL", request.host_url.rstrip("/"))
-    for i, u in enumerate(provider_urls):
+    for u in provider_urls:
         try:
             img_bytes = requests.get(u, timeout=120).content
-            fname = f"tattoo_qwen_{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}_{i}.png"
-            out = pathlib.Path(UPLOAD_DIR) / fname
-            with open(out, "wb") as f:
-                f.write(img_bytes)
-            local_urls.append(f"{base}/{UPLOAD_DIR}/{fname}".replace("//", "/").replace(":/", "://"))
+            sha, ext = put_blob(img_bytes)
+            local_urls.append(media_url(sha, ext))
         except Exception:
             # si falla descarga, devolvemos el link temporal del proveedor
             local_urls.append(u)
@@ -1561,16 +3357,325 @@ def login():
 @jwt_required(refresh=True)
 def refresh_token():
     ident = get_jwt_identity()
-    new_access = create_access_token(identity=ident)
+    user = current_user()
+    if not user:
+        return jsonify({"msg": "No autorizado"}), 401
+    new_access = create_access_token(identity=ident, additional_claims={"role": user.role})
     return jsonify({"access_token": new_access})
 
+# =========================
+# Búsqueda full-text (catálogo)
+# =========================
+def fold_text(s: str | None) -> str:
+    """Minúsculas y sin tildes ("Tatuaje Pequeño" -> "tatuaje pequeno")."""
+    s = unicodedata.normalize("NFKD", s or "")
+    return "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+
+def search_terms(qtext: str) -> list[str]:
+    return re.findall(r"\w+", fold_text(qtext))[:8]
+
+def _design_search_fields(db, d: Design) -> tuple[str, str, str]:
+    artist = db.get(User, d.artist_id)
+    artist_text = f"{artist.name} {artist.email}" if artist else ""
+    return fold_text(d.title), fold_text(d.description), fold_text(artist_text)
+
+class SearchIndex:
+    """
+    Interfaz del índice de búsqueda de diseños. index_design/remove_design se
+    llaman dentro de la transacción del endpoint que escribe el diseño.
+    search() devuelve ids ordenados por relevancia, o None si el backend no
+    indexa (list_designs cae al filtro ILIKE de siempre).
+    """
+    def setup(self):
+        pass
+
+    def rebuild(self, db):
+        pass
+
+    def index_design(self, db, d: Design):
+        pass
+
+    def remove_design(self, db, design_id: int):
+        pass
+
+    def search(self, db, qtext: str, *, artist_only: bool, limit: int) -> list[int] | None:
+        return None
+
+class SqliteFtsIndex(SearchIndex):
+    """FTS5 con rowid = designs.id; prefijos y texto ya plegado (sin tildes)."""
+    def setup(self):
+        with engine.begin() as conn:
+            exists = conn.execute(sql_text(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='designs_fts'"
+            )).first()
+            if not exists:
+                conn.execute(sql_text(
+                    "CREATE VIRTUAL TABLE designs_fts USING fts5("
+                    "title, description, artist, "
+                    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                ))
+        db = SessionLocal()
+        try:
+            n_fts = db.execute(sql_text("SELECT count(*) FROM designs_fts")).scalar()
+            n_designs = db.query(func.count(Design.id)).scalar()
+            if n_fts != n_designs:
+                self.rebuild(db)
+        finally:
+            db.close()
+
+    def rebuild(self, db):
+        db.execute(sql_text("DELETE FROM designs_fts"))
+        for d in db.query(Design).options(joinedload(Design.artist)).yield_per(500):
+            self.index_design(db, d)
+        db.commit()
+
+    def index_design(self, db, d: Design):
+        title, description, artist = _design_search_fields(db, d)
+        db.execute(sql_text("DELETE FROM designs_fts WHERE rowid = :id"), {"id": d.id})
+        db.execute(
+            sql_text("INSERT INTO designs_fts(rowid, title, description, artist) VALUES (:id, :t, :d, :a)"),
+            {"id": d.id, "t": title, "d": description, "a": artist},
+        )
+
+    def remove_design(self, db, design_id: int):
+        db.execute(sql_text("DELETE FROM designs_fts WHERE rowid = :id"), {"id": design_id})
+
+    def search(self, db, qtext, *, artist_only, limit):
+        terms = search_terms(qtext)
+        if not terms:
+            return []
+        match = " ".join(f'"{t}"*' for t in terms)
+        if artist_only:
+            match = f"artist : ({match})"
+        rows = db.execute(
+            sql_text(
+                "SELECT rowid FROM designs_fts WHERE designs_fts MATCH :m "
+                "ORDER BY bm25(designs_fts, 10.0, 3.0, 1.0) LIMIT :n"
+            ),
+            {"m": match, "n": limit},
+        ).all()
+        return [r[0] for r in rows]
+
+class PostgresSearchIndex(SearchIndex):
+    """tsvector con pesos (A título, B descripción, C artista) e índice GIN."""
+    def setup(self):
+        with engine.begin() as conn:
+            conn.execute(sql_text(
+                "CREATE TABLE IF NOT EXISTS design_search ("
+                "design_id INTEGER PRIMARY KEY REFERENCES designs(id) ON DELETE CASCADE, "
+                "document tsvector NOT NULL)"
+            ))
+            conn.execute(sql_text(
+                "CREATE INDEX IF NOT EXISTS ix_design_search_document ON design_search USING GIN (document)"
+            ))
+        db = SessionLocal()
+        try:
+            n_idx = db.execute(sql_text("SELECT count(*) FROM design_search")).scalar()
+            if n_idx != db.query(func.count(Design.id)).scalar():
+                self.rebuild(db)
+        finally:
+            db.close()
+
+    def rebuild(self, db):
+        db.execute(sql_text("DELETE FROM design_search"))
+        for d in db.query(Design).yield_per(500):
+            self.index_design(db, d)
+        db.commit()
+
+    def index_design(self, db, d: Design):
+        title, description, artist = _design_search_fields(db, d)
+        db.execute(
+            sql_text(
+                "INSERT INTO design_search(design_id, document) VALUES (:id, "
+                "setweight(to_tsvector('simple', :t), 'A') || "
+                "setweight(to_tsvector('simple', :d), 'B') || "
+                "setweight(to_tsvector('simple', :a), 'C')) "
+                "ON CONFLICT (design_id) DO UPDATE SET document = EXCLUDED.document"
+            ),
+            {"id": d.id, "t": title, "d": description, "a": artist},
+        )
+
+    def remove_design(self, db, design_id: int):
+        db.execute(sql_text("DELETE FROM design_search WHERE design_id = :id"), {"id": design_id})
+
+    def search(self, db, qtext, *, artist_only, limit):
+        terms = search_terms(qtext)
+        if not terms:
+            return []
+        suffix = ":*C" if artist_only else ":*"
+        tsq = " & ".join(f"{t}{suffix}" for t in terms)
+        rows = db.execute(
+            sql_text(
+                "SELECT design_id FROM design_search, to_tsquery('simple', :q) query "
+                "WHERE document @@ query ORDER BY ts_rank(document, query) DESC, design_id DESC LIMIT :n"
+            ),
+            {"q": tsq, "n": limit},
+        ).all()
+        return [r[0] for r in rows]
+
+def _sqlite_has_fts5() -> bool:
+    import sqlite3
+    try:
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        con.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+def make_search_index() -> SearchIndex:
+    backend = (os.getenv("SEARCH_BACKEND") or "").lower()
+    if backend == "like":
+        return SearchIndex()
+    if engine.dialect.name == "sqlite" and _sqlite_has_fts5():
+        return SqliteFtsIndex()
+    if engine.dialect.name == "postgresql":
+        return PostgresSearchIndex()
+    return SearchIndex()
+
+search_index = make_search_index()
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Reconstruye el índice full-text de diseños."""
+    db = get_db()
+    try:
+        search_index.rebuild(db)
+    finally:
+        db.close()
+
 # =========================
 # Designs (Catálogo)
 # =========================
+DESIGNS_PAGE_SIZE = int(os.getenv("DESIGNS_PAGE_SIZE", "100"))
+DESIGNS_MAX_PAGE = 200
+CATALOG_VERSION = "catalog"  # AppCounter que sube con cada escritura de diseños/favoritos
+
+# Páginas del catálogo ya serializadas (sin is_favorited), por versión + filtros
+catalog_cache = LRUCache(int(os.getenv("CATALOG_CACHE_SIZE", "256")), ttl=float(os.getenv("CATALOG_CACHE_TTL", "30")))
+
+def bump_catalog_version(db):
+    bump_counter(db, CATALOG_VERSION)
+    catalog_cache.clear()
+
+def adjust_like_counters(db, design_id: int, artist_id: int, delta: int):
+    """likes_count del diseño y likes_total del artista, como col = col + delta en la misma transacción."""
+    db.execute(update(Design).where(Design.id == design_id)
+               .values(likes_count=Design.likes_count + delta)
+               .execution_options(synchronize_session=False))
+    db.execute(update(User).where(User.id == artist_id)
+               .values(likes_total=User.likes_total + delta)
+               .execution_options(synchronize_session=False))
+
+def rebuild_like_counters(db) -> None:
+    """Recalcula likes_count, designs_count y likes_total desde favorites/designs."""
+    db.execute(update(Design).values(likes_count=(
+        select(func.count(Favorite.id)).where(Favorite.design_id == Design.id).scalar_subquery()
+    )).execution_options(synchronize_session=False))
+    db.execute(update(User).values(
+        designs_count=select(func.count(Design.id)).where(Design.artist_id == User.id).scalar_subquery(),
+        likes_total=select(func.coalesce(func.sum(Design.likes_count), 0))
+            .where(Design.artist_id == User.id).scalar_subquery(),
+    ).execution_options(synchronize_session=False))
+    db.commit()
+
+@app.cli.command("rebuild-like-counters")
+def rebuild_like_counters_command():
+    """Recalcula los contadores materializados de likes y diseños."""
+    db = get_db()
+    try:
+        rebuild_like_counters(db)
+    finally:
+        db.close()
+
+def catalog_query(db, qtext: str, artist_id: int | None, limit: int, cursor_key):
+    """
+    Único armado de filtros y orden del catálogo: (query, ranked_ids).
+    Con búsqueda full-text ranked_ids trae el orden por relevancia (una sola página);
+    si no, la query ya viene ordenada por (created_at, id) desde el cursor.
+    """
+    q = db.query(Design).options(joinedload(Design.artist))
+    ranked_ids = None
+    if not artist_id and qtext:
+        artist_only = qtext.startswith('@')
+        ranked_ids = search_index.search(
+            db, qtext[1:] if artist_only else qtext, artist_only=artist_only, limit=limit
+        )
+
+    if artist_id:
+        q = q.filter(Design.artist_id == artist_id)
+    elif ranked_ids is not None:
+        q = q.filter(Design.id.in_(ranked_ids))
+    elif qtext:
+        if qtext.startswith('@'):
+            term = f"%{qtext[1:].strip()}%"
+            q = (
+                q.join(User, User.id == Design.artist_id)
+                 .filter(or_(User.name.ilike(term), User.email.ilike(term)))
+            )
+        else:
+            term = f"%{qtext}%"
+            q = q.filter(or_(Design.title.ilike(term),
+                             Design.description.ilike(term)))
+    if ranked_ids is None:
+        if cursor_key:
+            c_ts, c_id = cursor_key
+            q = q.filter(or_(
+                Design.created_at < c_ts,
+                and_(Design.created_at == c_ts, Design.id < c_id),
+            ))
+        q = q.order_by(Design.created_at.desc(), Design.id.desc())
+    return q, ranked_ids
+
+def _build_catalog_page(db, qtext: str, artist_id: int | None, limit: int, cursor_key) -> tuple[list[dict], str | None]:
+    """Página anónima del catálogo (cacheable): (items, next_cursor)."""
+    q, ranked_ids = catalog_query(db, qtext, artist_id, limit, cursor_key)
+    next_cursor = None
+    if ranked_ids is not None:
+        pos = {did: i for i, did in enumerate(ranked_ids)}
+        designs = sorted(q.all(), key=lambda d: pos[d.id])
+    else:
+        designs = q.limit(limit + 1).all()
+        if len(designs) > limit:
+            designs = designs[:limit]
+            next_cursor = encode_cursor(designs[-1].created_at, designs[-1].id)
+
+    items = [
+        {
+            "id": d.id,
+            "title": d.title,
+            "description": d.description,
+            "image_url": d.image_url,
+            "image_variants": image_variants(d.image_url),
+            "price": d.price,
+            "artist_id": d.artist_id,
+            "artist_name": d.artist.name if d.artist else None,
+            "likes_count": int(d.likes_count or 0),
+            "created_at": d.created_at.isoformat(),
+        } for d in designs
+    ]
+    return items, next_cursor
+
 @app.get("/designs")
 def list_designs():
+    """
+    Catálogo paginado (más nuevos primero).
+    Query: ?q=<texto|@artista>&artist_id=<int>&limit=<int>&cursor=<X-Next-Cursor>
+    Con q (búsqueda) los resultados vienen por relevancia y en una sola página
+    de hasta `limit` elementos.
+
+    Responde con ETag/Last-Modified ligados a la versión del catálogo: si no
+    cambió nada desde la última vez, 304 sin cuerpo. La página anónima sale de
+    un LRU en memoria y is_favorited se superpone aparte por usuario.
+    """
     qtext = (request.args.get("q") or "").strip()
     artist_id = request.args.get("artist_id", type=int)
+    limit = page_limit(DESIGNS_PAGE_SIZE, DESIGNS_MAX_PAGE)
+    cursor = request.args.get("cursor")
+    try:
+        cursor_key = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"msg": "cursor inválido"}), 400
 
     db = get_db()
     try:
@@ -1583,59 +3688,42 @@ def list_designs():
         except Exception:
             pass
 
-        q = db.query(Design)
-        if artist_id:
-            q = q.filter(Design.artist_id == artist_id)
-        elif qtext:
-            if qtext.startswith('@'):
-                term = f"%{qtext[1:].strip()}%"
-                from sqlalchemy import or_
-                q = (
-                    q.join(User, User.id == Design.artist_id)
-                     .filter(or_(User.name.ilike(term), User.email.ilike(term)))
-                )
-            else:
-                term = f"%{qtext}%"
-                from sqlalchemy import or_
-                q = q.filter(or_(Design.title.ilike(term),
-                                 Design.description.ilike(term)))
-        designs = q.order_by(Design.created_at.desc()).all()
-
-        # Precalcular likes y si el user ya likeó
-        ids = [d.id for d in designs]
-        likes_map = {}
-        if ids:
-            rows = (
-                db.query(Favorite.design_id, func.count(Favorite.id))
-                  .filter(Favorite.design_id.in_(ids))
-                  .group_by(Favorite.design_id).all()
-            )
-            likes_map = {did: cnt for (did, cnt) in rows}
+        version, last_modified = read_counter(db, CATALOG_VERSION)
+        page_key = (version, qtext, artist_id, limit, cursor or "")
+        etag = hashlib.sha1(repr((page_key, uid)).encode()).hexdigest()[:24]
+
+        if request.if_none_match.contains_weak(etag):
+            metrics.inc("catalog_not_modified")
+            resp = Response(status=304)
+            resp.set_etag(etag, weak=True)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+
+        cached = catalog_cache.get(page_key)
+        if cached is None:
+            metrics.inc("catalog_cache_misses")
+            cached = _build_catalog_page(db, qtext, artist_id, limit, cursor_key)
+            catalog_cache.set(page_key, cached)
+        else:
+            metrics.inc("catalog_cache_hits")
+        items, next_cursor = cached
 
+        # Overlay por usuario: una consulta sobre los ids de la página
+        ids = [it["id"] for it in items]
         fav_set = set()
         if uid and ids:
             mine = db.query(Favorite.design_id)\
                      .filter(Favorite.user_id == uid, Favorite.design_id.in_(ids)).all()
             fav_set = {did for (did,) in mine}
 
-        # ---------- RESPUESA SIN CACHÉ ----------
-        resp = jsonify([
-            {
-                "id": d.id,
-                "title": d.title,
-                "description": d.description,
-                "image_url": d.image_url,
-                "price": d.price,
-                "artist_id": d.artist_id,
-                "artist_name": d.artist.name if d.artist else None,
-                "likes_count": int(likes_map.get(d.id, 0)),
-                "is_favorited": bool(d.id in fav_set),
-                "created_at": d.created_at.isoformat(),
-            } for d in designs
-        ])
-        resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-        resp.headers["Pragma"] = "no-cache"
-        resp.headers["Expires"] = "0"
+        resp = jsonify([{**it, "is_favorited": it["id"] in fav_set} for it in items])
+        # El cliente puede guardar la respuesta pero debe revalidar siempre (ETag)
+        resp.set_etag(etag, weak=True)
+        if last_modified:
+            resp.last_modified = last_modified.replace(tzinfo=timezone.utc)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        if next_cursor:
+            resp.headers["X-Next-Cursor"] = next_cursor
         return resp
     finally:
         db.close()
@@ -1651,6 +3739,8 @@ def create_design():
 
     db = get_db()
     try:
+        if not can_reference_blob(db, data.get("image_url"), request.current_user.id):
+            return jsonify({"msg": "image_url debe ser una imagen subida por ti"}), 400
         d = Design(
             title=title,
             description=data.get("description"),
@@ -1659,6 +3749,13 @@ def create_design():
             artist_id=request.current_user.id
         )
         db.add(d)
+        db.flush()
+        adjust_blob_refcount(db, d.image_url, +1)
+        search_index.index_design(db, d)
+        db.execute(update(User).where(User.id == d.artist_id)
+                   .values(designs_count=User.designs_count + 1)
+                   .execution_options(synchronize_session=False))
+        bump_catalog_version(db)
         db.commit()
         return jsonify({"msg": "creado", "id": d.id}), 201
     finally:
@@ -1673,9 +3770,17 @@ def update_design(design_id):
         d = db.get(Design, design_id)
         if not d or d.artist_id != request.current_user.id:
             return jsonify({"msg": "No encontrado o sin permiso"}), 404
+        if "image_url" in data and data["image_url"] != d.image_url:
+            if not can_reference_blob(db, data["image_url"], d.artist_id, current=d.image_url):
+                return jsonify({"msg": "image_url debe ser una imagen subida por ti"}), 400
+            adjust_blob_refcount(db, d.image_url, -1)
+            adjust_blob_refcount(db, data["image_url"], +1)
         for field in ("title", "description", "image_url", "price"):
             if field in data:
                 setattr(d, field, data[field])
+        if "title" in data or "description" in data:
+            search_index.index_design(db, d)
+        bump_catalog_version(db)
         db.commit()
         return jsonify({"msg": "actualizado"})
     finally:
@@ -1689,7 +3794,17 @@ def delete_design(design_id):
         d = db.get(Design, design_id)
         if not d or d.artist_id != request.current_user.id:
             return jsonify({"msg": "No encontrado o sin permiso"}), 404
+        search_index.remove_design(db, d.id)
+        # sus likes dejan de contar para el artista (y no quedan favoritos huérfanos)
+        # se resta lo que realmente se borró (d.likes_count en memoria puede estar atrasado)
+        removed = db.query(Favorite).filter(Favorite.design_id == d.id).delete(synchronize_session=False)
+        db.execute(update(User).where(User.id == d.artist_id)
+                   .values(designs_count=User.designs_count - 1,
+                           likes_total=User.likes_total - removed)
+                   .execution_options(synchronize_session=False))
+        adjust_blob_refcount(db, d.image_url, -1)
         db.delete(d)
+        bump_catalog_version(db)
         db.commit()
         return jsonify({"msg": "eliminado"})
     finally:
@@ -1700,11 +3815,19 @@ def add_favorite(design_id):
     db = get_db()
     try:
         uid = int(get_jwt_identity())
-        if not db.get(Design, design_id):
+        d = db.get(Design, design_id)
+        if not d:
             return jsonify({"msg":"Diseño no encontrado"}), 404
-        if not db.query(Favorite).filter_by(user_id=uid, design_id=design_id).first():
-            db.add(Favorite(user_id=uid, design_id=design_id))
+        # ON CONFLICT DO NOTHING sobre uq_fav: con un doble tap simultáneo sólo uno inserta
+        # (rowcount 1) y sólo ése suma likes y cambia la versión del catálogo
+        res = db.execute(insert_ignore_duplicates(Favorite.__table__, ["user_id", "design_id"])
+                         .values(user_id=uid, design_id=design_id, created_at=datetime.utcnow()))
+        if res.rowcount == 1:
+            adjust_like_counters(db, d.id, d.artist_id, +1)
+            bump_catalog_version(db)
             db.commit()
+        else:
+            db.rollback()
         return jsonify({"msg":"ok"})
     finally:
         db.close()
@@ -1715,43 +3838,93 @@ def remove_favorite(design_id):
     db = get_db()
     try:
         uid = int(get_jwt_identity())
-        f = db.query(Favorite).filter_by(user_id=uid, design_id=design_id).first()
-        if f:
-            db.delete(f); db.commit()
+        # DELETE directo: con dos "unlike" simultáneos sólo uno borra la fila (rowcount 1)
+        # y sólo ése descuenta; el otro no toca los contadores
+        removed = db.query(Favorite).filter_by(user_id=uid, design_id=design_id).delete(synchronize_session=False)
+        if removed == 1:
+            d = db.get(Design, design_id)
+            if d:
+                adjust_like_counters(db, d.id, d.artist_id, -1)
+            bump_catalog_version(db)
+            db.commit()
+        else:
+            db.rollback()
         return jsonify({"msg":"ok"})
     finally:
         db.close()
 
+FAVORITES_PAGE_SIZE = int(os.getenv("FAVORITES_PAGE_SIZE", "100"))
+FAVORITES_MAX_PAGE = 200
+FAVORITES_COMPACT_MAX = 5000
+
 @app.get("/favorites/me")
 @jwt_required()
 def favorites_me():
+    """
+    Favoritos del usuario, más recientes primero.
+    Query: ?limit=<int>&cursor=<X-Next-Cursor>
+           ?compact=1 -> solo [design_id, ...] (sync del lado del cliente; sin
+                         límite por defecto, hasta FAVORITES_COMPACT_MAX)
+    """
+    compact = request.args.get("compact", default=0, type=int) == 1
+    if compact:
+        limit = page_limit(FAVORITES_COMPACT_MAX, FAVORITES_COMPACT_MAX)
+    else:
+        limit = page_limit(FAVORITES_PAGE_SIZE, FAVORITES_MAX_PAGE)
+    cursor = request.args.get("cursor")
+    try:
+        cursor_key = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"msg": "cursor inválido"}), 400
+
     db = get_db()
     try:
         uid = int(get_jwt_identity())
-        rows = (
-            db.query(Favorite, Design, User)
-              .join(Design, Design.id == Favorite.design_id)
-              .join(User, User.id == Design.artist_id)
-              .filter(Favorite.user_id == uid)
-              .order_by(Favorite.created_at.desc())
-              .all()
-        )
-        out = []
-        for fav, d, artist in rows:
-            # conteo likes
-            cnt = db.query(Favorite).filter(Favorite.design_id==d.id).count()
-            out.append({
-                "design_id": d.id,
-                "title": d.title,
-                "description": d.description,
-                "image_url": d.image_url,
-                "price": d.price,
-                "artist_id": d.artist_id,
-                "artist_name": artist.name if artist else None,
-                "likes_count": cnt,
-                "fav_at": fav.created_at.isoformat(),
-            })
-        return jsonify(out)
+        if compact:
+            q = db.query(Favorite.design_id, Favorite.created_at, Favorite.id)
+        else:
+            # una sola consulta por página: favorito + diseño (likes materializados) + artista
+            q = (
+                db.query(Favorite, Design, User)
+                  .join(Design, Design.id == Favorite.design_id)
+                  .join(User, User.id == Design.artist_id)
+            )
+        q = q.filter(Favorite.user_id == uid)
+        if cursor_key:
+            c_ts, c_id = cursor_key
+            q = q.filter(or_(
+                Favorite.created_at < c_ts,
+                and_(Favorite.created_at == c_ts, Favorite.id < c_id),
+            ))
+        rows = q.order_by(Favorite.created_at.desc(), Favorite.id.desc()).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1] if compact else rows[-1][0]
+            next_cursor = encode_cursor(last.created_at, last.id)
+
+        if compact:
+            resp = jsonify([design_id for design_id, _, _ in rows])
+        else:
+            out = []
+            for fav, d, artist in rows:
+                out.append({
+                    "design_id": d.id,
+                    "title": d.title,
+                    "description": d.description,
+                    "image_url": d.image_url,
+                    "image_variants": image_variants(d.image_url),
+                    "price": d.price,
+                    "artist_id": d.artist_id,
+                    "artist_name": artist.name if artist else None,
+                    "likes_count": int(d.likes_count or 0),
+                    "fav_at": fav.created_at.isoformat(),
+                })
+            resp = jsonify(out)
+        if next_cursor:
+            resp.headers["X-Next-Cursor"] = next_cursor
+        return resp
     finally:
         db.close()
 @app.get("/artists/<int:artist_id>")
@@ -1761,16 +3934,10 @@ def get_artist(artist_id):
         a = db.get(User, artist_id)
         if not a or a.role != "artist":
             return jsonify({"msg":"Artista no encontrado"}), 404
-        designs_count = db.query(Design).filter(Design.artist_id==a.id).count()
-        likes_total = (
-            db.query(func.count(Favorite.id))
-              .join(Design, Design.id == Favorite.design_id)
-              .filter(Design.artist_id == a.id).scalar()
-        ) or 0
         return jsonify({
             "id": a.id, "name": a.name, "email": a.email,
-            "designs_count": int(designs_count),
-            "likes_total": int(likes_total),
+            "designs_count": int(a.designs_count or 0),
+            "likes_total": int(a.likes_total or 0),
         })
     finally:
         db.close()
@@ -1804,7 +3971,7 @@ def book_appointment():
         return jsonify({"msg": "Faltan campos requeridos"}), 400
 
     try:
-        start_time = datetime.fromisoformat(start_time_s)
+        start_time = parse_dt(start_time_s)
     except Exception:
         return jsonify({"msg": "start_time inválido (ISO 8601)"}), 400
 
@@ -1819,21 +3986,31 @@ def book_appointment():
         if design.artist_id != artist.id:
             return jsonify({"msg": "El diseño no pertenece a ese artista"}), 400
 
-        if check_overlap(db, artist.id, start_time, end_time):
-            return jsonify({"msg": "Horario no disponible"}), 409
-
-        appt = Appointment(
-            design_id=design.id,
-            client_id=request.current_user.id,
-            artist_id=artist.id,
-            start_time=start_time,
-            end_time=end_time,
-            status="booked",
-            pay_now=pay_now,
-            paid=False
-        )
-        db.add(appt)
-        db.commit()
+        def reserve():
+            # chequeo + insert dentro del mismo lock/transacción
+            with artist_booking_lock(db, artist.id):
+                if check_overlap(db, artist.id, start_time, end_time):
+                    raise BookingConflict("Horario no disponible")
+                appt = Appointment(
+                    design_id=design.id,
+                    client_id=request.current_user.id,
+                    artist_id=artist.id,
+                    start_time=start_time,
+                    end_time=end_time,
+                    status="booked",
+                    pay_now=pay_now,
+                    paid=False
+                )
+                db.add(appt)
+                db.commit()
+                return appt
+
+        try:
+            appt = run_booking(db, reserve)
+        except BookingConflict as e:
+            return jsonify({"msg": str(e)}), 409
+        except OperationalError:
+            return jsonify({"msg": "Agenda ocupada, intenta nuevamente"}), 503
 
         # 🔔 Notificación al tatuador
         try:
@@ -1856,44 +4033,147 @@ def book_appointment():
     finally:
         db.close()
 
-from sqlalchemy.orm import joinedload
-# ...
+@app.post("/appointments/check")
+@jwt_required()
+def check_appointments_batch():
+    """
+    Valida varios horarios candidatos de un artista en una sola llamada.
+    body:
+    {
+      "artist_id": 2,
+      "intervals": [
+        {"start_time": "2025-09-12T15:00:00", "duration_minutes": 90},
+        {"start_time": "2025-09-12T18:00:00", "end_time": "2025-09-12T19:00:00"}
+      ]
+    }
+    Es una validación previa: la reserva vuelve a verificar al escribir.
+    """
+    data = request.get_json(force=True) or {}
+    try:
+        artist_id = int(data.get("artist_id"))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "artist_id requerido"}), 400
+    raw = data.get("intervals") or []
+    if not isinstance(raw, list) or not raw:
+        return jsonify({"msg": "intervals requerido (lista)"}), 400
+    if len(raw) > OVERLAP_MAX_BATCH:
+        return jsonify({"msg": f"Máximo {OVERLAP_MAX_BATCH} intervalos"}), 400
+
+    intervals = []
+    try:
+        for it in raw:
+            start = parse_dt(it["start_time"])
+            if it.get("end_time"):
+                end = parse_dt(it["end_time"])
+            else:
+                end = start + timedelta(minutes=int(it.get("duration_minutes") or DEFAULT_APPT_MINUTES))
+            if end <= start:
+                return jsonify({"msg": "end_time debe ser mayor que start_time"}), 400
+            intervals.append((start, end))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"msg": "Intervalo inválido (start_time ISO 8601)"}), 400
+
+    db = get_db()
+    try:
+        results = find_overlaps(db, artist_id, intervals)
+        return jsonify([
+            {"start_time": s.isoformat(), "end_time": e.isoformat(), **r}
+            for (s, e), r in zip(intervals, results)
+        ])
+    finally:
+        db.close()
+
+APPOINTMENTS_PAGE_SIZE = int(os.getenv("APPOINTMENTS_PAGE_SIZE", "100"))
+APPOINTMENTS_MAX_PAGE = 200
+APPOINTMENTS_EXPANDS = {"design", "artist", "client"}
+
+def _parse_when(raw: str, end_of_day: bool = False) -> datetime:
+    """'YYYY-MM-DD' o ISO 8601. Con end_of_day, una fecha sola cubre el día completo."""
+    raw = raw.strip()
+    dt = parse_dt(raw)
+    if end_of_day and len(raw) == 10:
+        dt += timedelta(days=1)
+    return dt
+
 @app.get("/appointments/me")
 @jwt_required()
 def my_appointments():
-    from flask_jwt_extended import get_jwt_identity
+    """
+    Citas del usuario (cliente o artista), más recientes primero.
+    Query:
+      ?from=2025-01-01&to=2025-12-31   ventana sobre start_time (to incluye el día)
+      ?status=booked,confirmed          filtra por estado
+      ?limit=<int>&cursor=<X-Next-Cursor>
+      ?expand=design,artist,client      enriquecido opcional (por defecto sólo columnas de la cita)
+    """
+    limit = page_limit(APPOINTMENTS_PAGE_SIZE, APPOINTMENTS_MAX_PAGE)
+    try:
+        d_from = _parse_when(request.args["from"]) if request.args.get("from") else None
+        d_to = _parse_when(request.args["to"], end_of_day=True) if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"msg": "from/to inválido (YYYY-MM-DD o ISO 8601)"}), 400
+    cursor = request.args.get("cursor")
+    try:
+        cursor_key = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"msg": "cursor inválido"}), 400
+    statuses = [x.strip() for x in (request.args.get("status") or "").split(",") if x.strip()]
+    expand = {x.strip() for x in (request.args.get("expand") or "").split(",") if x.strip()}
+    if expand - APPOINTMENTS_EXPANDS:
+        return jsonify({"msg": "expand admite: design, artist, client"}), 400
+
     db = get_db()
     try:
-        uid = int(get_jwt_identity())
-        user = db.get(User, uid)
+        user = current_user()
         if not user:
             return jsonify({"msg": "No autorizado"}), 401
 
-        q = (
-            db.query(Appointment)
-              .options(
-                  joinedload(Appointment.design).joinedload(Design.artist),  # 👈 artista del diseño
-                  joinedload(Appointment.artist),
-                  joinedload(Appointment.client),
-              )
-        )
+        opts = [load_only(
+            Appointment.id, Appointment.design_id, Appointment.artist_id, Appointment.client_id,
+            Appointment.start_time, Appointment.end_time, Appointment.status,
+            Appointment.pay_now, Appointment.paid, Appointment.created_at,
+        )]
+        if "design" in expand:
+            opts.append(
+                joinedload(Appointment.design)
+                .load_only(Design.id, Design.title, Design.image_url, Design.description,
+                           Design.artist_id, Design.price)
+                .joinedload(Design.artist).load_only(User.id, User.name)  # 👈 artista del diseño
+            )
+        if "artist" in expand:
+            opts.append(joinedload(Appointment.artist).load_only(User.id, User.name))
+        if "client" in expand:
+            opts.append(joinedload(Appointment.client).load_only(User.id, User.name))
+
+        q = db.query(Appointment).options(*opts)
         if user.role == "client":
             q = q.filter(Appointment.client_id == user.id)
         else:
             q = q.filter(Appointment.artist_id == user.id)
-
-        appts = q.order_by(Appointment.start_time.desc()).all()
+        if d_from:
+            q = q.filter(Appointment.start_time >= d_from)
+        if d_to:
+            q = q.filter(Appointment.start_time < d_to)
+        if statuses:
+            q = q.filter(Appointment.status.in_(statuses))
+        if cursor_key:
+            c_ts, c_id = cursor_key
+            q = q.filter(or_(
+                Appointment.start_time < c_ts,
+                and_(Appointment.start_time == c_ts, Appointment.id < c_id),
+            ))
+
+        appts = q.order_by(Appointment.start_time.desc(), Appointment.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(appts) > limit:
+            appts = appts[:limit]
+            next_cursor = encode_cursor(appts[-1].start_time, appts[-1].id)
 
         base = os.getenv("PUBLIC_BASE_URL", request.host_url.rstrip("/"))
 
         out = []
         for a in appts:
-            d = a.design
-            artist = a.artist
-            client = a.client
-            d_artist = d.artist if d and hasattr(d, "artist") else None
-
-            out.append({
+            item = {
                 "id": a.id,
                 "design_id": a.design_id,
                 "artist_id": a.artist_id,
@@ -1904,29 +4184,39 @@ def my_appointments():
                 "pay_now": a.pay_now,
                 "paid": a.paid,
                 "created_at": a.created_at.isoformat(),
+            }
 
-                # === Enriquecido ===
-                "price": (d.price if d else None),
-                "design": {
+            # === Enriquecido (opt-in) ===
+            if "design" in expand:
+                d = a.design
+                d_artist = d.artist if d else None
+                item["price"] = d.price if d else None
+                item["design"] = {
                     "id": (d.id if d else None),
                     "title": (d.title if d else None),
                     "image_url": (d.image_url if d else None),
-                    "description": (d.description if d else None),          # 👈 NECESARIO
-                    "artist_id": (d.artist_id if d else None),              # 👈 lo usa Detail
-                    "artist_name": (d_artist.name if d_artist else None),   # 👈 nombre legible
+                    "description": (d.description if d else None),
+                    "artist_id": (d.artist_id if d else None),
+                    "artist_name": (d_artist.name if d_artist else None),
                     "artist_avatar_url": (getattr(d_artist, "avatar_url", None) if d_artist else None),
                     "url": (f"{base}/panel/designs/{d.id}" if d else None),
-                },
-                "artist": {
-                    "id": (artist.id if artist else None),
-                    "name": (artist.name if artist else None),
-                },
-                "client": {
-                    "id": (client.id if client else None),
-                    "name": (client.name if client else None),
-                },
-            })
-        return jsonify(out)
+                }
+            if "artist" in expand:
+                item["artist"] = {
+                    "id": (a.artist.id if a.artist else None),
+                    "name": (a.artist.name if a.artist else None),
+                }
+            if "client" in expand:
+                item["client"] = {
+                    "id": (a.client.id if a.client else None),
+                    "name": (a.client.name if a.client else None),
+                }
+            out.append(item)
+
+        resp = jsonify(out)
+        if next_cursor:
+            resp.headers["X-Next-Cursor"] = next_cursor
+        return resp
     finally:
         db.close()
 
@@ -2102,6 +4392,10 @@ def payments_mercadopago():
 def health():
     return jsonify({"status": "ok"})
 
+@app.get("/metrics")
+def metrics_view():
+    return jsonify(metrics.snapshot())
+
 from flask import render_template_string
 from flask import redirect
 
@@ -2118,6 +4412,7 @@ def home():
 
 if __name__ == "__main__":
     init_db()
+    push_dispatcher.start()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
 
 
@@ -0,0 +1,69 @@
+"""
+Perfil de producción:  gunicorn -c gunicorn.conf.py app:app
+
+- Un solo worker con el broker en memoria (BROKER_BACKEND=local): un evento sólo llega a
+  los suscriptores SSE del mismo proceso. Con WEB_CONCURRENCY > 1 y broker local el
+  arranque falla; para escalar a varios workers hay que registrar un broker compartido.
+- Hilos por worker (gthread) = streams SSE + hilos para el resto de la API. Cada stream
+  abierto ocupa un hilo mientras dura pero sólo usa la DB al conectar; SSE_MAX_SUBSCRIBERS
+  se acota a threads - SSE_RESERVED_THREADS para que la API siempre tenga hilos libres.
+- Pool de la DB dimensionado con los hilos que SÍ la usan a la vez: DB_POOL_SIZE = hilos
+  de API, DB_MAX_OVERFLOW = hilos de fondo (push, imágenes, tink) + margen para ráfagas de
+  conexiones SSE. Si en un momento hay más requests de API que conexiones, esperan en el
+  pool (DB_POOL_TIMEOUT) en vez de abrir más. En Postgres: conexiones totales =
+  workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW), tiene que caber en max_connections.
+- En SQLite el motor activa WAL + busy_timeout (ver make_engine en app.py); en Postgres
+  basta con DATABASE_URL=postgresql://...
+"""
+import os
+
+SHARED_BROKER = (os.getenv("BROKER_BACKEND") or "local").lower() != "local"
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "4" if SHARED_BROKER else "1"))
+worker_class = "gthread"
+
+# hilos que atienden la API normal (y por lo tanto pueden tener una conexión tomada)
+SSE_RESERVED_THREADS = int(os.getenv("SSE_RESERVED_THREADS", "32"))
+# ~1000 pestañas con SSE abiertas + los hilos de API
+threads = int(os.getenv("GUNICORN_THREADS", str(1024 + SSE_RESERVED_THREADS)))
+worker_connections = threads + 64
+timeout = 60
+graceful_timeout = 20
+
+# app.py lee SSE_MAX_SUBSCRIBERS y DB_POOL_* al importarse (on_starting), así que se fijan acá
+_sse_cap = max(1, threads - SSE_RESERVED_THREADS)
+os.environ["SSE_MAX_SUBSCRIBERS"] = str(min(int(os.getenv("SSE_MAX_SUBSCRIBERS", _sse_cap)), _sse_cap))
+
+BACKGROUND_THREADS = sum(int(os.getenv(k, d)) for k, d in (
+    ("PUSH_WORKERS", "4"), ("IMAGE_WORKERS", "2"), ("TINK_WORKERS", "4"),
+))
+SSE_CONNECT_HEADROOM = 8  # streams SSE conectándose a la vez (permiso + catch-up)
+os.environ.setdefault("DB_POOL_SIZE", str(SSE_RESERVED_THREADS))
+os.environ.setdefault("DB_MAX_OVERFLOW", str(BACKGROUND_THREADS + SSE_CONNECT_HEADROOM))
+
+
+def on_starting(server):
+    if workers > 1 and not SHARED_BROKER:
+        raise RuntimeError(
+            f"WEB_CONCURRENCY={workers} con BROKER_BACKEND=local: los eventos SSE no cruzan "
+            "entre workers. Usa un solo worker o un broker compartido."
+        )
+    pool = int(os.environ["DB_POOL_SIZE"]) + int(os.environ["DB_MAX_OVERFLOW"])
+    if pool < SSE_RESERVED_THREADS + BACKGROUND_THREADS:
+        server.log.warning(
+            "pool de DB (%s) menor que hilos de API + fondo (%s): habrá requests esperando conexión",
+            pool, SSE_RESERVED_THREADS + BACKGROUND_THREADS,
+        )
+    server.log.info("conexiones a la DB: hasta %s (%s workers x %s)", workers * pool, workers, pool)
+    # migraciones una sola vez, en el master, antes de forkear
+    import app
+    app.init_db()
+    app.engine.dispose()
+
+
+def post_fork(server, worker):
+    # cada worker abre su propio pool; la outbox se reparte con el lease de _claim
+    import app
+    app.engine.dispose(close=False)
+    app.push_dispatcher.start()
@@ -0,0 +1,65 @@
+"""
+Fixtures comunes: el backend se importa contra una DB SQLite y un BLOB_DIR temporales.
+
+    cd backend && python -m pytest -q tests
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="tattoo-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ["UPLOAD_DIR"] = os.path.join(_TMP, "uploads")
+os.environ["BLOB_DIR"] = os.path.join(_TMP, "blobs")
+os.environ["PUSH_WORKERS"] = "0"  # la outbox se drena a mano en los tests (_dispatch_one)
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _BACKEND_DIR)
+sys.path.insert(0, os.path.join(_BACKEND_DIR, "tools"))
+
+import app as backend  # noqa: E402
+from fake_fcm import FakeFcmHandler  # noqa: E402
+
+backend.init_db()
+
+
+@pytest.fixture()
+def client():
+    return backend.app.test_client()
+
+
+@pytest.fixture()
+def login(client):
+    """login(role) -> (user_id, headers) de un usuario nuevo."""
+    def _login(role: str = "client"):
+        email = f"{role}-{uuid.uuid4().hex[:8]}@test.local"
+        client.post("/auth/register", json={"email": email, "password": "secret", "role": role, "name": email})
+        r = client.post("/auth/login", json={"email": email, "password": "secret"})
+        body = r.get_json()
+        return body["user_id"], {"Authorization": f"Bearer {body['access_token']}"}
+    return _login
+
+
+def png_bytes(size=(32, 32), color=(200, 30, 30)) -> bytes:
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture()
+def fake_fcm(monkeypatch):
+    """tools/fake_fcm.py en un puerto libre; los tokens "dead*" responden UNREGISTERED."""
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), FakeFcmHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    monkeypatch.setattr(backend, "FCM_BASE_URL", f"http://127.0.0.1:{srv.server_port}")
+    monkeypatch.setenv("FCM_ACCESS_TOKEN", "fake")
+    monkeypatch.setattr(FakeFcmHandler, "latency", 0.0)
+    FakeFcmHandler.received = 0
+    yield FakeFcmHandler
+    srv.shutdown()
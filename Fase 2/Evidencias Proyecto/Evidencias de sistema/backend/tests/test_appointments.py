@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from conftest import backend
+
+
+def _artist_with_design(client, login):
+    artist_id, artist = login("artist")
+    design_id = client.post("/designs", headers=artist, json={"title": "x", "price": 1}).get_json()["id"]
+    return artist_id, design_id
+
+
+def test_check_accepts_mixed_naive_and_aware_times(client, login):
+    artist_id, design_id = _artist_with_design(client, login)
+    _, me = login()
+    day = (datetime.utcnow() + timedelta(days=40)).replace(hour=15, minute=0, second=0, microsecond=0)
+    r = client.post("/appointments", headers=me, json={
+        "design_id": design_id, "artist_id": artist_id, "start_time": day.isoformat(),
+    })
+    assert r.status_code == 201
+    appt_id = r.get_json()["appointment_id"]
+
+    r = client.post("/appointments/check", headers=me, json={"artist_id": artist_id, "intervals": [
+        {"start_time": day.isoformat() + "Z"},
+        {"start_time": (day + timedelta(minutes=30)).isoformat() + "+00:00"},
+        {"start_time": (day + timedelta(hours=3)).isoformat()},
+    ]})
+    assert r.status_code == 200
+    body = r.get_json()
+    assert [it["ok"] for it in body] == [False, False, True]
+    assert body[0]["start_time"] == day.isoformat()  # normalizado a UTC naive
+    conflict = body[0]["conflicts"][0]
+    assert set(conflict) == {"start_time", "end_time"}
+    assert appt_id not in [v for it in body for c in it["conflicts"] for v in c.values()]
+
+
+def test_aware_start_time_is_stored_as_utc(client, login):
+    artist_id, design_id = _artist_with_design(client, login)
+    _, me = login()
+    r = client.post("/appointments", headers=me, json={
+        "design_id": design_id, "artist_id": artist_id, "start_time": "2031-05-02T12:00:00-03:00",
+    })
+    assert r.status_code == 201
+    db = backend.SessionLocal()
+    try:
+        appt = db.get(backend.Appointment, r.get_json()["appointment_id"])
+        assert appt.start_time == datetime(2031, 5, 2, 15, 0)
+    finally:
+        db.close()
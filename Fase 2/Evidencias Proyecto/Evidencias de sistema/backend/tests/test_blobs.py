@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+from conftest import backend, png_bytes
+
+
+def _age(db, sha, days=2):
+    db.query(backend.Blob).filter(backend.Blob.sha256 == sha).update(
+        {"last_used_at": datetime.utcnow() - timedelta(days=days)}, synchronize_session=False)
+    db.commit()
+
+
+def test_gc_skips_blob_referenced_after_candidate_scan():
+    db = backend.SessionLocal()
+    try:
+        sha, _ = backend.put_blob(png_bytes(color=(9, 9, 9)))
+        _age(db, sha)
+        real_query = db.query
+
+        def query_then_reference(*args):
+            q = real_query(*args)
+            if args and args[0] is backend.Blob:  # justo antes del DELETE condicional
+                backend.adjust_blob_refcount(db, f"/media/{sha}.png", +1)
+            return q
+
+        db.query = query_then_reference
+        try:
+            n, _ = backend.gc_blobs(db, timedelta(days=1))
+        finally:
+            del db.query
+        assert n == 0
+        assert backend.blob_path(sha).exists()
+    finally:
+        db.close()
+
+
+def test_put_blob_rewrites_missing_file_for_existing_row():
+    raw = png_bytes(color=(8, 8, 8))
+    sha, _ = backend.put_blob(raw)
+    backend.blob_path(sha).unlink()  # fila viva, archivo perdido
+    assert backend.put_blob(raw)[0] == sha
+    assert backend.blob_path(sha).read_bytes() == raw
+
+
+def test_gc_removes_unreferenced_old_blob():
+    db = backend.SessionLocal()
+    try:
+        sha, _ = backend.put_blob(png_bytes(color=(7, 7, 7)))
+        _age(db, sha)
+        n, _ = backend.gc_blobs(db, timedelta(days=1))
+        assert n >= 1
+        assert not backend.blob_path(sha).exists()
+        assert db.get(backend.Blob, sha) is None
+    finally:
+        db.close()
+
+
+def test_put_blob_leaves_callers_session_uncommitted():
+    db = backend.SessionLocal()
+    try:
+        uid = db.query(backend.User.id).first()[0]
+        pending = backend.Notification(user_id=uid, type="t", title="pendiente", body="x")
+        db.add(pending)
+        backend.put_blob(png_bytes(color=(6, 6, 6)))
+        assert pending in db.new  # ni flush ni commit sobre la sesión del que llama
+        db.rollback()
+    finally:
+        db.close()
+
+
+def _upload(client, auth, color):
+    r = client.post("/upload/image", data=png_bytes(color=color), headers={**auth, "Content-Type": "image/png"})
+    return r.get_json()["url"]
+
+
+def _refcount(url):
+    db = backend.SessionLocal()
+    try:
+        return db.get(backend.Blob, backend._blob_sha_from_url(url)).refcount
+    finally:
+        db.close()
+
+
+def test_design_cannot_pin_someone_elses_blob(client, login):
+    _, artist = login("artist")
+    _, other = login("artist")
+    theirs = _upload(client, other, (5, 4, 3))
+
+    r = client.post("/designs", json={"title": "ajeno", "image_url": theirs}, headers=artist)
+    assert r.status_code == 400
+    assert _refcount(theirs) == 0
+
+    mine = _upload(client, artist, (5, 4, 2))
+    r = client.post("/designs", json={"title": "propio", "image_url": mine}, headers=artist)
+    assert r.status_code == 201
+    assert _refcount(mine) == 1
+    did = r.get_json()["id"]
+
+    # editar sin cambiar la imagen sigue permitido; cambiarla por una ajena no
+    assert client.put(f"/designs/{did}", json={"title": "x", "image_url": mine}, headers=artist).status_code == 200
+    assert client.put(f"/designs/{did}", json={"image_url": theirs}, headers=artist).status_code == 400
+    assert (_refcount(mine), _refcount(theirs)) == (1, 0)
+
+
+def test_chat_message_cannot_pin_someone_elses_blob(client, login):
+    artist_id, artist = login("artist")
+    _, cli = login("client")
+    _, other = login("client")
+    tid = client.post("/chat/threads/ensure", json={"other_user_id": artist_id}, headers=cli).get_json()["thread_id"]
+    theirs = _upload(client, other, (3, 4, 5))
+
+    r = client.post(f"/chat/threads/{tid}/messages", json={"image_url": theirs}, headers=cli)
+    assert r.status_code == 400
+    assert _refcount(theirs) == 0
+
+    mine = _upload(client, cli, (3, 4, 6))
+    r = client.post(f"/chat/threads/{tid}/messages", json={"image_url": mine}, headers=cli)
+    assert r.status_code in (200, 201)
+    assert _refcount(mine) == 1
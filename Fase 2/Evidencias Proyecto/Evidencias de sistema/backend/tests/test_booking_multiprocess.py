@@ -0,0 +1,44 @@
+"""
+Varios procesos (como los workers de gunicorn) reservan intervalos que se pisan pero
+empiezan a distinta hora: uq_artist_slot no los frena, sólo el chequeo de solapamiento.
+"""
+import multiprocessing as mp
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import backend
+
+WORKERS = 6
+
+
+def _book(barrier, results, auth, body):
+    backend.engine.dispose(close=False)  # cada proceso con sus propias conexiones
+    client = backend.app.test_client()
+    barrier.wait()
+    results.put(client.post("/appointments", headers=auth, json=body).status_code)
+
+
+@pytest.mark.skipif("fork" not in mp.get_all_start_methods(), reason="requiere fork")
+@pytest.mark.parametrize("round_", range(3))
+def test_overlapping_bookings_from_several_processes(client, login, round_):
+    artist_id, artist = login("artist")
+    design_id = client.post("/designs", headers=artist, json={"title": "x", "price": 1}).get_json()["id"]
+    _, me = login()
+    start = (datetime.utcnow() + timedelta(days=60)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+    ctx = mp.get_context("fork")
+    barrier, results = ctx.Barrier(WORKERS), ctx.Queue()
+    procs = [
+        ctx.Process(target=_book, args=(barrier, results, me, {
+            "design_id": design_id, "artist_id": artist_id,
+            "start_time": (start + timedelta(minutes=7 * i)).isoformat(), "duration_minutes": 60,
+        }))
+        for i in range(WORKERS)
+    ]
+    for p in procs:
+        p.start()
+    codes = sorted(results.get(timeout=60) for _ in procs)
+    for p in procs:
+        p.join(timeout=10)
+    assert codes == [201] + [409] * (WORKERS - 1)
@@ -0,0 +1,53 @@
+import threading
+import uuid
+
+from conftest import backend
+
+
+def test_first_bumps_of_a_counter_race_without_integrity_error():
+    name = f"test-{uuid.uuid4().hex[:8]}"
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def bump():
+        db = backend.SessionLocal()
+        try:
+            barrier.wait()
+            backend.bump_counter(db, name)
+            db.commit()
+        except Exception as e:  # IntegrityError si dos INSERT chocan
+            errors.append(e)
+        finally:
+            db.close()
+            backend.SessionLocal.remove()
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db = backend.SessionLocal()
+    try:
+        assert errors == []
+        assert backend.read_counter(db, name)[0] == 4
+    finally:
+        db.close()
+
+
+def test_catalog_cursor_walks_every_design(client, login):
+    artist_id, auth = login("artist")
+    created = {
+        client.post("/designs", headers=auth, json={"title": f"d{i}", "price": 10}).get_json()["id"]
+        for i in range(7)
+    }
+    seen, cursor = [], None
+    while True:
+        params = {"artist_id": artist_id, "limit": 3, **({"cursor": cursor} if cursor else {})}
+        r = client.get("/designs", query_string=params)
+        assert r.status_code == 200
+        seen += [d["id"] for d in r.get_json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen))
+    assert set(seen) == created
@@ -0,0 +1,84 @@
+import threading
+
+from conftest import backend
+
+
+def _counters(design_id, artist_id):
+    db = backend.SessionLocal()
+    try:
+        d = db.get(backend.Design, design_id)
+        a = db.get(backend.User, artist_id)
+        return d.likes_count, a.likes_total
+    finally:
+        db.close()
+
+
+def test_concurrent_unlikes_decrement_once(client, login):
+    artist_id, artist = login("artist")
+    design_id = client.post("/designs", headers=artist, json={"title": "x", "price": 1}).get_json()["id"]
+    _, fan = login()
+    assert client.post(f"/designs/{design_id}/favorite", headers=fan).status_code == 200
+    assert _counters(design_id, artist_id) == (1, 1)
+
+    barrier = threading.Barrier(5)
+
+    def unlike():
+        c = backend.app.test_client()
+        barrier.wait()
+        c.delete(f"/designs/{design_id}/favorite", headers=fan)
+
+    threads = [threading.Thread(target=unlike) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert _counters(design_id, artist_id) == (0, 0)
+
+
+def test_delete_design_subtracts_only_existing_likes(client, login):
+    artist_id, artist = login("artist")
+    keep = client.post("/designs", headers=artist, json={"title": "keep", "price": 1}).get_json()["id"]
+    gone = client.post("/designs", headers=artist, json={"title": "gone", "price": 1}).get_json()["id"]
+    for _ in range(2):
+        _, fan = login()
+        client.post(f"/designs/{keep}/favorite", headers=fan)
+        client.post(f"/designs/{gone}/favorite", headers=fan)
+    assert client.delete(f"/designs/{gone}", headers=artist).status_code == 200
+    assert _counters(keep, artist_id) == (2, 2)
+
+
+def test_concurrent_likes_count_once(client, login):
+    artist_id, artist = login("artist")
+    design_id = client.post("/designs", headers=artist, json={"title": "x", "price": 1}).get_json()["id"]
+    _, fan = login()
+    barrier = threading.Barrier(5)
+    codes = []
+
+    def like():
+        c = backend.app.test_client()
+        barrier.wait()
+        codes.append(c.post(f"/designs/{design_id}/favorite", headers=fan).status_code)
+
+    threads = [threading.Thread(target=like) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert codes == [200] * 5
+    assert _counters(design_id, artist_id) == (1, 1)
+
+
+def test_repeated_like_is_idempotent(client, login):
+    # el favorito ya existe (otro tap ganó): 200 sin volver a contar
+    artist_id, artist = login("artist")
+    design_id = client.post("/designs", headers=artist, json={"title": "x", "price": 1}).get_json()["id"]
+    fan_id, fan = login()
+    db = backend.SessionLocal()
+    try:
+        db.add(backend.Favorite(user_id=fan_id, design_id=design_id))
+        backend.adjust_like_counters(db, design_id, artist_id, +1)
+        db.commit()
+    finally:
+        db.close()
+    assert client.post(f"/designs/{design_id}/favorite", headers=fan).status_code == 200
+    assert _counters(design_id, artist_id) == (1, 1)
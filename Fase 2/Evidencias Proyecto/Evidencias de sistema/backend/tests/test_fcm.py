@@ -0,0 +1,54 @@
+import time
+
+from conftest import backend
+
+
+def _add_tokens(uid, tokens):
+    db = backend.SessionLocal()
+    try:
+        db.add_all([backend.DeviceToken(user_id=uid, token=t) for t in tokens])
+        db.commit()
+    finally:
+        db.close()
+
+
+def _tokens_of(uid):
+    db = backend.SessionLocal()
+    try:
+        return {t for (t,) in db.query(backend.DeviceToken.token).filter_by(user_id=uid)}
+    finally:
+        db.close()
+
+
+def test_v1_fans_out_concurrently(fake_fcm, monkeypatch):
+    monkeypatch.setattr(fake_fcm, "latency", 0.2)
+    tokens = [f"tok-{i}" for i in range(backend.FCM_FANOUT_CONCURRENCY)]
+    t0 = time.monotonic()
+    assert backend._fcm_send(tokens, "t", "b", {"type": "debug", "n": 1}) is True
+    elapsed = time.monotonic() - t0
+    assert fake_fcm.received == len(tokens)
+    # en serie serían len(tokens) * 0.2 s
+    assert elapsed < len(tokens) * 0.2 / 2
+
+
+def test_v1_prunes_unregistered_tokens(login, fake_fcm):
+    uid, _ = login()
+    _add_tokens(uid, [f"dead-a-{uid}", f"dead-b-{uid}", f"live-{uid}"])
+    assert backend._fcm_send(sorted(_tokens_of(uid)), "t", "b") is True
+    assert _tokens_of(uid) == {f"live-{uid}"}
+
+
+def test_legacy_prunes_not_registered_tokens(login, fake_fcm, monkeypatch):
+    monkeypatch.delenv("FCM_ACCESS_TOKEN")
+    monkeypatch.delenv("GOOGLE_APPLICATION_CREDENTIALS", raising=False)
+    monkeypatch.setenv("FCM_SERVER_KEY", "fake")
+    uid, _ = login()
+    _add_tokens(uid, [f"dead-{uid}", f"live-{uid}"])
+    assert backend._fcm_send(sorted(_tokens_of(uid)), "t", "b") is True
+    assert fake_fcm.received == 1  # un solo POST con registration_ids
+    assert _tokens_of(uid) == {f"live-{uid}"}
+
+
+def test_no_tokens_sends_nothing(fake_fcm):
+    assert backend._fcm_send([], "t", "b") is False
+    assert fake_fcm.received == 0
@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+from conftest import backend, png_bytes
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_upload_over_pixel_limit_is_rejected(client, login):
+    _, auth = login()
+    buf = io.BytesIO()
+    side = int(backend.IMAGE_MAX_PIXELS ** 0.5) + 100
+    Image.new("1", (side, side)).save(buf, "PNG")  # pocos KB comprimido
+    r = client.post("/upload/image", data=buf.getvalue(), headers={**auth, "Content-Type": "image/png"})
+    assert r.status_code == 400
+
+
+def test_variants_are_built_at_upload(client, login):
+    _, auth = login()
+    raw = png_bytes(size=(1200, 900), color=(10, 120, 10))
+    url = client.post("/upload/image", data=raw, headers={**auth, "Content-Type": "image/png"}).get_json()["url"]
+    sha = backend.MEDIA_URL_RE.search(url).group(1)
+    fut = backend.image_pipeline.pending(sha)
+    if fut is not None:
+        fut.result(timeout=20)
+    thumb = backend.variant_path(sha, "thumb")
+    assert thumb.exists()
+    with Image.open(thumb) as im:
+        assert max(im.size) == backend.IMAGE_VARIANTS["thumb"]
+
+
+def test_get_never_builds_missing_variant(client, login, monkeypatch):
+    monkeypatch.setattr(backend.image_pipeline, "submit", lambda sha: None)  # sin trabajo en cola
+    sha, _ = backend.put_blob(png_bytes(color=(1, 200, 3)))
+    built = []
+    monkeypatch.setattr(backend.image_pipeline, "_build", built.append)
+    r = client.get(f"/media/thumb/{sha}.{backend.VARIANT_EXT}")
+    assert r.status_code == 307
+    assert r.headers["Location"].endswith(f"/media/{sha}.png")
+    assert built == [] and not backend.variant_path(sha, "thumb").exists()
+
+
+def test_pixel_limit_does_not_change_global_warning_filters(tmp_path):
+    import warnings
+    path = tmp_path / "big.png"
+    side = int(backend.IMAGE_MAX_PIXELS ** 0.5) + 100  # rango en que Pillow sólo avisa
+    Image.new("1", (side, side)).save(path, "PNG")
+    before = list(warnings.filters)
+    with pytest.raises(ValueError):
+        backend.open_image_limited(path)
+    assert warnings.filters == before
+    assert not any(f[0] == "error" and f[2] is Image.DecompressionBombWarning for f in warnings.filters)
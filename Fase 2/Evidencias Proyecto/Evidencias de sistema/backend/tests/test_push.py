@@ -0,0 +1,51 @@
+from conftest import backend
+
+
+def _drain():
+    while backend.push_dispatcher._dispatch_one():
+        backend.SessionLocal.remove()
+    backend.SessionLocal.remove()
+
+
+def test_dispatch_with_dead_token_prunes_it_and_marks_row_sent(login, fake_fcm):
+    uid, _ = login()
+    db = backend.SessionLocal()
+    try:
+        db.add_all([
+            backend.DeviceToken(user_id=uid, token=f"dead-{uid}"),
+            backend.DeviceToken(user_id=uid, token=f"live-{uid}"),
+        ])
+        db.commit()
+        nid = backend.send_notification(db, uid, "debug", "hola", "mundo")
+    finally:
+        db.close()
+        backend.SessionLocal.remove()
+
+    _drain()
+
+    db = backend.SessionLocal()
+    try:
+        row = db.query(backend.PushOutbox).filter_by(notification_id=nid).one()
+        assert row.status == "sent"
+        assert row.attempts == 1
+        tokens = {t for (t,) in db.query(backend.DeviceToken.token).filter_by(user_id=uid)}
+        assert tokens == {f"live-{uid}"}
+    finally:
+        db.close()
+    assert fake_fcm.received == 2  # un envío por token, sin reenvío al vivo
+
+
+def test_dispatcher_starts_once_per_process(client, monkeypatch):
+    d = backend.PushDispatcher(workers=2)
+    started = []
+    monkeypatch.setattr(backend.threading.Thread, "start", lambda t: started.append(t.name))
+    monkeypatch.setattr(backend, "push_dispatcher", d)
+
+    client.get("/")
+    client.get("/")
+    assert started == ["push-worker-0", "push-worker-1"]
+
+    # en un hijo de fork (otro pid) los hilos del padre no existen: se lanzan de nuevo
+    monkeypatch.setattr(backend.os, "getpid", lambda: -1)
+    client.get("/")
+    assert len(started) == 4
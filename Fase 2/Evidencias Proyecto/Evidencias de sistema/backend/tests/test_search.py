@@ -0,0 +1,73 @@
+import uuid
+
+import pytest
+
+from conftest import backend
+
+
+def _tag():
+    return "zq" + uuid.uuid4().hex[:8]
+
+
+def _search(client, q, headers=None):
+    r = client.get("/designs", query_string={"q": q}, headers=headers or {})
+    assert r.status_code == 200
+    return [d["title"] for d in r.get_json()]
+
+
+@pytest.fixture()
+def fts():
+    if not isinstance(backend.search_index, (backend.SqliteFtsIndex, backend.PostgresSearchIndex)):
+        pytest.skip("sin índice full-text en esta DB")
+    return backend.search_index
+
+
+def test_fts_folds_accents_matches_prefixes_and_ranks_title_first(client, login, fts):
+    _, artist = login("artist")
+    tag = _tag()
+    client.post("/designs", json={"title": f"Lobo {tag}", "description": "dragón en la espalda"}, headers=artist)
+    client.post("/designs", json={"title": f"Dragón {tag}", "description": "brazo"}, headers=artist)
+
+    assert _search(client, f"dragon {tag}") == [f"Dragón {tag}", f"Lobo {tag}"]
+    assert _search(client, f"drag {tag[:6]}") == [f"Dragón {tag}", f"Lobo {tag}"]
+
+
+def test_fts_follows_updates_and_deletes(client, login, fts):
+    _, artist = login("artist")
+    tag, new_tag = _tag(), _tag()
+    did = client.post("/designs", json={"title": f"Rosa {tag}"}, headers=artist).get_json()["id"]
+    assert _search(client, tag) == [f"Rosa {tag}"]
+
+    client.put(f"/designs/{did}", json={"title": f"Rosa {new_tag}"}, headers=artist)
+    assert _search(client, tag) == []
+    assert _search(client, new_tag) == [f"Rosa {new_tag}"]
+
+    client.delete(f"/designs/{did}", headers=artist)
+    assert _search(client, new_tag) == []
+
+
+def test_fts_artist_search_only_looks_at_the_artist(client, login, fts):
+    tag = _tag()
+    artist_id, artist = login("artist")
+    db = backend.SessionLocal()
+    try:
+        db.get(backend.User, artist_id).name = f"Ana {tag}"
+        db.commit()
+    finally:
+        db.close()
+    _, other = login("artist")
+    client.post("/designs", json={"title": "Calavera"}, headers=artist)
+    client.post("/designs", json={"title": f"Ancla {tag}"}, headers=other)
+
+    assert _search(client, f"@{tag}") == ["Calavera"]
+
+
+def test_like_fallback_without_index(client, login, monkeypatch):
+    _, artist = login("artist")
+    tag = _tag()
+    client.post("/designs", json={"title": "Golondrina", "description": f"tradicional {tag}"}, headers=artist)
+    monkeypatch.setattr(backend, "search_index", backend.SearchIndex())
+    backend.catalog_cache.clear()
+
+    assert _search(client, tag) == ["Golondrina"]
+    assert _search(client, f"{tag}-nada") == []
@@ -0,0 +1,24 @@
+import pytest
+
+from conftest import backend
+
+
+@pytest.mark.parametrize("text", ["@tink", "  @TINK  ", "@tink ¿?!"])
+def test_empty_tink_prompt_is_rejected_before_queueing(client, login, monkeypatch, text):
+    artist_id, _ = login("artist")
+    _, cli = login("client")
+    tid = client.post("/chat/threads/ensure", json={"other_user_id": artist_id}, headers=cli).get_json()["thread_id"]
+    queued = []
+    monkeypatch.setattr(backend.tink_jobs, "submit", lambda *a: queued.append(a) or True)
+
+    r = client.post(f"/chat/threads/{tid}/messages", json={"text": text}, headers=cli)
+    assert r.status_code == 400
+    assert queued == []
+    assert client.get(f"/chat/threads/{tid}/messages", headers=cli).get_json() == []
+
+
+def test_qwen_reply_skips_cache_for_empty_prompt(monkeypatch):
+    monkeypatch.setenv("QWEN_API_KEY", "fake")
+    monkeypatch.setattr(backend, "_qwen_text_call", lambda *a: pytest.fail("no debe llamar al proveedor"))
+    monkeypatch.setattr(backend.qwen_cache, "get", lambda k: pytest.fail("no debe consultar la cache"))
+    assert "más contexto" in backend.qwen_reply("  ¿?  ")
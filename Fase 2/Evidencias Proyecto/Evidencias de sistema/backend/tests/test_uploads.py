@@ -0,0 +1,58 @@
+import io
+
+import pytest
+
+from conftest import backend, png_bytes
+
+pytest.importorskip("PIL")
+
+
+def test_raw_png_upload_is_served_as_png(client, login):
+    _, auth = login()
+    r = client.post("/upload/image", data=png_bytes(), headers={**auth, "Content-Type": "image/png"})
+    assert r.status_code == 200
+    url = r.get_json()["url"]
+    assert url.endswith(".png")
+    media = client.get(url[url.index("/media/"):])
+    assert media.status_code == 200
+    assert media.mimetype == "image/png"
+    assert media.headers["X-Content-Type-Options"] == "nosniff"
+
+
+def test_extension_comes_from_content_not_filename(client, login):
+    _, auth = login()
+    r = client.post("/upload/image", headers=auth, content_type="multipart/form-data",
+                    data={"file": (io.BytesIO(png_bytes(color=(1, 2, 3))), "x.html")})
+    assert r.status_code == 200
+    assert r.get_json()["url"].endswith(".png")
+
+
+@pytest.mark.parametrize("ctype,body", [
+    ("image/svg+xml", b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'),
+    ("application/octet-stream", b"<html><script>alert(1)</script></html>"),
+])
+def test_non_image_raw_upload_is_rejected(client, login, ctype, body):
+    _, auth = login()
+    r = client.post("/upload/image", data=body, headers={**auth, "Content-Type": ctype})
+    assert r.status_code == 400
+    assert not list((backend.pathlib.Path(backend.BLOB_DIR) / "incoming").glob("*.tmp"))
+
+
+def test_html_multipart_upload_is_rejected(client, login):
+    _, auth = login()
+    r = client.post("/upload/image", headers=auth, content_type="multipart/form-data",
+                    data={"file": (io.BytesIO(b"<script>alert(1)</script>"), "x.html")})
+    assert r.status_code == 400
+
+
+def test_undecodable_image_is_rejected(client, login):
+    _, auth = login()
+    truncated = png_bytes()[:40]  # magic bytes de PNG, pero sin datos válidos
+    r = client.post("/upload/image", data=truncated, headers={**auth, "Content-Type": "image/png"})
+    assert r.status_code == 400
+
+
+def test_media_only_serves_raster_extensions(client):
+    sha = "a" * 64
+    assert client.get(f"/media/{sha}.html").status_code == 404
+    assert client.get(f"/media/{sha}.svg").status_code == 404
@@ -0,0 +1,22 @@
+from conftest import backend
+
+
+def test_profile_edit_invalidates_cached_snapshot(client, login):
+    uid, auth = login()
+    assert client.get("/appointments/me", headers=auth).status_code == 200  # llena el cache
+    assert backend.user_cache.get(uid).name.startswith("client-")
+
+    db = backend.SessionLocal()
+    try:
+        db.get(backend.User, uid).name = "Nuevo nombre"
+        db.commit()
+    finally:
+        db.close()
+    assert backend.user_cache.get(uid) is None
+
+
+def test_counter_updates_keep_cached_snapshot(client, login):
+    uid, auth = login("artist")
+    client.get("/appointments/me", headers=auth)
+    client.post("/designs", headers=auth, json={"title": "x", "price": 1})  # designs_count += 1
+    assert backend.user_cache.get(uid) is not None
@@ -0,0 +1,124 @@
+"""
+Servidor DashScope falso (qwen-plus texto + qwen-image-plus) para probar el bot @tink
+y el cache de qwen_reply sin gastar cuota.
+
+Uso:
+    python tools/fake_dashscope.py serve --port 9098 --latency-ms 800
+    python tools/fake_dashscope.py bench --url http://127.0.0.1:9098 --concurrency 20
+
+En el backend basta con:
+    DASHSCOPE_BASE_URL=http://127.0.0.1:9098 DASHSCOPE_API_KEY=fake
+
+GET /stats devuelve cuántas llamadas llegaron realmente al "proveedor".
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+class FakeDashscopeHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    lock = threading.Lock()
+    text_calls = 0
+    image_calls = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code: int, body: dict):
+        raw = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._reply(200, {
+                "text_calls": FakeDashscopeHandler.text_calls,
+                "image_calls": FakeDashscopeHandler.image_calls,
+            })
+        self._reply(404, {"message": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.latency)
+        messages = (body.get("input") or {}).get("messages") or [{}]
+
+        if self.path.endswith("/text-generation/generation"):
+            with FakeDashscopeHandler.lock:
+                FakeDashscopeHandler.text_calls += 1
+            prompt = messages[-1].get("content") or ""
+            return self._reply(200, {"output": {"choices": [
+                {"message": {"role": "assistant", "content": f"(fake qwen) {prompt}"}}
+            ]}})
+
+        if self.path.endswith("/multimodal-generation/generation"):
+            with FakeDashscopeHandler.lock:
+                FakeDashscopeHandler.image_calls += 1
+                n = FakeDashscopeHandler.image_calls
+            return self._reply(200, {"output": {"choices": [
+                {"message": {"content": [{"image": f"http://127.0.0.1/fake/{n}.png"}]}}
+            ]}})
+
+        self._reply(404, {"message": "not found"})
+
+
+def serve(port: int, latency_ms: float):
+    FakeDashscopeHandler.latency = latency_ms / 1000.0
+    srv = ThreadingHTTPServer(("127.0.0.1", port), FakeDashscopeHandler)
+    print(f"fake DashScope escuchando en http://127.0.0.1:{port} (latencia {latency_ms} ms)")
+    srv.serve_forever()
+
+
+def bench(url: str, concurrency: int, distinct: int):
+    os.environ["DASHSCOPE_BASE_URL"] = url
+    os.environ["DASHSCOPE_API_KEY"] = "fake"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app
+
+    before = requests.get(f"{url}/stats", timeout=5).json()["text_calls"]
+    prompts = [f"@tink ¿Cuánto cuesta un tatuaje pequeño? #{i % distinct}" for i in range(concurrency)]
+    threads = [threading.Thread(target=app.qwen_reply, args=(p,)) for p in prompts]
+    t0 = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cold = time.monotonic() - t0
+
+    t0 = time.monotonic()
+    app.qwen_reply("@TINK cuanto cuesta un tatuaje pequeno #0")
+    warm = time.monotonic() - t0
+
+    upstream = requests.get(f"{url}/stats", timeout=5).json()["text_calls"] - before
+    counters = dict(app.metrics._counters)  # sin gauges: no hace falta DB inicializada
+    print(f"{concurrency} prompts concurrentes ({distinct} distintos): {cold:.2f}s, "
+          f"{upstream} llamadas al proveedor")
+    print(f"repetido (otra redacción): {warm * 1000:.1f} ms")
+    print({k: counters.get(k, 0) for k in ("qwen_cache_hits", "qwen_cache_misses", "qwen_coalesced")})
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("serve")
+    s.add_argument("--port", type=int, default=9098)
+    s.add_argument("--latency-ms", type=float, default=800)
+    b = sub.add_parser("bench")
+    b.add_argument("--url", default="http://127.0.0.1:9098")
+    b.add_argument("--concurrency", type=int, default=20)
+    b.add_argument("--distinct", type=int, default=2)
+    args = ap.parse_args()
+    if args.cmd == "serve":
+        serve(args.port, args.latency_ms)
+    else:
+        bench(args.url, args.concurrency, args.distinct)
@@ -0,0 +1,99 @@
+"""
+Servidor FCM falso (HTTP v1 + legacy) para probar y medir los envíos sin Firebase.
+
+Uso:
+    python tools/fake_fcm.py serve --port 9099 --latency-ms 120
+    python tools/fake_fcm.py bench --tokens 20 --url http://127.0.0.1:9099
+
+Los tokens que empiezan con "dead" responden UNREGISTERED (se deben podar de
+device_tokens). En el backend basta con:
+    FCM_BASE_URL=http://127.0.0.1:9099 FCM_ACCESS_TOKEN=fake
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeFcmHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    lock = threading.Lock()
+    received = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code: int, body: dict):
+        raw = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.latency)
+        with FakeFcmHandler.lock:
+            FakeFcmHandler.received += 1
+
+        if self.path.endswith("/messages:send"):
+            token = (body.get("message") or {}).get("token") or ""
+            if token.startswith("dead"):
+                return self._reply(404, {"error": {
+                    "code": 404, "status": "NOT_FOUND", "message": "Requested entity was not found.",
+                    "details": [{"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError",
+                                 "errorCode": "UNREGISTERED"}],
+                }})
+            return self._reply(200, {"name": f"projects/fake/messages/{FakeFcmHandler.received}"})
+
+        if self.path == "/fcm/send":
+            results = [
+                {"error": "NotRegistered"} if t.startswith("dead") else {"message_id": str(i)}
+                for i, t in enumerate(body.get("registration_ids") or [])
+            ]
+            return self._reply(200, {"results": results})
+
+        self._reply(404, {"error": {"message": "not found"}})
+
+
+def serve(port: int, latency_ms: float):
+    FakeFcmHandler.latency = latency_ms / 1000.0
+    srv = ThreadingHTTPServer(("127.0.0.1", port), FakeFcmHandler)
+    print(f"fake FCM escuchando en http://127.0.0.1:{port} (latencia {latency_ms} ms)")
+    srv.serve_forever()
+
+
+def bench(url: str, n_tokens: int, rounds: int):
+    os.environ["FCM_BASE_URL"] = url
+    os.environ["FCM_ACCESS_TOKEN"] = "fake"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app
+
+    tokens = [f"tok{i}" for i in range(n_tokens)]
+    t0 = time.monotonic()
+    for _ in range(rounds):
+        app._fcm_send(tokens, "bench", "bench", {"type": "debug"})
+    dt = time.monotonic() - t0
+    print(f"{rounds} rondas x {n_tokens} tokens: {dt:.2f}s ({dt / rounds * 1000:.0f} ms/ronda)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("serve")
+    s.add_argument("--port", type=int, default=9099)
+    s.add_argument("--latency-ms", type=float, default=100)
+    b = sub.add_parser("bench")
+    b.add_argument("--url", default="http://127.0.0.1:9099")
+    b.add_argument("--tokens", type=int, default=10)
+    b.add_argument("--rounds", type=int, default=5)
+    args = ap.parse_args()
+    if args.cmd == "serve":
+        serve(args.port, args.latency_ms)
+    else:
+        bench(args.url, args.tokens, args.rounds)
@@ -0,0 +1,98 @@
+"""
+Carga concurrente sobre la reserva: N clientes intentan tomar el MISMO horario a la vez.
+
+Uso (con el backend corriendo):
+    python tools/loadtest_booking.py --url http://127.0.0.1:8000 --clients 50
+    python tools/loadtest_booking.py --mode time --clients 50   # POST /appointments
+
+Crea un artista, un diseño, un slot y N clientes (emails aleatorios), dispara las N
+reservas juntas (threading.Barrier) y cuenta los códigos HTTP. Lo correcto es
+exactamente un 201 y el resto 409; cualquier 5xx o más de un 201 es una carrera.
+"""
+import argparse
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+import requests
+
+
+def register_and_login(url: str, email: str, role: str) -> tuple[int, dict]:
+    requests.post(f"{url}/auth/register", json={
+        "email": email, "password": "loadtest", "role": role, "name": email.split("@")[0],
+    }, timeout=10)
+    r = requests.post(f"{url}/auth/login", json={"email": email, "password": "loadtest"}, timeout=10)
+    r.raise_for_status()
+    body = r.json()
+    return body["user_id"], {"Authorization": f"Bearer {body['access_token']}"}
+
+
+def setup(url: str, n_clients: int):
+    run = uuid.uuid4().hex[:8]
+    artist_id, artist = register_and_login(url, f"lt-artist-{run}@test.local", "artist")
+
+    r = requests.post(f"{url}/designs", headers=artist, timeout=10, json={
+        "title": f"loadtest {run}", "price": 1000, "image_url": "http://example.invalid/x.png",
+    })
+    r.raise_for_status()
+    design_id = r.json()["id"]
+
+    day = (datetime.utcnow() + timedelta(days=30)).date().isoformat()
+    requests.post(f"{url}/artist/slots/generate", headers=artist, timeout=10, json={
+        "from_date": day, "to_date": day, "start_hour": 10, "end_hour": 11,
+    }).raise_for_status()
+    slots = requests.get(f"{url}/artists/{artist_id}/slots", params={"date": day}, timeout=10).json()
+    slot = slots[0]
+
+    clients = [register_and_login(url, f"lt-client-{run}-{i}@test.local", "client")[1] for i in range(n_clients)]
+    return artist_id, design_id, slot, clients
+
+
+def fire(url: str, mode: str, artist_id: int, design_id: int, slot: dict, clients: list):
+    barrier = threading.Barrier(len(clients))
+    results = [None] * len(clients)
+
+    def worker(i, headers):
+        if mode == "slot":
+            path, body = "/appointments/from_slot", {"design_id": design_id, "slot_id": slot["id"]}
+        else:
+            path, body = "/appointments", {
+                "design_id": design_id, "artist_id": artist_id, "start_time": slot["start_time"],
+            }
+        barrier.wait()
+        t0 = time.monotonic()
+        try:
+            r = requests.post(f"{url}{path}", json=body, headers=headers, timeout=30)
+            results[i] = (r.status_code, time.monotonic() - t0)
+        except requests.RequestException:
+            results[i] = ("error", time.monotonic() - t0)
+
+    threads = [threading.Thread(target=worker, args=(i, h)) for i, h in enumerate(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--clients", type=int, default=30)
+    ap.add_argument("--mode", choices=["slot", "time"], default="slot")
+    args = ap.parse_args()
+
+    artist_id, design_id, slot, clients = setup(args.url, args.clients)
+    results = fire(args.url, args.mode, artist_id, design_id, slot, clients)
+
+    codes = Counter(code for code, _ in results)
+    lat = sorted(dt for _, dt in results)
+    print(f"{args.clients} reservas simultáneas ({args.mode}) -> {dict(codes)}")
+    print(f"latencia p50={lat[len(lat) // 2] * 1000:.0f} ms  max={lat[-1] * 1000:.0f} ms")
+
+    ok = codes.get(201, 0) == 1 and set(codes) <= {201, 409}
+    print("OK: una sola reserva ganó" if ok else "FALLA: carrera detectada")
+    sys.exit(0 if ok else 1)